@@ -0,0 +1,348 @@
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import AIRequestSlot
+
+SYSTEM_PROMPT = (
+    "Vous êtes un assistant médical spécialisé en obstétrique pour les sages-femmes. "
+    "Vos réponses sont basées sur les recommandations médicales actuelles et la littérature scientifique. "
+    "Soyez précis, concis et professionnel. Rappelez toujours que vos conseils ne remplacent pas "
+    "le jugement clinique d'un professionnel de santé."
+)
+
+# Seconds to wait for the provider to start answering
+REQUEST_TIMEOUT = 60
+
+# Seconds after which a request slot is taken back, in case the worker
+# holding it died before releasing it
+SLOT_TIMEOUT = 600
+
+
+class ProviderError(Exception):
+    """Raised when a provider cannot produce an answer."""
+
+
+class Provider:
+    """
+    Base class for AI providers.
+
+    Subclasses implement stream(), which yields the answer as text chunks in
+    the order the provider produces them.
+    """
+    name = None
+    env_key = None
+    # Only offered when the app runs in debug or testing mode
+    debug_only = False
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+
+    @classmethod
+    def from_request(cls, client_key=None):
+        """
+        Build a provider, preferring the server-side key over the client's.
+
+        Args:
+            client_key (str, optional): API key configured in the browser
+
+        Returns:
+            Provider: Configured provider
+        """
+        api_key = os.environ.get(cls.env_key) if cls.env_key else None
+        return cls(api_key or client_key)
+
+    def stream(self, prompt):
+        raise NotImplementedError
+
+    def _post_sse(self, url, payload, headers=None):
+        # Les fournisseurs renvoient des Server-Sent Events : une ligne "data:" par fragment
+        request_headers = {'Content-Type': 'application/json', 'Accept': 'text/event-stream'}
+        request_headers.update(headers or {})
+        req = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                     headers=request_headers, method='POST')
+        try:
+            response = urllib.request.urlopen(req, timeout=REQUEST_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            raise ProviderError(f"{self.name}: HTTP {e.code}") from e
+        except urllib.error.URLError as e:
+            raise ProviderError(f"{self.name}: {e.reason}") from e
+        except OSError as e:
+            raise ProviderError(f"{self.name}: {e}") from e
+
+        with response:
+            try:
+                for raw_line in response:
+                    line = raw_line.decode('utf-8').strip()
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        break
+                    yield json.loads(data)
+            except ValueError as e:
+                raise ProviderError(f"{self.name}: réponse invalide") from e
+            except OSError as e:
+                # Délai dépassé ou connexion coupée en cours de réponse
+                raise ProviderError(f"{self.name}: connexion interrompue ({e})") from e
+
+
+class OpenAIProvider(Provider):
+    name = 'openai'
+    env_key = 'OPENAI_API_KEY'
+    url = 'https://api.openai.com/v1/chat/completions'
+    model = 'gpt-4'
+
+    def stream(self, prompt):
+        if not self.api_key:
+            raise ProviderError("Clé API non configurée")
+        payload = {
+            'model': self.model,
+            'messages': [
+                {'role': 'system', 'content': SYSTEM_PROMPT},
+                {'role': 'user', 'content': prompt}
+            ],
+            'temperature': 0.7,
+            'stream': True
+        }
+        headers = {'Authorization': f"Bearer {self.api_key}"}
+        for event in self._post_sse(self.url, payload, headers):
+            choices = event.get('choices') or [{}]
+            token = choices[0].get('delta', {}).get('content')
+            if token:
+                yield token
+
+
+class DeepSeekProvider(OpenAIProvider):
+    # DeepSeek expose une API compatible avec OpenAI
+    name = 'deepseek'
+    env_key = 'DEEPSEEK_API_KEY'
+    url = 'https://api.deepseek.com/v1/chat/completions'
+    model = 'deepseek-chat'
+
+
+class GeminiProvider(Provider):
+    name = 'gemini'
+    env_key = 'GEMINI_API_KEY'
+    url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:streamGenerateContent?alt=sse&key={key}'
+
+    def stream(self, prompt):
+        if not self.api_key:
+            raise ProviderError("Clé API non configurée")
+        payload = {
+            'contents': [{'parts': [{'text': f"{SYSTEM_PROMPT} Voici la question: {prompt}"}]}],
+            'generationConfig': {'temperature': 0.7}
+        }
+        for event in self._post_sse(self.url.format(key=self.api_key), payload):
+            for candidate in event.get('candidates', []):
+                for part in candidate.get('content', {}).get('parts', []):
+                    if part.get('text'):
+                        yield part['text']
+
+
+class StubProvider(Provider):
+    """Local provider echoing a fixed answer word by word, for tests and development."""
+    name = 'stub'
+    debug_only = True
+
+    def stream(self, prompt):
+        answer = f"Réponse de démonstration pour : {prompt}"
+        for i, word in enumerate(answer.split(' ')):
+            yield word if i == 0 else ' ' + word
+
+
+PROVIDERS = {}
+
+
+def register_provider(provider_class):
+    """
+    Make a provider available to the proxy endpoint.
+
+    Args:
+        provider_class (type): Provider subclass with a unique name
+    """
+    PROVIDERS[provider_class.name] = provider_class
+    return provider_class
+
+
+for _provider_class in (OpenAIProvider, GeminiProvider, DeepSeekProvider, StubProvider):
+    register_provider(_provider_class)
+
+
+def find_provider(name, debug=False):
+    """
+    Get the provider class a client asked for.
+
+    Args:
+        name (str): Provider name sent by the client
+        debug (bool): Whether the app runs in debug or testing mode
+
+    Returns:
+        type: Provider subclass, or None if unknown or not offered
+    """
+    provider_class = PROVIDERS.get(name)
+    if provider_class is None or (provider_class.debug_only and not debug):
+        return None
+    return provider_class
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a fixed number of seconds.
+    """
+
+    def __init__(self, maxsize=256, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+answer_cache = TTLCache(
+    maxsize=int(os.environ.get('AI_CACHE_SIZE', 256)),
+    ttl=int(os.environ.get('AI_CACHE_TTL', 6 * 3600))
+)
+
+
+def normalize_question(prompt):
+    """
+    Normalize a question so trivially different phrasings share a cache entry.
+
+    Args:
+        prompt (str): Question as typed or templated by the client
+
+    Returns:
+        str: Lowercased question with collapsed whitespace and no trailing punctuation
+    """
+    text = re.sub(r'\s+', ' ', prompt.casefold()).strip()
+    return text.rstrip(' ?!.')
+
+
+class ConcurrencyLimiter:
+    """
+    Limit the number of simultaneous AI requests each user can have open.
+
+    The count is shared by every worker process: an open request holds one
+    of its user's numbered slots, a row of AIRequestSlot whose primary key
+    makes two requests unable to take the same slot.
+    """
+
+    def __init__(self, max_per_user=2, timeout=SLOT_TIMEOUT):
+        self.max_per_user = max_per_user
+        self.timeout = timeout
+
+    def acquire(self, user_id):
+        """
+        Take a free slot of the user.
+
+        Args:
+            user_id (int): User opening a request
+
+        Returns:
+            tuple: Slot to give back to release(), or None if all are taken
+        """
+        engine = db.engines[AIRequestSlot.__bind_key__]
+        table = AIRequestSlot.__table__
+        now = datetime.utcnow()
+        with engine.begin() as connection:
+            connection.execute(delete(table).where(
+                table.c.user_id == user_id, table.c.started_at < now - timedelta(seconds=self.timeout)))
+        for slot in range(self.max_per_user):
+            try:
+                with engine.begin() as connection:
+                    connection.execute(insert(table).values(user_id=user_id, slot=slot, started_at=now))
+            except IntegrityError:
+                continue
+            return engine, user_id, slot, now
+        return None
+
+    def release(self, held):
+        """
+        Give a slot back; callable once the request context is gone.
+
+        Args:
+            held (tuple): Slot returned by acquire()
+        """
+        engine, user_id, slot, started_at = held
+        table = AIRequestSlot.__table__
+        with engine.begin() as connection:
+            # Unless it timed out and was taken by another request since
+            connection.execute(delete(table).where(
+                table.c.user_id == user_id, table.c.slot == slot, table.c.started_at == started_at))
+
+
+limiter = ConcurrencyLimiter(int(os.environ.get('AI_MAX_CONCURRENT_PER_USER', 2)))
+
+
+def _event(payload):
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def stream_answer(provider, prompt, user_id):
+    """
+    Relay an answer as Server-Sent Events, serving a user's repeated
+    questions from cache.
+
+    Args:
+        provider (Provider): Provider answering the question
+        prompt (str): Full prompt
+        user_id (int): User asking; answers are only reused for the same user
+
+    Yields:
+        str: SSE events carrying tokens, then a final done or error event
+    """
+    key = (user_id, provider.name, normalize_question(prompt))
+    cached = answer_cache.get(key)
+    if cached is not None:
+        yield _event({'token': cached})
+        yield _event({'done': True, 'cached': True})
+        return
+
+    chunks = []
+    try:
+        try:
+            for token in provider.stream(prompt):
+                chunks.append(token)
+                yield _event({'token': token})
+        except (ValueError, OSError) as e:
+            # Providers reading their answer without _post_sse
+            raise ProviderError(f"{provider.name}: réponse interrompue ({e})") from e
+    except ProviderError as e:
+        yield _event({'error': str(e)})
+        return
+
+    answer_cache.set(key, ''.join(chunks))
+    yield _event({'done': True, 'cached': False})
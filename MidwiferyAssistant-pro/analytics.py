@@ -0,0 +1,497 @@
+from datetime import date, datetime, time
+
+from sqlalchemy import and_, case, event, exists, func, inspect, literal, or_, select, union, bindparam
+from sqlalchemy.orm import Session
+
+from app import db
+from jobs import register_task
+from models import (Patient, BloodPressureRecord, BloodPressureMilestone, BiomedicalRecord, DeliveryRecord,
+                    BabyRecord, DailyClinicalStat, ClinicalStatDirtyDay, VitalsBlock, get_owner_id,
+                    get_previous_owner_id)
+from vitals_archive import SERIES as VITALS_SERIES, decode_block
+
+# Hemoglobin (g/dL) below which a pregnant woman is anemic (WHO)
+ANEMIA_HEMOGLOBIN = 11.0
+
+# Gestational hypertension thresholds (mmHg)
+HYPERTENSION_SYSTOLIC = 140
+HYPERTENSION_DIASTOLIC = 90
+
+# Days of amenorrhea at which the 2nd and 3rd trimesters start (14 and 28 weeks)
+TRIMESTER_START_DAYS = (98, 196)
+
+# Blood loss (mL) defining a postpartum hemorrhage
+PPH_VAGINAL_ML = 500
+PPH_CESAREAN_ML = 1000
+
+# Apgar scores below this value are reported as low
+LOW_APGAR = 7
+
+# Model -> column giving the day a record is counted on. Blood pressure
+# readings are counted through their milestones instead.
+SOURCES = {
+    BiomedicalRecord: 'recorded_at',
+    DeliveryRecord: 'delivery_date',
+    BabyRecord: 'birth_date',
+}
+
+ROLLUP_COLUMNS = ['user_id', 'metric', 'day', 'bucket', 'numerator', 'denominator']
+
+_stats = DailyClinicalStat.__table__
+_dirty = ClinicalStatDirtyDay.__table__
+_milestones = BloodPressureMilestone.__table__
+
+HYPERTENSIVE = 'hypertensive'
+
+# Reading columns a milestone depends on
+MILESTONE_COLUMNS = ('patient_id', 'user_id', 'recorded_at', 'systolic', 'diastolic')
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value.date() if hasattr(value, 'date') else value
+
+
+def _day_number(day):
+    # Numeric day, so window frames can be expressed in days
+    if db.engine.dialect.name == 'sqlite':
+        return func.julianday(day)
+    return func.extract('epoch', day) / 86400
+
+
+def _on_dirty_day(user_column, day, user_id):
+    return and_(_dirty.c.user_id == user_column, _dirty.c.day == day, _dirty.c.user_id == user_id)
+
+
+def _anemia_rollup(user_id):
+    day = func.date(BiomedicalRecord.recorded_at)
+    return select(
+        Patient.user_id, literal('anemia'), day, literal(0),
+        func.sum(case((BiomedicalRecord.hemoglobin < ANEMIA_HEMOGLOBIN, 1), else_=0)),
+        func.count()
+    ).select_from(BiomedicalRecord).join(Patient, Patient.id == BiomedicalRecord.patient_id).join(
+        _dirty, _on_dirty_day(Patient.user_id, day, user_id)
+    ).where(BiomedicalRecord.hemoglobin.isnot(None)).group_by(Patient.user_id, day)
+
+
+def _hypertension_rollup(user_id):
+    # Incidence: a patient counts as a new case on the day of her first
+    # hypertensive reading, and in a trimester's denominator on the day of
+    # her first reading in that trimester. Those first readings are kept as
+    # milestones, which stay when the readings are archived.
+    hypertensive = _milestones.c.kind == HYPERTENSIVE
+    return select(
+        _milestones.c.user_id, literal('hypertension'), _milestones.c.day, _milestones.c.trimester,
+        func.sum(case((hypertensive, 1), else_=0)),
+        func.sum(case((hypertensive, 0), else_=1))
+    ).join(_dirty, _on_dirty_day(_milestones.c.user_id, _milestones.c.day, user_id)).group_by(
+        _milestones.c.user_id, _milestones.c.day, _milestones.c.trimester)
+
+
+def _is_cesarean():
+    return DeliveryRecord.delivery_type.like('cesarean%')
+
+
+def _cesarean_rollup(user_id):
+    day = func.date(DeliveryRecord.delivery_date)
+    return select(
+        DeliveryRecord.user_id, literal('cesarean'), day, literal(0),
+        func.sum(case((_is_cesarean(), 1), else_=0)),
+        func.count()
+    ).join(_dirty, _on_dirty_day(DeliveryRecord.user_id, day, user_id)).group_by(DeliveryRecord.user_id, day)
+
+
+def _hemorrhage_rollup(user_id):
+    day = func.date(DeliveryRecord.delivery_date)
+    hemorrhage = or_(and_(_is_cesarean(), DeliveryRecord.blood_loss >= PPH_CESAREAN_ML),
+                     and_(~_is_cesarean(), DeliveryRecord.blood_loss >= PPH_VAGINAL_ML))
+    return select(
+        DeliveryRecord.user_id, literal('postpartum_hemorrhage'), day, literal(0),
+        func.sum(case((hemorrhage, 1), else_=0)),
+        func.count()
+    ).join(_dirty, _on_dirty_day(DeliveryRecord.user_id, day, user_id)).where(
+        DeliveryRecord.blood_loss.isnot(None)).group_by(DeliveryRecord.user_id, day)
+
+
+def _apgar_rollup(column_name):
+    def build(user_id):
+        day = func.date(BabyRecord.birth_date)
+        score = getattr(BabyRecord, column_name)
+        return select(
+            Patient.user_id, literal(column_name), day, score, func.count(), func.count()
+        ).select_from(BabyRecord).join(Patient, Patient.id == BabyRecord.mother_id).join(
+            _dirty, _on_dirty_day(Patient.user_id, day, user_id)
+        ).where(score.isnot(None)).group_by(Patient.user_id, day, score)
+    return build
+
+
+# metric -> builder of the SELECT recomputing its rows for a user's dirty days
+ROLLUPS = {
+    'anemia': _anemia_rollup,
+    'hypertension': _hypertension_rollup,
+    'cesarean': _cesarean_rollup,
+    'postpartum_hemorrhage': _hemorrhage_rollup,
+    'apgar_1min': _apgar_rollup('apgar_1min'),
+    'apgar_5min': _apgar_rollup('apgar_5min'),
+}
+
+
+def _trimester(recorded_at, last_period_date):
+    # None for a reading without date or LMP, or taken before the LMP
+    if recorded_at is None or last_period_date is None:
+        return None
+    gestational_days = (recorded_at - datetime.combine(last_period_date, time.min)).total_seconds() / 86400
+    if gestational_days < 0:
+        return None
+    if gestational_days < TRIMESTER_START_DAYS[0]:
+        return 1
+    return 2 if gestational_days < TRIMESTER_START_DAYS[1] else 3
+
+
+def _reading_milestones(reading, last_period_date):
+    # Milestone rows a reading would be, were it the earliest of their kind
+    trimester = _trimester(reading['recorded_at'], last_period_date)
+    if trimester is None:
+        return {}
+    row = {'patient_id': reading['patient_id'], 'reading_id': reading['id'], 'recorded_at': reading['recorded_at'],
+           'day': reading['recorded_at'].date(), 'trimester': trimester, 'user_id': reading['user_id']}
+    kinds = [f'trimester_{trimester}']
+    if reading['systolic'] >= HYPERTENSION_SYSTOLIC or reading['diastolic'] >= HYPERTENSION_DIASTOLIC:
+        kinds.append(HYPERTENSIVE)
+    return {kind: dict(row, kind=kind) for kind in kinds}
+
+
+def _last_period_date(connection, patient_id):
+    return _as_date(connection.execute(select(Patient.last_period_date).where(Patient.id == patient_id)).scalar())
+
+
+def _stored_milestones(connection, patient_id):
+    return {row['kind']: dict(row) for row in connection.execute(
+        select(_milestones).where(_milestones.c.patient_id == patient_id)).mappings()}
+
+
+def _patient_readings(connection, patient_id):
+    # Full history: rows still in the table and readings archived in blocks
+    table = BloodPressureRecord.__table__
+    readings = {row['id']: dict(row) for row in connection.execute(
+        select(table.c.id, *[table.c[column] for column in MILESTONE_COLUMNS]).where(
+            table.c.patient_id == patient_id, table.c.recorded_at.isnot(None))).mappings()}
+    blocks = connection.execute(select(VitalsBlock.data).where(
+        VitalsBlock.patient_id == patient_id, VitalsBlock.series == 'blood_pressure')).scalars()
+    for data in blocks:
+        for reading in decode_block(VITALS_SERIES['blood_pressure'], data):
+            readings.setdefault(reading['id'], reading)
+    return sorted(readings.values(), key=lambda reading: (reading['recorded_at'], reading['id']))
+
+
+def _write_milestones(connection, patient_id, stored, milestones):
+    # Replace the milestones that changed; the days they leave and reach
+    # are the only ones whose hypertension rollups change
+    changed = [kind for kind in set(stored) | set(milestones) if stored.get(kind) != milestones.get(kind)]
+    if not changed:
+        return set()
+    connection.execute(_milestones.delete().where(_milestones.c.patient_id == patient_id,
+                                                  _milestones.c.kind.in_(changed)))
+    rows = [milestones[kind] for kind in changed if kind in milestones]
+    if rows:
+        connection.execute(_milestones.insert(), rows)
+    return {(row['user_id'], row['day']) for kind in changed
+            for row in (stored.get(kind), milestones.get(kind)) if row is not None}
+
+
+def refresh_milestones(connection, patient_id):
+    """
+    Recompute a patient's blood pressure milestones from her full history,
+    archived readings included.
+
+    Args:
+        connection (Connection): Connection of the current transaction
+        patient_id (int): Patient, possibly deleted
+
+    Returns:
+        set: (user_id, day) pairs whose hypertension rollups changed
+    """
+    last_period_date = _last_period_date(connection, patient_id)
+    milestones = {}
+    for reading in _patient_readings(connection, patient_id):
+        for kind, row in _reading_milestones(reading, last_period_date).items():
+            milestones.setdefault(kind, row)
+    return _write_milestones(connection, patient_id, _stored_milestones(connection, patient_id), milestones)
+
+
+def _add_reading(connection, record):
+    # A new reading only replaces the milestones it comes before
+    reading = {'id': record.id, **{column: getattr(record, column) for column in MILESTONE_COLUMNS}}
+    candidates = _reading_milestones(reading, _last_period_date(connection, record.patient_id))
+    if not candidates:
+        return set()
+    stored = _stored_milestones(connection, record.patient_id)
+    milestones = dict(stored)
+    for kind, row in candidates.items():
+        current = stored.get(kind)
+        if current is None or (row['recorded_at'], row['reading_id']) < (current['recorded_at'], current['reading_id']):
+            milestones[kind] = row
+    return _write_milestones(connection, record.patient_id, stored, milestones)
+
+
+def rebuild_milestones(user_id=None):
+    """
+    Recompute the blood pressure milestones of every patient with readings.
+
+    Args:
+        user_id (int, optional): Only the patients of this midwife
+    """
+    patients = [
+        select(BloodPressureRecord.patient_id).where(BloodPressureRecord.recorded_at.isnot(None)),
+        select(VitalsBlock.patient_id).where(VitalsBlock.series == 'blood_pressure'),
+        select(_milestones.c.patient_id),
+    ]
+    if user_id is not None:
+        owned = select(Patient.id).where(Patient.user_id == user_id)
+        patients = [
+            patients[0].where(BloodPressureRecord.user_id == user_id),
+            patients[1].where(VitalsBlock.patient_id.in_(owned)),
+            patients[2].where(_milestones.c.user_id == user_id),
+        ]
+    connection = db.session.connection()
+    for patient_id in connection.execute(union(*patients)).scalars().all():
+        refresh_milestones(connection, patient_id)
+
+
+def _changed_values(record, column):
+    attribute = inspect(record).attrs[column]
+    return {value for value in [attribute.value] + list(attribute.history.deleted) if value is not None}
+
+
+def _changed_days(record, column):
+    return {_as_date(value) for value in _changed_values(record, column)}
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_dirty_days(session, flush_context):
+    # Written in the flush transaction: the markers commit or roll back with the data
+    connection = None
+    pairs = set()
+    refreshed = set()
+    for record in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(record, Patient):
+            # A new LMP moves every reading of the patient to another trimester
+            state = inspect(record)
+            if record in session.new or (record not in session.deleted
+                                         and not state.attrs.last_period_date.history.deleted):
+                continue
+            connection = connection or session.connection()
+            refreshed.add(record.id)
+            continue
+        if isinstance(record, BloodPressureRecord):
+            connection = connection or session.connection()
+            if record in session.new:
+                pairs |= _add_reading(connection, record)
+            elif record in session.deleted or any(
+                    inspect(record).attrs[column].history.has_changes() for column in MILESTONE_COLUMNS):
+                # The milestones may move to any other reading of the patient
+                refreshed |= _changed_values(record, 'patient_id')
+            continue
+        if type(record) not in SOURCES:
+            continue
+        connection = connection or session.connection()
+        days = _changed_days(record, SOURCES[type(record)])
+        owners = {get_owner_id(connection, record), get_previous_owner_id(connection, record)} - {None}
+        pairs.update((user_id, day) for user_id in owners for day in days)
+
+    for patient_id in refreshed:
+        pairs |= refresh_milestones(connection, patient_id)
+
+    if pairs:
+        rows = [{'marked_user': user_id, 'marked_day': day} for user_id, day in pairs]
+        connection.execute(_dirty.delete().where(_dirty.c.user_id == bindparam('marked_user'),
+                                                 _dirty.c.day == bindparam('marked_day')), rows)
+        connection.execute(_dirty.insert(), [{'user_id': user_id, 'day': day} for user_id, day in pairs])
+
+
+def refresh_rollups(user_id, progress=None):
+    """
+    Recompute the daily rollups of a midwife's days changed since the last read.
+
+    Every metric is recomputed for all dirty days at once with one
+    INSERT ... SELECT, then the dirty markers are cleared. Must run inside
+    a unit of work, which commits the new rollups.
+
+    Args:
+        user_id (int): Midwife whose rollups are refreshed
+        progress (callable, optional): Called with (done, total, metric) after each metric
+    """
+    session = db.session
+    if not session.execute(select(exists().where(_dirty.c.user_id == user_id))).scalar():
+        return
+
+    session.execute(_stats.delete().where(
+        _stats.c.user_id == user_id,
+        exists().where(_dirty.c.user_id == _stats.c.user_id, _dirty.c.day == _stats.c.day)
+    ))
+    for done, (metric, build) in enumerate(ROLLUPS.items(), 1):
+        session.execute(_stats.insert().from_select(ROLLUP_COLUMNS, build(user_id)))
+        if progress:
+            progress(done, len(ROLLUPS), metric)
+    session.execute(_dirty.delete().where(_dirty.c.user_id == user_id))
+
+
+def _clinical_days(user_id=None):
+    # Every (midwife, day) with at least one record counted by a rollup
+    queries = [
+        select(_milestones.c.user_id, _milestones.c.day),
+        select(Patient.user_id, func.date(BiomedicalRecord.recorded_at)).join(
+            Patient, Patient.id == BiomedicalRecord.patient_id).where(BiomedicalRecord.recorded_at.isnot(None)),
+        select(DeliveryRecord.user_id, func.date(DeliveryRecord.delivery_date)),
+        select(Patient.user_id, func.date(BabyRecord.birth_date)).join(Patient, Patient.id == BabyRecord.mother_id)
+    ]
+    if user_id is not None:
+        owners = (_milestones.c.user_id, Patient.user_id, DeliveryRecord.user_id, Patient.user_id)
+        queries = [query.where(owner == user_id) for query, owner in zip(queries, owners)]
+    return union(*queries)
+
+
+def rebuild_rollups(user_id, progress=None):
+    """
+    Recompute all of a midwife's rollups, e.g. after changing a threshold.
+
+    Must run inside a unit of work, which commits the new rollups.
+
+    Args:
+        user_id (int): Midwife whose rollups are rebuilt
+        progress (callable, optional): Called with (done, total, metric) after each metric
+    """
+    rebuild_milestones(user_id)
+    db.session.execute(_dirty.delete().where(_dirty.c.user_id == user_id))
+    db.session.execute(_dirty.insert().from_select(['user_id', 'day'], _clinical_days(user_id)))
+    db.session.execute(_stats.delete().where(_stats.c.user_id == user_id))
+    refresh_rollups(user_id, progress)
+
+
+def init_analytics():
+    """
+    Mark every day with clinical data dirty when the rollups were never
+    built, or were built before the blood pressure milestones existed.
+
+    Must be called inside an application context; the rollups themselves
+    are computed lazily on the first read.
+    """
+    built = db.session.execute(select(exists().select_from(_stats))).scalar() or \
+        db.session.execute(select(exists().select_from(_dirty))).scalar()
+    missing_milestones = not db.session.execute(select(exists().select_from(_milestones))).scalar() and (
+        db.session.execute(select(exists().select_from(BloodPressureRecord))).scalar() or
+        db.session.execute(select(exists().where(VitalsBlock.series == 'blood_pressure'))).scalar())
+    if built and not missing_milestones:
+        return
+
+    if missing_milestones:
+        rebuild_milestones()
+    db.session.execute(_dirty.delete())
+    db.session.execute(_dirty.insert().from_select(['user_id', 'day'], _clinical_days()))
+    db.session.commit()
+
+
+def _rate(cases, total):
+    return {'cases': cases, 'total': total, 'rate': round(cases * 100 / total, 1) if total else None}
+
+
+def _apgar_summary(distribution):
+    total = sum(distribution.values())
+    low = sum(count for score, count in distribution.items() if score < LOW_APGAR)
+    return {'distribution': {str(score): count for score, count in sorted(distribution.items())},
+            'total': total,
+            'low': _rate(low, total)}
+
+
+def clinic_summary(user_id, start=None, end=None):
+    """
+    Clinical indicators of a midwife's patients over a period.
+
+    Args:
+        user_id (int): Midwife
+        start (date, optional): First day included
+        end (date, optional): Last day included
+
+    Returns:
+        dict: Anemia prevalence, hypertension incidence by trimester,
+        cesarean and postpartum hemorrhage rates, Apgar distributions
+    """
+    refresh_rollups(user_id)
+
+    query = select(_stats.c.metric, _stats.c.bucket, func.sum(_stats.c.numerator), func.sum(_stats.c.denominator)).where(
+        _stats.c.user_id == user_id)
+    if start:
+        query = query.where(_stats.c.day >= start)
+    if end:
+        query = query.where(_stats.c.day <= end)
+    totals = {(metric, bucket): (numerator, denominator)
+              for metric, bucket, numerator, denominator in db.session.execute(
+                  query.group_by(_stats.c.metric, _stats.c.bucket))}
+
+    def rate(metric, bucket=0):
+        return _rate(*totals.get((metric, bucket), (0, 0)))
+
+    def distribution(metric):
+        return {bucket: numerator for (name, bucket), (numerator, _) in totals.items() if name == metric}
+
+    return {
+        'period': {'start': start, 'end': end},
+        'anemia': rate('anemia'),
+        'hypertension_by_trimester': {str(trimester): rate('hypertension', trimester) for trimester in (1, 2, 3)},
+        'cesarean': rate('cesarean'),
+        'postpartum_hemorrhage': rate('postpartum_hemorrhage'),
+        'apgar_1min': _apgar_summary(distribution('apgar_1min')),
+        'apgar_5min': _apgar_summary(distribution('apgar_5min')),
+    }
+
+
+def daily_trend(user_id, metric, start=None, end=None, window=30, bucket=None):
+    """
+    Day-by-day rate of an indicator with a rolling window.
+
+    Args:
+        user_id (int): Midwife
+        metric (str): One of ROLLUPS
+        start (date, optional): First day returned
+        end (date, optional): Last day returned
+        window (int): Rolling window in days
+        bucket (int, optional): Trimester or Apgar score; all buckets when None
+
+    Returns:
+        list: Dicts with day, cases, total and the rolling rate (%)
+    """
+    refresh_rollups(user_id)
+
+    daily = select(_stats.c.day, func.sum(_stats.c.numerator).label('cases'),
+                   func.sum(_stats.c.denominator).label('total')).where(
+        _stats.c.user_id == user_id, _stats.c.metric == metric)
+    if bucket is not None:
+        daily = daily.where(_stats.c.bucket == bucket)
+    if end:
+        daily = daily.where(_stats.c.day <= end)
+    daily = daily.group_by(_stats.c.day).subquery()
+
+    frame = {'order_by': _day_number(daily.c.day), 'range_': (-(window - 1), 0)}
+    rolling = select(
+        daily.c.day, daily.c.cases, daily.c.total,
+        func.sum(daily.c.cases).over(**frame).label('window_cases'),
+        func.sum(daily.c.total).over(**frame).label('window_total')
+    ).subquery()
+
+    # The start bound is applied after the window so the first days still see their predecessors
+    query = select(rolling).order_by(rolling.c.day)
+    if start:
+        query = query.where(rolling.c.day >= start)
+
+    return [{'day': _as_date(row.day), 'cases': row.cases, 'total': row.total,
+             'rolling_rate': round(row.window_cases * 100 / row.window_total, 1) if row.window_total else None}
+            for row in db.session.execute(query)]
+
+
+def _rebuild_rollups_task(user_id, payload, progress):
+    rebuild_rollups(user_id, progress)
+    return {'metrics': len(ROLLUPS)}
+
+
+register_task('rollup_rebuild', _rebuild_rollups_task, public=True)
@@ -1,30 +1,53 @@
 import os
-import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from sqlalchemy.ext.declarative import declarative_base  # Updated import
+from serializers import FastJSONProvider
+from sharding import TenantSession, init_sharding
+from structured_logging import configure_logging, init_request_logging
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# JSON log records written by a background thread; levels from LOG_LEVEL / LOG_LEVELS
+configure_logging()
 
-# Set up database
-Base = declarative_base()  # Updated to use declarative_base
-
-db = SQLAlchemy(model_class=Base)
+# With TENANT_SHARD_DIR set, each midwife's clinical data lives in its own
+# SQLite file and only accounts stay in the main database
+db = SQLAlchemy(session_options={'class_': TenantSession})
 
 # Create the app
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 
 # Configure SQLite database for local use
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///anips_f.db")
+app.config["SQLALCHEMY_BINDS"] = {
+    "jobs": os.environ.get("JOB_QUEUE_DATABASE_URL", "sqlite:///jobs.db"),
+}
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
 
+# Audit log retention: rows older than the hot window are moved to compressed
+# archives by a periodic job (seconds between runs, 0 disables it)
+app.config["AUDIT_HOT_RETENTION_DAYS"] = int(os.environ.get("AUDIT_HOT_RETENTION_DAYS", 90))
+app.config["AUDIT_ARCHIVE_INTERVAL"] = int(os.environ.get("AUDIT_ARCHIVE_INTERVAL", 3600))
+
+# Vital sign readings older than this are compacted into per-patient columnar blocks
+# by a periodic job (seconds between runs, 0 disables it)
+app.config["VITALS_ARCHIVE_AGE_DAYS"] = int(os.environ.get("VITALS_ARCHIVE_AGE_DAYS", 180))
+app.config["VITALS_ARCHIVE_INTERVAL"] = int(os.environ.get("VITALS_ARCHIVE_INTERVAL", 86400))
+
+# Worker processes of a job runner. Runners live in a dedicated `flask run-jobs`
+# process; JOB_RUNNER_IN_PROCESS=1 starts one in the web process instead
+# (single-process setups only: never under gunicorn's preloading master)
+app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", 2))
+app.config["JOB_RUNNER_IN_PROCESS"] = os.environ.get("JOB_RUNNER_IN_PROCESS") == "1"
+
+# Share of successful requests logged per endpoint, e.g. "static=0.01,api_sync=0.1"
+app.config["LOG_SAMPLE_RATES"] = os.environ.get("LOG_SAMPLE_RATES", "")
+
 # Initialize the database
 db.init_app(app)
 
@@ -47,3 +70,46 @@ with app.app_context():
 
 # Import routes after app is created
 from routes import *
+
+init_sharding(app, db)
+
+# Request ids, and one sampled log line per request with its duration
+init_request_logging(app)
+
+# Count database commits per request
+from unit_of_work import init_commit_metrics
+init_commit_metrics(app)
+
+# Per-page script bundles and self-hosted vendor libraries
+from assets import init_assets
+init_assets(app)
+
+# Compile templates eagerly so the first page views are not slowed down
+from fragments import precompile_templates
+precompile_templates(app)
+
+# Set up the full-text search index over clinical notes
+from search import init_search_index
+with app.app_context():
+    init_search_index()
+
+# New patients are compared with the existing ones sharing a blocking key
+from duplicates import init_duplicate_detection
+with app.app_context():
+    init_duplicate_detection()
+
+# Clinical indicators are served from incrementally refreshed daily rollups
+from analytics import init_analytics
+with app.app_context():
+    init_analytics()
+
+from audit_archive import init_audit_storage
+init_audit_storage(app)
+
+from vitals_archive import init_vitals_archive
+init_vitals_archive(app)
+
+# Heavy work (rollup rebuilds, reports...) runs on a local job queue, taken
+# by `flask run-jobs`
+from jobs import init_jobs
+init_jobs(app)
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import threading
+import urllib.request
+from collections import namedtuple
+
+import click
+from flask import Response, abort, current_app, url_for
+
+# A third-party file: its path under static/vendor and the CDN it comes from
+VendorFile = namedtuple('VendorFile', 'path url')
+
+# Versions are pinned: the path changes with the version, so cached copies
+# never go stale
+VENDOR = {
+    'jquery': VendorFile(
+        'jquery-3.5.1/jquery.slim.min.js',
+        'https://code.jquery.com/jquery-3.5.1.slim.min.js'),
+    'bootstrap.js': VendorFile(
+        'bootstrap-4.6.0/bootstrap.bundle.min.js',
+        'https://cdn.jsdelivr.net/npm/bootstrap@4.6.0/dist/js/bootstrap.bundle.min.js'),
+    'bootstrap.css': VendorFile(
+        'bootstrap-4.6.0/bootstrap.min.css',
+        'https://cdn.jsdelivr.net/npm/bootstrap@4.6.0/dist/css/bootstrap.min.css'),
+    'fontawesome.css': VendorFile(
+        'fontawesome-5.15.4/css/all.min.css',
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.4/css/all.min.css'),
+    'chart.js': VendorFile(
+        'chart.js-4.4.1/chart.umd.js',
+        'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.js'),
+    'chartjs-annotation': VendorFile(
+        'chartjs-plugin-annotation-3.0.1/chartjs-plugin-annotation.min.js',
+        'https://cdn.jsdelivr.net/npm/chartjs-plugin-annotation@3.0.1/dist/chartjs-plugin-annotation.min.js'),
+}
+
+# Files loaded by the vendor stylesheets through relative URLs
+VENDOR_DEPENDENCIES = tuple(
+    VendorFile(f'fontawesome-5.15.4/webfonts/{font}.{extension}',
+               f'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.4/webfonts/{font}.{extension}')
+    for font in ('fa-solid-900', 'fa-regular-400', 'fa-brands-400')
+    for extension in ('woff2', 'woff')
+)
+
+# A script bundle: vendor libraries (separate, long-lived files) and our
+# own scripts, concatenated into a single request
+Bundle = namedtuple('Bundle', 'vendor files')
+
+BUNDLES = {
+    # Every page: navbar, dropdowns, modals, and the loader of the lazy bundles
+    'core': Bundle(('jquery', 'bootstrap.js'), ('js/lazy_loader.js',)),
+    'charts': Bundle(('chart.js',), ('js/chart_utils.js',)),
+    'annotations': Bundle(('chartjs-annotation',), ()),
+    'passwords': Bundle((), ('js/security.js',)),
+    'patient_picker': Bundle((), ('js/patient_picker.js',)),
+    # Loaded by lazy_loader.js on first use
+    'help': Bundle((), ('js/help_guide.js',)),
+    'assistant': Bundle((), ('js/ai_assistant.js',)),
+}
+
+LAZY_BUNDLES = ('help', 'assistant')
+
+VENDOR_DIR = 'vendor'
+
+# bundle name -> (hash, concatenated source)
+_bundles = {}
+_bundles_lock = threading.Lock()
+
+
+def _vendor_path(vendor_file):
+    return os.path.join(current_app.static_folder, VENDOR_DIR, vendor_file.path)
+
+
+def vendor_url(name):
+    """
+    Get the URL of a vendor file: the self-hosted copy once
+    `flask fetch-vendor` has downloaded it, the CDN otherwise.
+
+    Args:
+        name (str): Key of VENDOR
+
+    Returns:
+        str: URL
+    """
+    vendor_file = VENDOR[name]
+    if os.path.exists(_vendor_path(vendor_file)):
+        return url_for('static', filename=f'{VENDOR_DIR}/{vendor_file.path}')
+    return vendor_file.url
+
+
+def _build_bundle(name):
+    parts = []
+    for filename in BUNDLES[name].files:
+        with open(os.path.join(current_app.static_folder, filename), encoding='utf-8') as f:
+            parts.append(f'/* {filename} */\n{f.read()}')
+    # Scripts may end without a semicolon
+    source = '\n;\n'.join(parts)
+    return hashlib.sha256(source.encode()).hexdigest()[:12], source
+
+
+def _bundle(name):
+    # Rebuilt on every call in debug mode, where the scripts are edited
+    if current_app.debug:
+        return _build_bundle(name)
+    with _bundles_lock:
+        if name not in _bundles:
+            _bundles[name] = _build_bundle(name)
+        return _bundles[name]
+
+
+def bundle_url(name):
+    """
+    Get the URL of the concatenated scripts of a bundle.
+
+    Args:
+        name (str): Key of BUNDLES with files
+
+    Returns:
+        str: URL containing the content hash of the bundle
+    """
+    digest, _ = _bundle(name)
+    return url_for('script_bundle', name=name, digest=digest)
+
+
+def script_urls(names=()):
+    """
+    Get the scripts of a page, in loading order.
+
+    Args:
+        names (iterable): Bundles declared by the page; core is always first
+
+    Returns:
+        list: Script URLs
+    """
+    urls = []
+    for name in ('core',) + tuple(n for n in names if n != 'core'):
+        bundle = BUNDLES[name]
+        urls += [vendor_url(vendor) for vendor in bundle.vendor]
+        if bundle.files:
+            urls.append(bundle_url(name))
+    return urls
+
+
+def lazy_bundle_urls():
+    """
+    Get the URLs of the bundles lazy_loader.js loads on demand.
+
+    Returns:
+        dict: Bundle name -> URL
+    """
+    return {name: bundle_url(name) for name in LAZY_BUNDLES}
+
+
+def asset_urls():
+    """
+    Get the URLs of every bundle and vendor file pages may load.
+
+    Bundle URLs carry their content hash and vendor URLs their version, so
+    the list changes whenever one of these files does.
+
+    Returns:
+        list: URLs (CDN URLs for vendor files not downloaded)
+    """
+    urls = [bundle_url(name) for name, bundle in BUNDLES.items() if bundle.files]
+    urls += [vendor_url(name) for name in VENDOR]
+    # Fonts of the self-hosted stylesheets (browsers use the woff2 files)
+    urls += [url_for('static', filename=f'{VENDOR_DIR}/{vendor_file.path}')
+             for vendor_file in VENDOR_DEPENDENCIES
+             if vendor_file.path.endswith('.woff2') and os.path.exists(_vendor_path(vendor_file))]
+    return urls
+
+
+def fetch_vendor(force=False):
+    """
+    Download the vendor files into static/vendor so that pages no longer
+    depend on CDNs.
+
+    Args:
+        force (bool): Download files already present again
+
+    Returns:
+        int: Number of files downloaded
+    """
+    downloaded = 0
+    for vendor_file in tuple(VENDOR.values()) + VENDOR_DEPENDENCIES:
+        path = _vendor_path(vendor_file)
+        if os.path.exists(path) and not force:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with urllib.request.urlopen(vendor_file.url, timeout=30) as response:
+            content = response.read()
+        # Write then rename: a partial file must never be served
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+        downloaded += 1
+    return downloaded
+
+
+def init_assets(app):
+    """
+    Register the template helpers, the bundle route and the vendor CLI.
+
+    Args:
+        app (Flask): Application
+    """
+    app.jinja_env.globals.update(vendor_url=vendor_url, script_urls=script_urls,
+                                 lazy_bundle_urls=lazy_bundle_urls)
+
+    @app.route('/bundles/<name>-<digest>.js')
+    def script_bundle(name, digest):
+        bundle = BUNDLES.get(name)
+        if bundle is None or not bundle.files:
+            abort(404)
+        current, source = _bundle(name)
+        response = Response(source, mimetype='application/javascript')
+        if digest == current:
+            # The URL changes with the content
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.cli.command('fetch-vendor')
+    @click.option('--force', is_flag=True, help="Download files already present again")
+    def fetch_vendor_command(force):
+        """Download the third-party scripts, stylesheets and fonts into static/vendor."""
+        try:
+            downloaded = fetch_vendor(force)
+        except OSError as error:
+            raise click.ClickException(f"Téléchargement impossible : {error}")
+        click.echo(f"{downloaded} file(s) downloaded into static/{VENDOR_DIR}")
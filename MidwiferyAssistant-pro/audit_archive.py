@@ -0,0 +1,237 @@
+import fcntl
+import gzip
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db
+from jobs import register_periodic, register_task
+from models import AuditLog
+from sharding import set_tenant, tenant_ids
+
+# Rows moved to the archive per transaction
+ARCHIVE_BATCH_SIZE = 5000
+
+INDEX_FILE = 'index.json'
+LOCK_FILE = '.lock'
+
+
+def _archive_dir(app):
+    path = app.config.get('AUDIT_ARCHIVE_DIR') or os.path.join(app.instance_path, 'audit_archive')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _bucket(timestamp):
+    # One archive file per calendar month
+    return timestamp.strftime('%Y-%m')
+
+
+def _bucket_file(archive_dir, bucket):
+    return os.path.join(archive_dir, f"audit-{bucket}.jsonl.gz")
+
+
+def _load_index(archive_dir):
+    try:
+        with open(os.path.join(archive_dir, INDEX_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_index(archive_dir, index):
+    path = os.path.join(archive_dir, INDEX_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _archive_lock(archive_dir):
+    # Only one process archives at a time, whatever the number of workers
+    with open(os.path.join(archive_dir, LOCK_FILE), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _serialize(log):
+    return {
+        'id': log.id,
+        'user_id': log.user_id,
+        'action': log.action,
+        'details': log.details,
+        'timestamp': log.timestamp.isoformat(),
+        'ip_address': log.ip_address
+    }
+
+
+def _entry_key(row):
+    # Ids are only unique within one database: the catalog and every shard
+    # number their rows independently, so the same id can name two entries
+    return row['timestamp'], row['id'], row['action']
+
+
+def _archive_tenant(archive_dir, index, cutoff):
+    archived = 0
+    while True:
+        logs = AuditLog.query.filter(AuditLog.timestamp < cutoff).order_by(AuditLog.id).limit(ARCHIVE_BATCH_SIZE).all()
+        if not logs:
+            return archived
+
+        by_bucket = {}
+        for log in logs:
+            by_bucket.setdefault(_bucket(log.timestamp), []).append(_serialize(log))
+
+        for bucket, rows in by_bucket.items():
+            payload = ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+            with open(_bucket_file(archive_dir, bucket), 'ab') as f:
+                f.write(gzip.compress(payload.encode('utf-8')))
+                f.flush()
+                os.fsync(f.fileno())
+
+            users = index.setdefault(bucket, {})
+            for row in rows:
+                entry = users.setdefault(str(row['user_id']), [row['timestamp'], row['timestamp'], 0])
+                entry[0] = min(entry[0], row['timestamp'])
+                entry[1] = max(entry[1], row['timestamp'])
+                entry[2] += 1
+        _save_index(archive_dir, index)
+
+        AuditLog.query.filter(AuditLog.id.in_([log.id for log in logs])).delete(synchronize_session=False)
+        db.session.commit()
+        archived += len(logs)
+
+
+def archive_old_audit_logs(app, now=None):
+    """
+    Move audit rows older than the hot retention window to compressed archives.
+
+    Rows are appended to one gzip file per month (each run adds a gzip
+    member, so files are only ever appended to), the index is updated, and
+    only then are the rows deleted from the database. A crash between the
+    two steps leaves duplicates, which readers drop by timestamp, id and
+    action (ids alone repeat across the catalog and the shards).
+
+    Args:
+        app (Flask): Application, for configuration and context
+        now (datetime, optional): Reference time, defaults to utcnow
+
+    Returns:
+        int: Number of rows archived
+    """
+    retention_days = app.config.get('AUDIT_HOT_RETENTION_DAYS', 90)
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    archive_dir = _archive_dir(app)
+    archived = 0
+
+    with _archive_lock(archive_dir):
+        index = _load_index(archive_dir)
+        # The catalog database, then every midwife's shard in sharded mode
+        for tenant in [None] + tenant_ids():
+            with app.app_context():
+                set_tenant(tenant)
+                archived += _archive_tenant(archive_dir, index, cutoff)
+                db.session.remove()
+
+    if archived:
+        logging.info("%d entrées du journal d'audit archivées", archived)
+    return archived
+
+
+def _archive_task(user_id, payload, progress):
+    return {'archived': archive_old_audit_logs(current_app._get_current_object())}
+
+
+register_task('audit_archive', _archive_task)
+
+
+def _read_bucket(archive_dir, bucket):
+    # gzip.open reads all concatenated members of the file
+    with gzip.open(_bucket_file(archive_dir, bucket), 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def query_audit_logs(app, user_id, start=None, end=None, limit=None):
+    """
+    Read a user's audit entries across the hot table and the archives.
+
+    Args:
+        app (Flask): Application
+        user_id (int): User whose actions are read
+        start (datetime, optional): Inclusive lower bound
+        end (datetime, optional): Exclusive upper bound
+        limit (int, optional): Maximum number of entries
+
+    Returns:
+        list: Entries as dicts, most recent first
+    """
+    query = AuditLog.query.filter(AuditLog.user_id == user_id)
+    if start:
+        query = query.filter(AuditLog.timestamp >= start)
+    if end:
+        query = query.filter(AuditLog.timestamp < end)
+    query = query.order_by(AuditLog.timestamp.desc())
+    if limit:
+        query = query.limit(limit)
+    entries = [_serialize(log) for log in query]
+    if limit and len(entries) >= limit:
+        return entries
+
+    archive_dir = _archive_dir(app)
+    index = _load_index(archive_dir)
+    start_iso = start.isoformat() if start else None
+    end_iso = end.isoformat() if end else None
+    seen = {_entry_key(entry) for entry in entries}
+    archived = []
+
+    # Newest buckets first so a limit can stop the scan early
+    for bucket in sorted(index, reverse=True):
+        span = index[bucket].get(str(user_id))
+        if span is None:
+            continue
+        if (start_iso and span[1] < start_iso) or (end_iso and span[0] >= end_iso):
+            continue
+        for row in _read_bucket(archive_dir, bucket):
+            if row['user_id'] != user_id:
+                continue
+            if (start_iso and row['timestamp'] < start_iso) or (end_iso and row['timestamp'] >= end_iso):
+                continue
+            key = _entry_key(row)
+            if key in seen:
+                continue
+            seen.add(key)
+            archived.append(row)
+        if limit and len(entries) + len(archived) >= limit:
+            break
+
+    archived.sort(key=lambda row: row['timestamp'], reverse=True)
+    entries.extend(archived)
+    return entries[:limit] if limit else entries
+
+
+def init_audit_storage(app):
+    """
+    Make sure the hot table is indexed for per-user range reads and have
+    the job runners archive old rows periodically.
+
+    The interval comes from AUDIT_ARCHIVE_INTERVAL (seconds, 0 disables it).
+
+    Args:
+        app (Flask): Application
+    """
+    with app.app_context():
+        for index in AuditLog.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    register_periodic('audit_archive', app.config.get('AUDIT_ARCHIVE_INTERVAL', 3600))
@@ -0,0 +1,72 @@
+"""
+Measure requests per second on the dashboard and the blood pressure API.
+
+Usage:
+    python benchmarks/server_throughput.py http://localhost:5000 [requests] [concurrency]
+
+Start the server to measure first, e.g. ``python main.py`` for the
+development server or ``gunicorn -c gunicorn.conf.py main:app`` for the
+production setup.
+"""
+import http.cookiejar
+import json
+import sys
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def login(base_url):
+    # Each run registers its own user so it never depends on existing data
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    username = f"bench-{uuid.uuid4().hex[:8]}"
+    form = {'username': username, 'email': f"{username}@example.org",
+            'password': 'bench', 'confirm_password': 'bench'}
+    opener.open(f"{base_url}/register", urllib.parse.urlencode(form).encode())
+    opener.open(f"{base_url}/login", urllib.parse.urlencode({'username': username, 'password': 'bench'}).encode())
+    return opener
+
+
+def create_patient(base_url, opener):
+    # Readings are only stored for a patient: without one the BP API would
+    # measure the classification alone
+    form = {'first_name': 'Bench', 'last_name': uuid.uuid4().hex[:8], 'cycle_length': '28'}
+    opener.open(f"{base_url}/patients", urllib.parse.urlencode(form).encode())
+    request = urllib.request.Request(f"{base_url}/api/patients", headers={'Accept': 'application/json'})
+    with opener.open(request) as response:
+        return json.load(response)['patients'][0]['id']
+
+
+def run(name, opener, make_request, total, concurrency):
+    def call(_):
+        with opener.open(make_request()) as response:
+            response.read()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(call, range(total)))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {total / elapsed:8.1f} req/s  ({total} requests, {concurrency} concurrent)")
+
+
+def main():
+    base_url = sys.argv[1].rstrip('/') if len(sys.argv) > 1 else 'http://localhost:5000'
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+
+    opener = login(base_url)
+    patient_id = create_patient(base_url, opener)
+    bp_body = json.dumps({'systolic': 145, 'diastolic': 95, 'heartRate': 80, 'patientId': patient_id}).encode()
+
+    run('GET /dashboard', opener, lambda: f"{base_url}/dashboard", total, concurrency)
+    run('POST /api/record_blood_pressure', opener,
+        lambda: urllib.request.Request(f"{base_url}/api/record_blood_pressure", data=bp_body,
+                                       headers={'Content-Type': 'application/json'}),
+        total, concurrency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compare write throughput of the single database and per-midwife shards.
+
+Each tenant is a process committing, in a loop, what a blood pressure
+request commits: one measurement and one audit row per transaction. In
+"single" mode all tenants share one SQLite file and take turns on its write
+lock; in "sharded" mode each writes to its own file.
+
+Usage:
+    python benchmarks/shard_write_throughput.py [seconds per run] [max tenants]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db  # noqa: E402
+from models import BloodPressureRecord, AuditLog  # noqa: E402
+from sharding import tenant_tables  # noqa: E402
+
+
+def writer(path, user_id, duration, start, results):
+    engine = sa.create_engine(f"sqlite:///{path}")
+    bp_table = BloodPressureRecord.__table__
+    audit_table = AuditLog.__table__
+    writes = errors = 0
+    start.wait()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        try:
+            with engine.begin() as connection:
+                connection.execute(bp_table.insert(), {
+                    'systolic': 145, 'diastolic': 95, 'heart_rate': 80, 'notes': '',
+                    'recorded_at': datetime.utcnow(), 'patient_id': 1, 'user_id': user_id})
+                connection.execute(audit_table.insert(), {
+                    'user_id': user_id, 'action': "Enregistrement de tension artérielle",
+                    'details': 'Patient ID: 1', 'timestamp': datetime.utcnow(), 'ip_address': '127.0.0.1'})
+            writes += 1
+        except sa.exc.OperationalError:
+            # "database is locked" once the busy timeout expires
+            errors += 1
+    results.put((writes, errors))
+
+
+def run(mode, tenants, duration):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, 'single.db')] * tenants if mode == 'single' else \
+            [os.path.join(directory, f"tenant-{user_id}.db") for user_id in range(1, tenants + 1)]
+        for path in set(paths):
+            engine = sa.create_engine(f"sqlite:///{path}")
+            db.metadata.create_all(engine, tables=tenant_tables(db.metadata))
+            engine.dispose()
+
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=writer, args=(path, user_id, duration, start, results))
+                     for user_id, path in enumerate(paths, 1)]
+        for process in processes:
+            process.start()
+        time.sleep(0.5)
+        start.set()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    writes = sum(w for w, _ in totals)
+    errors = sum(e for _, e in totals)
+    print(f"{mode:<8} {tenants:>2} tenants {writes / duration:9.1f} commits/s  ({errors} lock timeouts)")
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    max_tenants = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    tenants = 1
+    while tenants <= max_tenants:
+        for mode in ('single', 'sharded'):
+            run(mode, tenants, duration)
+        tenants *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Measure the storage and scan-time savings of the vitals archive.
+
+Home-monitored patients record blood pressure twice a day. The history of
+every patient is read once from the row table, then the readings older
+than the archive age are compacted and the same histories are read back
+through read_vitals (blocks plus remaining rows).
+
+Usage:
+    python benchmarks/vitals_archive.py [patients] [days of history]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+directory = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'vitals.db')}"
+os.environ['JOB_QUEUE_DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'jobs.db')}"
+os.environ['JOB_WORKERS'] = '0'
+os.environ['AUDIT_ARCHIVE_INTERVAL'] = '0'
+os.environ['VITALS_ARCHIVE_INTERVAL'] = '0'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, text  # noqa: E402
+
+from app import app, db  # noqa: E402
+from models import User, Patient, BloodPressureRecord  # noqa: E402
+from vitals_archive import archive_old_vitals, read_vitals, vitals_scan_stats, vitals_storage_stats  # noqa: E402
+
+
+def database_size():
+    db.session.commit()
+    # VACUUM cannot run inside a transaction
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text('VACUUM'))
+        page_size = connection.execute(text('PRAGMA page_size')).scalar()
+        return connection.execute(text('PRAGMA page_count')).scalar() * page_size
+
+
+def seed(patients, days):
+    user = User(username='bench', email='bench@example.org', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    patient_ids = []
+    for i in range(patients):
+        patient = Patient(first_name=f'P{i}', last_name='Bench', user_id=user.id)
+        db.session.add(patient)
+        db.session.flush()
+        patient_ids.append(patient.id)
+
+    table = BloodPressureRecord.__table__
+    start = datetime.utcnow() - timedelta(days=days)
+    rows = []
+    for patient_id in patient_ids:
+        for day in range(days):
+            for hour in (8, 20):
+                rows.append({
+                    'systolic': random.randint(105, 150), 'diastolic': random.randint(65, 95),
+                    'heart_rate': random.randint(60, 100), 'notes': None,
+                    'recorded_at': start + timedelta(days=day, hours=hour, minutes=random.randint(0, 20)),
+                    'patient_id': patient_id, 'user_id': user.id})
+    db.session.execute(table.insert(), rows)
+    db.session.commit()
+    return patient_ids, len(rows)
+
+
+def scan(patient_ids, reader):
+    started = time.perf_counter()
+    count = sum(len(reader(patient_id)) for patient_id in patient_ids)
+    return count, time.perf_counter() - started
+
+
+def rows_only(patient_id):
+    # Same shape as read_vitals: one dict per reading, most recent first
+    table = BloodPressureRecord.__table__
+    query = select(table).where(table.c.patient_id == patient_id).order_by(table.c.recorded_at.desc())
+    return [dict(row) for row in db.session.execute(query).mappings()]
+
+
+def main():
+    patients = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 730
+
+    with app.app_context():
+        patient_ids, total = seed(patients, days)
+        before = database_size()
+        count, row_seconds = scan(patient_ids, rows_only)
+        print(f"{total} readings, {patients} patients, {days} days")
+        print(f"rows only       {before / 1024:9.0f} KiB  full history scan {row_seconds * 1000:8.1f} ms ({count} readings)")
+
+    stats = archive_old_vitals(app)
+
+    with app.app_context():
+        after = database_size()
+        count, archive_seconds = scan(patient_ids, lambda patient_id: read_vitals(patient_id, 'blood_pressure'))
+        print(f"with archive    {after / 1024:9.0f} KiB  full history scan {archive_seconds * 1000:8.1f} ms ({count} readings)")
+        print(f"archived {stats['readings']} readings into {stats['blocks']} blocks: "
+              f"{stats['bytes'] / stats['readings']:.1f} bytes/reading compressed")
+        print(f"storage x{before / after:.1f} smaller, scan x{row_seconds / archive_seconds:.1f} faster")
+        print(vitals_storage_stats())
+        print(vitals_scan_stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from models import ChecklistState
+
+# Items of each pregnancy stage, in bit order; ids match static/js/checklists.js.
+# Stored bitsets stay valid as long as positions never move: new items are
+# appended (and CATALOGUE_VERSION bumped), retired items are replaced by None.
+CATALOGUE_VERSION = 1
+
+CATALOGUE = {
+    # First trimester (up to 13+6 weeks)
+    't1': ('c1-1', 'c1-2', 'c1-3', 'c1-4', 'c1-5',
+           'l1-1', 'l1-2', 'l1-3', 'l1-4', 'l1-5', 'l1-6', 'l1-7', 'l1-8',
+           'i1-1',
+           'e1-1', 'e1-2', 'e1-3', 'e1-4', 'e1-5'),
+    # Second trimester (14 to 27+6 weeks)
+    't2': ('c2-1', 'c2-2', 'c2-3', 'c2-4', 'c2-5', 'c2-6',
+           'l2-1', 'l2-2', 'l2-3', 'l2-4',
+           'i2-1',
+           'e2-1', 'e2-2', 'e2-3', 'e2-4'),
+    # Third trimester (28 weeks and beyond)
+    't3': ('c3-1', 'c3-2', 'c3-3', 'c3-4', 'c3-5', 'c3-6', 'c3-7', 'c3-8', 'c3-9',
+           'l3-1', 'l3-2', 'l3-3', 'l3-4', 'l3-5',
+           'i3-1',
+           'e3-1', 'e3-2', 'e3-3', 'e3-4', 'e3-5',
+           's3-1', 's3-2'),
+}
+
+# Bits available in the signed 64-bit column
+MAX_ITEMS = 63
+
+_table = ChecklistState.__table__
+
+# stage -> item id -> bit
+_bits = {stage: {item: 1 << position for position, item in enumerate(items) if item}
+         for stage, items in CATALOGUE.items()}
+
+for _stage, _items in CATALOGUE.items():
+    if len(_items) > MAX_ITEMS:
+        raise ValueError(f"Trop d'éléments dans la checklist {_stage}")
+
+
+def _state(stage, checked, catalogue_version):
+    return {
+        'stage': stage,
+        'catalogue_version': catalogue_version,
+        'checked': [item for item, bit in _bits[stage].items() if checked & bit]
+    }
+
+
+def load_checklist(patient_id, stage):
+    """
+    Read a patient's checklist for a stage (one primary key lookup).
+
+    Args:
+        patient_id (int): Patient, whose ownership has been checked
+        stage (str): Stage key of CATALOGUE
+
+    Returns:
+        dict: stage, catalogue_version and the ids of the checked items
+    """
+    row = db.session.execute(select(_table.c.checked, _table.c.catalogue_version).where(
+        _table.c.patient_id == patient_id, _table.c.stage == stage)).first()
+    if row is None:
+        return _state(stage, 0, CATALOGUE_VERSION)
+    return _state(stage, row.checked, row.catalogue_version)
+
+
+def update_checklist(patient_id, stage, changes):
+    """
+    Check or uncheck items of a patient's checklist.
+
+    Only the given items change: the new state is computed by the database
+    as (checked | set) & ~clear in a single upsert, so concurrent updates
+    from two devices never overwrite each other's items.
+
+    Args:
+        patient_id (int): Patient, whose ownership has been checked
+        stage (str): Stage key of CATALOGUE
+        changes (dict): Item id -> True to check, False to uncheck
+
+    Returns:
+        dict: New state, as returned by load_checklist
+
+    Raises:
+        KeyError: If an item is not in the stage's catalogue
+    """
+    bits = _bits[stage]
+    set_mask = clear_mask = 0
+    for item, checked in changes.items():
+        if checked:
+            set_mask |= bits[item]
+        else:
+            clear_mask |= bits[item]
+
+    now = datetime.utcnow()
+    # Both dialects spell the upsert the same way but need their own insert()
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    statement = insert(_table).values(patient_id=patient_id, stage=stage, checked=set_mask,
+                                      catalogue_version=CATALOGUE_VERSION, updated_at=now)
+    statement = statement.on_conflict_do_update(
+        index_elements=[_table.c.patient_id, _table.c.stage],
+        set_={'checked': _table.c.checked.op('|')(set_mask).op('&')(~clear_mask),
+              'catalogue_version': CATALOGUE_VERSION,
+              'updated_at': now}
+    ).returning(_table.c.checked)
+    return _state(stage, db.session.execute(statement).scalar_one(), CATALOGUE_VERSION)
@@ -0,0 +1,354 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+# Clinical thresholds as data. A new version can be dropped in a JSON file
+# (CLINICAL_RULES_FILE) and is picked up without restarting the server.
+DEFAULT_RULES = {
+    'version': '2025.1',
+    'blood_pressure': {
+        # Bands are listed from the lowest value to the highest;
+        # each boundary is the first value of the next band.
+        'systolic': {
+            'boundaries': [90, 130, 140, 150, 160],
+            'bands': ['low', 'normal', 'elevated', 'mild', 'warning', 'critical']
+        },
+        'diastolic': {
+            'boundaries': [60, 80, 90, 100, 110],
+            'bands': ['low', 'normal', 'elevated', 'mild', 'warning', 'critical']
+        },
+        # When systolic and diastolic fall in different bands, the first one listed wins
+        'precedence': ['critical', 'warning', 'mild', 'elevated', 'low', 'normal'],
+        'results': {
+            'critical': {
+                'message': 'CRISE HYPERTENSIVE → URGENCE',
+                'recommendations': [
+                    'Transfert immédiat en milieu hospitalier',
+                    'Bilan prééclampsie complet',
+                    'Surveillance fœtale',
+                    'Traitement antihypertenseur parentéral à envisager'
+                ]
+            },
+            'warning': {
+                'message': 'HTA modérée → Contrôle rapide',
+                'recommendations': [
+                    'Contrôle dans la journée',
+                    'Recherche de protéinurie',
+                    'Surveillance des signes fonctionnels de prééclampsie',
+                    'Consultation obstétricale si persistance'
+                ]
+            },
+            'mild': {
+                'message': 'HTA légère → Surveillance',
+                'recommendations': [
+                    'Contrôle dans les 24h',
+                    'Repos et position latérale gauche',
+                    'Recherche de protéinurie'
+                ]
+            },
+            'elevated': {
+                'message': 'Tension artérielle élevée',
+                'recommendations': [
+                    'Surveillance à la prochaine consultation',
+                    'Conseils hygiéno-diététiques (limiter sel, repos)',
+                    'Auto-surveillance si possible'
+                ]
+            },
+            'low': {
+                'message': 'Tension artérielle basse',
+                'recommendations': [
+                    'Hydratation suffisante',
+                    'Position latérale gauche en cas de malaise',
+                    'Lever progressif'
+                ]
+            },
+            'normal': {
+                'message': 'Tension artérielle normale',
+                'recommendations': []
+            }
+        }
+    },
+    'blood': {
+        # Analytes are evaluated in order. "overall" sets the overall status,
+        # "overall_if_normal" only sets it while it is still normal, "hellp"
+        # counts the band as a HELLP syndrome marker. "above" bands start
+        # strictly above their boundary instead of at it.
+        'analytes': [
+            {
+                'name': 'hemoglobin',
+                'boundaries': [8, 10, 11],
+                'bands': [
+                    {'status': 'critical', 'message': 'Anémie sévère',
+                     'recommendation': 'Fer intraveineux recommandé', 'overall': 'critical'},
+                    {'status': 'warning', 'message': 'Anémie modérée',
+                     'recommendation': 'Supplément en fer oral (80-100 mg/jour)', 'overall': 'warning'},
+                    {'status': 'mild', 'message': 'Anémie légère',
+                     'recommendation': 'Supplément en fer oral (30-60 mg/jour)', 'overall': 'mild'},
+                    {'status': 'normal', 'message': 'Taux d\'hémoglobine normal'}
+                ]
+            },
+            {
+                'name': 'platelets',
+                'boundaries': [50, 100, 150],
+                'bands': [
+                    {'status': 'critical', 'message': 'Thrombopénie sévère',
+                     'recommendation': 'Consultation hématologique urgente', 'overall': 'critical', 'hellp': True},
+                    {'status': 'warning', 'message': 'Thrombopénie modérée',
+                     'recommendation': 'Surveillance rapprochée, LDH et frottis sanguin', 'overall': 'warning',
+                     'hellp': True},
+                    {'status': 'mild', 'message': 'Thrombopénie légère',
+                     'recommendation': 'Surveillance à la prochaine consultation'},
+                    {'status': 'normal', 'message': 'Taux de plaquettes normal'}
+                ]
+            },
+            {
+                'name': 'ferritin',
+                'optional': True,
+                'boundaries': [15, 30],
+                'bands': [
+                    {'status': 'warning', 'message': 'Déplétion des réserves en fer',
+                     'recommendation': 'Supplément en fer oral', 'overall_if_normal': 'mild'},
+                    {'status': 'mild', 'message': 'Réserves en fer faibles',
+                     'recommendation': 'Considérer un supplément en fer oral'},
+                    {'status': 'normal', 'message': 'Taux de ferritine normal'}
+                ]
+            },
+            {
+                'name': 'ldh',
+                'optional': True,
+                'above': True,
+                'boundaries': [600],
+                'bands': [
+                    {'status': 'normal', 'message': 'LDH normal'},
+                    {'status': 'critical', 'message': 'LDH élevé', 'hellp': True}
+                ]
+            },
+            {
+                'name': 'liver_enzymes',
+                'optional': True,
+                # Evaluated on the highest of the two values
+                'inputs': ['ast', 'alt'],
+                'above': True,
+                'boundaries': [70],
+                'bands': [
+                    {'status': 'normal', 'message': 'Enzymes hépatiques normales'},
+                    {'status': 'critical', 'message': 'Enzymes hépatiques élevées', 'hellp': True}
+                ]
+            }
+        ],
+        'hellp': {
+            'threshold': 2,
+            'message': 'Suspicion de syndrome HELLP',
+            'recommendations': [
+                'Consultation obstétricale immédiate',
+                'Tension artérielle et protéinurie',
+                'Surveillance fœtale'
+            ]
+        },
+        'overall_messages': {
+            'normal': 'Résultats dans les normes',
+            'mild': 'Anomalies légères détectées',
+            'warning': 'Anomalies modérées détectées',
+            'critical': 'Anomalies critiques détectées'
+        }
+    }
+}
+
+# Optional JSON file holding the active rules version
+RULES_FILE = os.environ.get('CLINICAL_RULES_FILE')
+
+# Seconds between two checks of the rules file for a new version
+RELOAD_CHECK_INTERVAL = 5
+
+BloodPressureClassification = namedtuple('BloodPressureClassification', 'status message recommendations')
+Band = namedtuple('Band', 'status message recommendation overall overall_if_normal hellp')
+Analyte = namedtuple('Analyte', 'name inputs optional locate boundaries bands')
+
+
+class RuleSet:
+    """
+    A version of the clinical rules compiled into sorted-boundary lookups.
+
+    Every possible result is built once at compile time; evaluating a value
+    is a bisect into the boundaries and an index into immutable results.
+    """
+
+    def __init__(self, rules):
+        self.version = rules['version']
+        self._compile_blood_pressure(rules['blood_pressure'])
+        self._compile_blood(rules['blood'])
+
+    def _compile_blood_pressure(self, table):
+        precedence = table['precedence']
+        # Higher rank wins; rank indexes the preallocated classifications
+        rank = {status: len(precedence) - 1 - i for i, status in enumerate(precedence)}
+        self._bp_results = tuple(
+            BloodPressureClassification(status, table['results'][status]['message'],
+                                        tuple(table['results'][status]['recommendations']))
+            for status in reversed(precedence)
+        )
+        self._systolic = self._compile_axis(table['systolic'], rank)
+        self._diastolic = self._compile_axis(table['diastolic'], rank)
+
+    @staticmethod
+    def _compile_axis(axis, rank):
+        boundaries = tuple(axis['boundaries'])
+        if list(boundaries) != sorted(boundaries) or len(axis['bands']) != len(boundaries) + 1:
+            raise ValueError("Bornes de tension artérielle invalides")
+        return boundaries, tuple(rank[band] for band in axis['bands'])
+
+    def _compile_blood(self, table):
+        analytes = []
+        for spec in table['analytes']:
+            boundaries = tuple(spec['boundaries'])
+            if list(boundaries) != sorted(boundaries) or len(spec['bands']) != len(boundaries) + 1:
+                raise ValueError(f"Bornes invalides pour {spec['name']}")
+            bands = tuple(
+                Band(band['status'], band['message'], band.get('recommendation'), band.get('overall'),
+                     band.get('overall_if_normal'), bool(band.get('hellp')))
+                for band in spec['bands']
+            )
+            # bisect_right: a boundary value belongs to the band above it;
+            # bisect_left: it still belongs to the band below ("above" bands)
+            locate = bisect_left if spec.get('above') else bisect_right
+            analytes.append(Analyte(spec['name'], tuple(spec.get('inputs', ())), bool(spec.get('optional')),
+                                    locate, boundaries, bands))
+        self._analytes = tuple(analytes)
+        self._hellp_threshold = table['hellp']['threshold']
+        self._hellp_message = table['hellp']['message']
+        self._hellp_recommendations = tuple(table['hellp']['recommendations'])
+        self._overall_messages = dict(table['overall_messages'])
+
+    def classify_blood_pressure(self, systolic, diastolic):
+        """
+        Classify a blood pressure reading.
+
+        Args:
+            systolic (int): Systolic blood pressure in mmHg
+            diastolic (int): Diastolic blood pressure in mmHg
+
+        Returns:
+            BloodPressureClassification: Shared immutable result
+        """
+        sys_boundaries, sys_ranks = self._systolic
+        dia_boundaries, dia_ranks = self._diastolic
+        return self._bp_results[max(sys_ranks[bisect_right(sys_boundaries, systolic)],
+                                    dia_ranks[bisect_right(dia_boundaries, diastolic)])]
+
+    def analyze_blood_results(self, values):
+        """
+        Analyze blood test results.
+
+        Args:
+            values (dict): Analyte or input name -> value (None when not measured)
+
+        Returns:
+            dict: Analysis in the format returned by utils.analyze_blood_results
+        """
+        analysis = {}
+        overall_status = 'normal'
+        recommendations = []
+        hellp_indicators = 0
+
+        for name, inputs, optional, locate, boundaries, bands in self._analytes:
+            if inputs:
+                measured = [values.get(input_name) for input_name in inputs]
+                if None in measured:
+                    continue
+                value = max(measured)
+                entry = dict(zip(inputs, measured))
+            else:
+                value = values.get(name)
+                if value is None and optional:
+                    continue
+                entry = {'value': value}
+
+            status, message, recommendation, overall, overall_if_normal, hellp = bands[locate(boundaries, value)]
+            entry['status'] = status
+            entry['message'] = message
+            analysis[name] = entry
+
+            if recommendation:
+                recommendations.append(recommendation)
+            if overall:
+                overall_status = overall
+            elif overall_if_normal and overall_status == 'normal':
+                overall_status = overall_if_normal
+            if hellp:
+                hellp_indicators += 1
+
+        if hellp_indicators >= self._hellp_threshold:
+            overall_status = 'critical'
+            message = self._hellp_message
+            recommendations = list(self._hellp_recommendations)
+        else:
+            message = self._overall_messages[overall_status]
+
+        analysis['overall'] = {
+            'status': overall_status,
+            'message': message,
+            'recommendations': recommendations
+        }
+        return analysis
+
+
+_active = RuleSet(DEFAULT_RULES)
+_reload_lock = threading.Lock()
+_rules_file_mtime = None
+# Modification time of the file version that failed to load: it is logged
+# once and not read again until the file changes
+_failed_mtime = None
+_next_check = 0.0
+
+
+def install_rules(rules):
+    """
+    Compile and activate a new version of the rules.
+
+    The previous version stays active if the new one does not compile.
+
+    Args:
+        rules (dict): Rules in the DEFAULT_RULES format
+
+    Returns:
+        RuleSet: The newly active rules
+    """
+    global _active
+    compiled = RuleSet(rules)
+    _active = compiled
+    logging.info("Règles cliniques version %s activées", compiled.version)
+    return compiled
+
+
+def get_rules():
+    """
+    Get the active rules, reloading CLINICAL_RULES_FILE if it changed.
+
+    Returns:
+        RuleSet: Active compiled rules
+    """
+    global _rules_file_mtime, _failed_mtime, _next_check
+    if not RULES_FILE or time.monotonic() < _next_check:
+        return _active
+
+    with _reload_lock:
+        _next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+        try:
+            mtime = os.stat(RULES_FILE).st_mtime
+        except OSError:
+            # Missing file: reported once, until it comes back
+            mtime = -1.0
+        if mtime in (_rules_file_mtime, _failed_mtime):
+            return _active
+        try:
+            with open(RULES_FILE, encoding='utf-8') as f:
+                install_rules(json.load(f))
+            _rules_file_mtime = mtime
+        except (OSError, ValueError, KeyError, TypeError):
+            _failed_mtime = mtime
+            logging.exception("Impossible de charger les règles cliniques depuis %s", RULES_FILE)
+    return _active
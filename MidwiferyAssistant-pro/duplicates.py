@@ -0,0 +1,390 @@
+import re
+from datetime import datetime
+from itertools import combinations, groupby
+
+from sqlalchemy import event, exists, func, select
+from sqlalchemy.orm import Session
+
+from app import db
+from jobs import register_task
+from models import Patient, PatientMatchKey
+from patient_index import normalize_name
+
+# Score from which two records are reported as the same woman
+DUPLICATE_THRESHOLD = 0.85
+
+# Weight of last name, first name and date of birth in the score
+NAME_WEIGHTS = (0.35, 0.35)
+BIRTH_WEIGHT = 0.3
+# Date of birth missing on either side: neither a match nor a mismatch
+UNKNOWN_BIRTH_SCORE = 0.55
+# Below this first-name similarity, two records are never the same woman,
+# however close the rest: sisters and twins share a surname and often a
+# date of birth ("Awa" / "Ava" pass, "Fatou" / "Fanta" do not)
+MIN_FIRST_NAME_SIMILARITY = 0.8
+
+# Blocks larger than this (very common name born the same year) are
+# compared within a sliding window over the sorted names instead of pairwise
+MAX_BLOCK_SIZE = 100
+BLOCK_WINDOW = 10
+
+# Words of a compound last name that get their own key
+MAX_NAME_WORDS = 3
+
+MAX_SCAN_PAIRS = 500
+
+_match_keys = PatientMatchKey.__table__
+
+# French spelling variants reduced to one form, applied in order
+_PHONETIC_RULES = [(re.compile(pattern), replacement) for pattern, replacement in (
+    (r'[^a-z]', ''),
+    (r'ph', 'f'), (r'th', 't'), (r'sch|sh|ch', 'x'), (r'qu|ck|q', 'k'),
+    (r'gu(?=[eiy])', 'g'), (r'g(?=[eiy])', 'j'), (r'c(?=[eiy])', 's'), (r'c', 'k'),
+    (r'z', 's'), (r'w', 'v'), (r'y', 'i'), (r'h', ''), (r'bv', 'b'),
+    (r'eau|au', 'o'), (r'ai|ei', 'e'), (r'e([mn])(?![aeiou])', r'a\1'), (r'm(?=[bp])', 'n'),
+    (r'(.)\1+', r'\1'),
+    # Silent endings: Dupont / Dupond / Dupon, Roux / Rou
+    (r'e?[dstx]?$', ''),
+)]
+
+
+def phonetic_key(word):
+    """
+    Reduce a name to how it sounds in French ("Lefèbvre" and "Lefebre" share a key).
+
+    Args:
+        word (str): Word already folded by normalize_name
+
+    Returns:
+        str: First letter followed by the consonant skeleton, at most 6 letters
+    """
+    for pattern, replacement in _PHONETIC_RULES:
+        word = pattern.sub(replacement, word)
+    if not word:
+        return ''
+    return (word[0] + re.sub('[aeiou]', '', word[1:]))[:6]
+
+
+def _birth_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def blocking_keys(first_name, last_name, date_of_birth):
+    """
+    Keys under which a patient is filed: two records can only be compared
+    if they share one.
+
+    Each name word with the birth year catches spelling variants and swapped
+    first and last names; the phonetic full name alone catches a mistyped
+    or missing date of birth.
+
+    Args:
+        first_name (str): First name
+        last_name (str): Last name
+        date_of_birth (date, optional): Date of birth
+
+    Returns:
+        set: Keys of at most 48 characters
+    """
+    last_words = normalize_name(last_name).split()
+    first_words = normalize_name(first_name).split()
+    year = str(date_of_birth.year) if date_of_birth else '?'
+
+    words = last_words[:MAX_NAME_WORDS] + first_words[:1]
+    if len(last_words) > 1:
+        # "Diallo Ndiaye" also filed under "diallondiaye", typed without the space
+        words.append(''.join(last_words))
+    keys = {f'n:{code}:{year}' for code in map(phonetic_key, words) if code}
+
+    last, first = phonetic_key(''.join(last_words)), phonetic_key(''.join(first_words))
+    if last and first:
+        # In either order, for first and last names entered the wrong way round
+        keys.add('p:' + ':'.join(sorted((last, first))))
+    return {key[:48] for key in keys}
+
+
+def _jaro_winkler(a, b):
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    window = max(len(a), len(b)) // 2 - 1
+    matched_b = [False] * len(b)
+    matches_a = []
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not matched_b[j] and b[j] == char:
+                matched_b[j] = True
+                matches_a.append(char)
+                break
+    if not matches_a:
+        return 0.0
+    matches_b = [char for char, matched in zip(b, matched_b) if matched]
+    transpositions = sum(x != y for x, y in zip(matches_a, matches_b)) / 2
+    m = len(matches_a)
+    jaro = (m / len(a) + m / len(b) + (m - transpositions) / m) / 3
+
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+def name_similarity(a, b):
+    """
+    Compare two folded names, tolerant of typos, spaces and dropped parts
+    of compound names ("diallo" and "diallo ndiaye").
+
+    Args:
+        a (str): Name folded by normalize_name
+        b (str): Name folded by normalize_name
+
+    Returns:
+        float: 0 (unrelated) to 1 (same name)
+    """
+    score = _jaro_winkler(a.replace(' ', ''), b.replace(' ', ''))
+    words_a, words_b = set(a.split()), set(b.split())
+    if words_a and words_b and (words_a <= words_b or words_b <= words_a):
+        score = max(score, 0.95)
+    return score
+
+
+def birth_similarity(a, b):
+    """
+    Compare two dates of birth, tolerant of the usual entry mistakes.
+
+    Args:
+        a (date, optional): First date
+        b (date, optional): Second date
+
+    Returns:
+        float: 1 when equal, less for a swapped day and month or a single
+            mistyped digit, 0 otherwise; None if either is missing
+    """
+    if a is None or b is None:
+        return None
+    if a == b:
+        return 1.0
+    if a.year == b.year and a.month == b.day and a.day == b.month:
+        return 0.9
+    changed = [(x, y, width) for x, y, width in ((a.year, b.year, 4), (a.month, b.month, 2), (a.day, b.day, 2))
+               if x != y]
+    if len(changed) == 1:
+        x, y, width = changed[0]
+        if sum(u != v for u, v in zip(f'{x:0{width}}', f'{y:0{width}}')) == 1:
+            return 0.8
+    return 0.0
+
+
+def _birth_term(a, b):
+    birth = birth_similarity(a[2], b[2])
+    return BIRTH_WEIGHT * (UNKNOWN_BIRTH_SCORE if birth is None else birth)
+
+
+def _names_term(a, b):
+    first_a, last_a, _ = a
+    first_b, last_b, _ = b
+    last_weight, first_weight = NAME_WEIGHTS
+    best = 0.0
+    # As entered, then first and last names entered the wrong way round
+    for other_first, other_last in ((first_b, last_b), (last_b, first_b)):
+        first = name_similarity(first_a, other_first)
+        if first < MIN_FIRST_NAME_SIMILARITY:
+            continue
+        best = max(best, last_weight * name_similarity(last_a, other_last) + first_weight * first)
+    return best
+
+
+def match_score(a, b):
+    """
+    Probability-like score that two patient records describe the same woman.
+
+    Args:
+        a (tuple): (folded first name, folded last name, date of birth)
+        b (tuple): Same for the other record
+
+    Returns:
+        float: 0 to 1, compared with DUPLICATE_THRESHOLD
+    """
+    return _names_term(a, b) + _birth_term(a, b)
+
+
+def _duplicate_score(a, b):
+    # Different dates of birth rule a pair out before the costlier name comparison
+    birth = _birth_term(a, b)
+    if birth + sum(NAME_WEIGHTS) < DUPLICATE_THRESHOLD:
+        return None
+    score = _names_term(a, b) + birth
+    return score if score >= DUPLICATE_THRESHOLD else None
+
+
+def _profile(first_name, last_name, date_of_birth):
+    return normalize_name(first_name), normalize_name(last_name), _birth_date(date_of_birth)
+
+
+def _serialize(row):
+    return {'id': row.id, 'first_name': row.first_name, 'last_name': row.last_name,
+            'date_of_birth': row.date_of_birth}
+
+
+def find_duplicates(user_id, first_name, last_name, date_of_birth=None, exclude_id=None):
+    """
+    Find a midwife's patients that are probably the same woman as a new or
+    imported record. Only the patients sharing a blocking key are scored.
+
+    Args:
+        user_id (int): Midwife
+        first_name (str): First name of the record
+        last_name (str): Last name of the record
+        date_of_birth (date, optional): Date of birth of the record
+        exclude_id (int, optional): The record itself, when already saved
+
+    Returns:
+        list: Dicts with id, names, date_of_birth and score, best match first
+    """
+    keys = blocking_keys(first_name, last_name, _birth_date(date_of_birth))
+    if not keys:
+        return []
+
+    candidates = select(_match_keys.c.patient_id).where(
+        _match_keys.c.user_id == user_id, _match_keys.c.key.in_(keys))
+    query = select(Patient.id, Patient.first_name, Patient.last_name, Patient.date_of_birth).where(
+        Patient.id.in_(candidates))
+    if exclude_id is not None:
+        query = query.where(Patient.id != exclude_id)
+
+    profile = _profile(first_name, last_name, date_of_birth)
+    matches = []
+    for row in db.session.execute(query):
+        score = _duplicate_score(profile, _profile(row.first_name, row.last_name, row.date_of_birth))
+        if score is not None:
+            matches.append({**_serialize(row), 'score': round(score, 2)})
+    matches.sort(key=lambda match: -match['score'])
+    return matches
+
+
+def _block_pairs(patient_ids, profiles):
+    if len(patient_ids) <= MAX_BLOCK_SIZE:
+        return combinations(patient_ids, 2)
+    # Sorted neighbourhood: only names close in alphabetical order are compared
+    ordered = sorted(patient_ids, key=lambda patient_id: profiles[patient_id][1:2] + profiles[patient_id][:1])
+    return ((ordered[i], ordered[j]) for i in range(len(ordered))
+            for j in range(i + 1, min(i + BLOCK_WINDOW, len(ordered))))
+
+
+def scan_duplicates(user_id, progress=None):
+    """
+    Find every probable duplicate among a midwife's patients.
+
+    Keys are read in index order, so each block is compared on its own and
+    the work grows with the number of patients, not its square.
+
+    Args:
+        user_id (int): Midwife
+        progress (callable, optional): Called with (done, total) blocks as they are compared
+
+    Returns:
+        list: Pairs as dicts with the two patients and their score, best first
+    """
+    rows = {row.id: row for row in db.session.execute(
+        select(Patient.id, Patient.first_name, Patient.last_name, Patient.date_of_birth)
+        .where(Patient.user_id == user_id))}
+    profiles = {patient_id: _profile(row.first_name, row.last_name, row.date_of_birth)
+                for patient_id, row in rows.items()}
+
+    owned = _match_keys.c.user_id == user_id
+    total = db.session.execute(select(func.count(func.distinct(_match_keys.c.key))).where(owned)).scalar()
+    keys = db.session.execute(
+        select(_match_keys.c.key, _match_keys.c.patient_id).where(owned).order_by(_match_keys.c.key))
+    compared = set()
+    pairs = []
+    for done, (_, block) in enumerate(groupby(keys, key=lambda row: row.key), 1):
+        patient_ids = [row.patient_id for row in block if row.patient_id in profiles]
+        for a, b in _block_pairs(patient_ids, profiles):
+            pair = (a, b) if a < b else (b, a)
+            if pair in compared:
+                continue
+            compared.add(pair)
+            score = _duplicate_score(profiles[a], profiles[b])
+            if score is not None:
+                pairs.append({'patients': [_serialize(rows[pair[0]]), _serialize(rows[pair[1]])],
+                              'score': round(score, 2)})
+        if progress and done % 500 == 0:
+            progress(done, total)
+
+    pairs.sort(key=lambda pair: -pair['score'])
+    return pairs
+
+
+def _keys_rows(patient_id, user_id, first_name, last_name, date_of_birth):
+    return [{'user_id': user_id, 'key': key, 'patient_id': patient_id}
+            for key in blocking_keys(first_name, last_name, _birth_date(date_of_birth))]
+
+
+def rebuild_match_keys(user_id=None):
+    """
+    Recompute the blocking keys of every patient.
+
+    Args:
+        user_id (int, optional): Only this midwife's patients
+    """
+    connection = db.session.connection()
+    delete = _match_keys.delete()
+    query = select(Patient.id, Patient.user_id, Patient.first_name, Patient.last_name, Patient.date_of_birth)
+    if user_id is not None:
+        delete = delete.where(_match_keys.c.user_id == user_id)
+        query = query.where(Patient.user_id == user_id)
+    connection.execute(delete)
+
+    rows = []
+    for patient in db.session.execute(query.execution_options(yield_per=1000)):
+        rows.extend(_keys_rows(*patient))
+        if len(rows) >= 5000:
+            connection.execute(_match_keys.insert(), rows)
+            rows = []
+    if rows:
+        connection.execute(_match_keys.insert(), rows)
+    db.session.commit()
+
+
+def init_duplicate_detection():
+    """
+    Fill the blocking index from existing patients when it was never built.
+
+    Must be called inside an application context.
+    """
+    if db.session.execute(select(exists().select_from(_match_keys))).scalar() or \
+            not db.session.execute(select(exists().select_from(Patient.__table__))).scalar():
+        return
+    rebuild_match_keys()
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_match_keys(session, flush_context):
+    changed = [patient for patient in list(session.new) + list(session.dirty) + list(session.deleted)
+               if isinstance(patient, Patient)]
+    if not changed:
+        return
+
+    connection = session.connection()
+    connection.execute(_match_keys.delete().where(
+        _match_keys.c.patient_id.in_([patient.id for patient in changed])))
+    rows = []
+    for patient in changed:
+        if patient not in session.deleted:
+            rows.extend(_keys_rows(patient.id, patient.user_id, patient.first_name, patient.last_name,
+                                   patient.date_of_birth))
+    if rows:
+        connection.execute(_match_keys.insert(), rows)
+
+
+def _scan_task(user_id, payload, progress):
+    pairs = scan_duplicates(user_id, progress)
+    return {'pairs': pairs[:MAX_SCAN_PAIRS], 'total': len(pairs)}
+
+
+register_task('duplicate_scan', _scan_task, public=True)
@@ -0,0 +1,71 @@
+import re
+import threading
+
+from flask import current_app, render_template
+
+# Templates holding the per-user sections of base.html, by marker name
+USER_SECTIONS = {
+    'navbar': '_navbar.html',
+    'flash_messages': '_flash_messages.html',
+}
+
+_MARKER = re.compile(r'<!--fragment:(\w+)-->')
+
+# template name -> (template objects the shell was built from, shell parts)
+_shells = {}
+_shells_lock = threading.Lock()
+
+
+def precompile_templates(app):
+    """
+    Compile every Jinja template once at startup so the first request on each
+    page does not pay for parsing and code generation.
+
+    Args:
+        app (Flask): Application whose templates are loaded
+    """
+    env = app.jinja_env
+    for name in env.list_templates(extensions=['html']):
+        env.get_template(name)
+
+
+def _template_version(template_name):
+    # Jinja returns the same Template object until the source changes (and
+    # auto reload is on), so identity is enough to detect a new version.
+    env = current_app.jinja_env
+    return (env.get_template(template_name), env.get_template('base.html'))
+
+
+def _build_shell(template_name):
+    html = render_template(template_name, fragment_shell=True)
+    # split() with one group alternates text and section names
+    return _MARKER.split(html)
+
+
+def render_cached_page(template_name):
+    """
+    Render a page whose content is the same for every user.
+
+    The user-independent shell is rendered once per template version; only
+    the sections listed in USER_SECTIONS are rendered per request.
+
+    Args:
+        template_name (str): Name of a template without per-user context
+
+    Returns:
+        str: Full page HTML
+    """
+    version = _template_version(template_name)
+    with _shells_lock:
+        cached = _shells.get(template_name)
+    if cached is None or cached[0] != version:
+        cached = (version, _build_shell(template_name))
+        with _shells_lock:
+            _shells[template_name] = cached
+
+    parts = cached[1]
+    html = [parts[0]]
+    for i in range(1, len(parts), 2):
+        html.append(render_template(USER_SECTIONS[parts[i]]))
+        html.append(parts[i + 1])
+    return ''.join(html)
@@ -0,0 +1,130 @@
+import math
+from array import array
+
+# WHO Child Growth Standards, weight-for-age, weekly LMS parameters from
+# birth to 13 weeks: (L, M in kg, S) per completed week.
+WHO_WEIGHT_FOR_AGE_LMS = {
+    'M': [
+        (0.3487, 3.3464, 0.14602), (0.2297, 3.4791, 0.13395), (0.1970, 3.7529, 0.12385),
+        (0.1738, 4.0603, 0.11816), (0.1553, 4.3671, 0.11467), (0.1395, 4.6590, 0.11220),
+        (0.1257, 4.9303, 0.11031), (0.1134, 5.1817, 0.10878), (0.1021, 5.4149, 0.10750),
+        (0.0917, 5.6319, 0.10640), (0.0821, 5.8346, 0.10543), (0.0730, 6.0242, 0.10457),
+        (0.0644, 6.2019, 0.10380), (0.0563, 6.3694, 0.10311)
+    ],
+    'F': [
+        (0.3809, 3.2322, 0.14171), (0.1714, 3.3388, 0.13724), (0.0962, 3.5693, 0.12743),
+        (0.0402, 3.8352, 0.12093), (-0.0050, 4.0987, 0.11631), (-0.0430, 4.3476, 0.11284),
+        (-0.0756, 4.5793, 0.11012), (-0.1042, 4.7950, 0.10792), (-0.1297, 4.9959, 0.10609),
+        (-0.1524, 5.1842, 0.10454), (-0.1729, 5.3618, 0.10322), (-0.1915, 5.5294, 0.10208),
+        (-0.2085, 5.6883, 0.10108), (-0.2244, 5.8393, 0.10020)
+    ]
+}
+
+# Weight loss from birth weight (%) prompting a feeding assessment / medical review
+WEIGHT_LOSS_WARNING = 7.0
+WEIGHT_LOSS_EXCESSIVE = 10.0
+
+# Age (days) by which birth weight is expected to be regained
+BIRTH_WEIGHT_REGAIN_DAYS = 14
+
+
+def _daily_tables():
+    # Interpolate the weekly parameters once into per-day arrays
+    tables = {}
+    for sex, weeks in WHO_WEIGHT_FOR_AGE_LMS.items():
+        l_values, m_values, s_values = array('d'), array('d'), array('d')
+        for day in range((len(weeks) - 1) * 7 + 1):
+            week, offset = divmod(day, 7)
+            low = weeks[week]
+            high = weeks[min(week + 1, len(weeks) - 1)]
+            fraction = offset / 7
+            l_values.append(low[0] + (high[0] - low[0]) * fraction)
+            m_values.append(low[1] + (high[1] - low[1]) * fraction)
+            s_values.append(low[2] + (high[2] - low[2]) * fraction)
+        tables[sex] = (l_values, m_values, s_values)
+    return tables
+
+
+_LMS_BY_DAY = _daily_tables()
+MAX_AGE_DAYS = len(_LMS_BY_DAY['M'][0]) - 1
+
+
+def _lms_value(l, m, s, z):
+    return m * (1 + l * s * z) ** (1 / l) if l else m * math.exp(s * z)
+
+
+def lms_z_score(weight, l, m, s):
+    """
+    Compute a WHO z-score with the LMS method.
+
+    Beyond ±3 SD the WHO restricted method is used, so that extreme
+    weights are not inflated by the skewness correction.
+
+    Args:
+        weight (float): Weight in kg
+        l (float): Box-Cox power
+        m (float): Median in kg
+        s (float): Coefficient of variation
+
+    Returns:
+        float: z-score, or None for a missing or non-positive weight
+    """
+    if weight is None or weight <= 0:
+        return None
+    z = ((weight / m) ** l - 1) / (l * s) if l else math.log(weight / m) / s
+    if z > 3:
+        sd3 = _lms_value(l, m, s, 3)
+        return 3 + (weight - sd3) / (sd3 - _lms_value(l, m, s, 2))
+    if z < -3:
+        sd3 = _lms_value(l, m, s, -3)
+        return -3 + (weight - sd3) / (_lms_value(l, m, s, -2) - sd3)
+    return z
+
+
+def compute_growth_series(sex, birth_weight_g, measurements):
+    """
+    Assess a baby's whole weight series in one call.
+
+    Args:
+        sex (str): 'M' or 'F'; other values get no z-score
+        birth_weight_g (float): Birth weight in grams
+        measurements (list): (age in days, weight in kg) pairs
+
+    Returns:
+        list: One dict per measurement with the weight change from birth (%),
+        the weight-for-age z-score (None outside the reference range) and flags;
+        a non-positive weight gets neither change nor z-score
+    """
+    tables = _LMS_BY_DAY.get(sex)
+    birth_weight_kg = birth_weight_g / 1000 if birth_weight_g else None
+    results = []
+
+    for age_days, weight in measurements:
+        change = None
+        z_score = None
+        flags = []
+
+        if birth_weight_kg and weight > 0:
+            change = (weight - birth_weight_kg) / birth_weight_kg * 100
+            if change <= -WEIGHT_LOSS_EXCESSIVE:
+                flags.append('excessive_weight_loss')
+            elif change <= -WEIGHT_LOSS_WARNING:
+                flags.append('weight_loss_warning')
+            if age_days >= BIRTH_WEIGHT_REGAIN_DAYS and change < 0:
+                flags.append('birth_weight_not_regained')
+
+        if tables is not None and 0 <= age_days <= MAX_AGE_DAYS:
+            l_values, m_values, s_values = tables
+            z_score = lms_z_score(weight, l_values[age_days], m_values[age_days], s_values[age_days])
+            if z_score is not None and z_score < -2:
+                flags.append('low_weight_for_age')
+
+        results.append({
+            'age_days': age_days,
+            'weight': weight,
+            'weight_change_percent': round(change, 1) if change is not None else None,
+            'z_score': round(z_score, 2) if z_score is not None else None,
+            'flags': flags
+        })
+
+    return results
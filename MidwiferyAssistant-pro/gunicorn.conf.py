@@ -0,0 +1,35 @@
+import multiprocessing
+import os
+
+# Production server settings, used with: gunicorn -c gunicorn.conf.py main:app
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Load the application once in the master so workers share its memory
+# (compiled templates, vendor assets) through copy-on-write.
+preload_app = True
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 5
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+
+
+def post_fork(server, worker):
+    # Connections opened by the master while preloading must never be shared
+    # between processes: drop them from the child's pool without closing the
+    # sockets the master still owns.
+    from app import app, db
+    from sharding import dispose_tenant_engines
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    dispose_tenant_engines(close=False)
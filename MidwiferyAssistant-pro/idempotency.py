@@ -0,0 +1,250 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app import db
+from models import IdempotencyKey
+from unit_of_work import transaction, savepoint
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# Days a key is remembered; a device retrying later than this creates a new record
+IDEMPOTENCY_KEY_TTL_DAYS = 7
+
+# Seconds between two purges of a user's expired keys
+PURGE_INTERVAL = 3600
+
+# Mutations applied per transaction when replaying a queued batch
+REPLAY_TRANSACTION_SIZE = 200
+
+# Maximum number of mutations accepted in one replay request
+MAX_REPLAY_ITEMS = 5000
+
+KEY_REUSED_ERROR = "Clé d'idempotence déjà utilisée pour une autre requête"
+
+# Mutation type -> function(data) returning (payload, status)
+MUTATIONS = {}
+
+_next_purge = {}
+_purge_lock = threading.Lock()
+
+
+def register_mutation(name, apply):
+    """
+    Make a write replayable through the batch endpoint.
+
+    Args:
+        name (str): Mutation type sent by clients
+        apply (callable): Function taking the request data and returning
+            (payload, status); it must not commit
+    """
+    MUTATIONS[name] = apply
+
+
+def _hash64(data):
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def hash_key(key):
+    """
+    Reduce a client idempotency key to a signed 64-bit integer.
+
+    Args:
+        key (str): Key chosen by the client (usually a UUID)
+
+    Returns:
+        int: Hash stored in the dedupe index
+    """
+    return _hash64(key.encode('utf-8'))
+
+
+def hash_request(data):
+    """
+    Reduce the data of a write to a signed 64-bit integer, whatever the
+    order of its keys.
+
+    Args:
+        data (dict): Request body of the route, or data of a replayed mutation
+
+    Returns:
+        int: Hash stored with the key
+    """
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return _hash64(body.encode('utf-8'))
+
+
+def _purge_expired(user_id):
+    now = time.monotonic()
+    with _purge_lock:
+        if _next_purge.get(user_id, 0) > now:
+            return
+        _next_purge[user_id] = now + PURGE_INTERVAL
+    cutoff = datetime.utcnow() - timedelta(days=IDEMPOTENCY_KEY_TTL_DAYS)
+    IdempotencyKey.query.filter(IdempotencyKey.user_id == user_id,
+                                IdempotencyKey.created_at < cutoff).delete(synchronize_session=False)
+
+
+def _lookup(user_id, key_hash):
+    return db.session.get(IdempotencyKey, (user_id, key_hash))
+
+
+def _remember(user_id, key_hash, operation, request_hash, status, body):
+    # In its own savepoint: a concurrent retry that stored the key first
+    # makes this insert fail without losing the caller's transaction
+    try:
+        with savepoint():
+            db.session.add(IdempotencyKey(user_id=user_id, key_hash=key_hash, operation=operation,
+                                          request_hash=request_hash, status_code=status, response=body))
+            db.session.flush()
+    except IntegrityError:
+        return False
+    return True
+
+
+def _reused(stored, operation, request_hash):
+    # A key sent again with another write must not get the first one's response
+    return stored.operation != operation or stored.request_hash != request_hash
+
+
+def _replayed_response(stored):
+    response = current_app.response_class(stored.response, status=stored.status_code, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(operation):
+    """
+    Decorator deduplicating retried writes with the Idempotency-Key header.
+
+    Must run inside a unit of work (below @unit_of_work) so that the key is
+    committed atomically with the writes. The first successful response is
+    stored and returned again for every retry with the same key; error
+    responses are not stored, so a failed attempt can be retried. A key
+    already used for another operation or another body gets a 422.
+
+    Args:
+        operation (str): Mutation type of the write, so that a write sent
+            to the route and then replayed in a batch is recognized
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(*args, **kwargs)
+
+            user_id = current_user.id
+            key_hash = hash_key(key)
+            request_hash = hash_request(request.get_json(silent=True) or {})
+            stored = _lookup(user_id, key_hash)
+            if stored is not None:
+                if _reused(stored, operation, request_hash):
+                    return jsonify({'error': KEY_REUSED_ERROR}), 422
+                return _replayed_response(stored)
+
+            _purge_expired(user_id)
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code < 400 and not _remember(user_id, key_hash, operation, request_hash,
+                                                             response.status_code, response.get_data(as_text=True)):
+                # Another attempt with the same key won the race: undo ours
+                db.session.rollback()
+                stored = _lookup(user_id, key_hash)
+                if _reused(stored, operation, request_hash):
+                    return jsonify({'error': KEY_REUSED_ERROR}), 422
+                return _replayed_response(stored)
+            return response
+        return wrapper
+    return decorator
+
+
+class _Rejected(Exception):
+    def __init__(self, payload, status, replayed=False):
+        super().__init__(status)
+        self.payload = payload
+        self.status = status
+        self.replayed = replayed
+
+
+def _apply_item(user_id, item):
+    if not isinstance(item, dict):
+        return {'key': None, 'status': 400, 'body': {'error': 'Mutation invalide'}}
+    key = item.get('key')
+    operation = item.get('type')
+    apply = MUTATIONS.get(operation) if isinstance(operation, str) else None
+    if not key or not isinstance(key, str) or apply is None:
+        return {'key': key, 'status': 400, 'body': {'error': 'Mutation invalide'}}
+    data = item.get('data')
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return {'key': key, 'status': 400, 'body': {'error': 'Données invalides'}}
+
+    key_hash = hash_key(key)
+    request_hash = hash_request(data)
+    stored = _lookup(user_id, key_hash)
+    if stored is not None:
+        if _reused(stored, operation, request_hash):
+            return {'key': key, 'status': 422, 'body': {'error': KEY_REUSED_ERROR}}
+        return {'key': key, 'status': stored.status_code, 'body': json.loads(stored.response), 'replayed': True}
+
+    try:
+        with savepoint():
+            payload, status = apply(data)
+            if status >= 400:
+                # Undo anything the mutation wrote before refusing
+                raise _Rejected(payload, status)
+            if not _remember(user_id, key_hash, operation, request_hash, status, json.dumps(payload)):
+                stored = _lookup(user_id, key_hash)
+                if _reused(stored, operation, request_hash):
+                    raise _Rejected({'error': KEY_REUSED_ERROR}, 422)
+                raise _Rejected(json.loads(stored.response), stored.status_code, replayed=True)
+    except _Rejected as rejected:
+        result = {'key': key, 'status': rejected.status, 'body': rejected.payload}
+        if rejected.replayed:
+            result['replayed'] = True
+        return result
+    except (KeyError, ValueError, TypeError):
+        return {'key': key, 'status': 400, 'body': {'error': 'Données invalides'}}
+    except SQLAlchemyError:
+        logging.exception("Échec du rejeu de la mutation %s", key)
+        return {'key': key, 'status': 500, 'body': {'error': 'Erreur serveur'}}
+    return {'key': key, 'status': status, 'body': payload}
+
+
+def replay_mutations(user_id, items):
+    """
+    Apply a queued batch of mutations in order.
+
+    Items are applied REPLAY_TRANSACTION_SIZE at a time, one transaction per
+    group, each item in its own savepoint so that a rejected item does not
+    undo its neighbours. Items whose key was already applied get the stored
+    result back instead of being applied twice.
+
+    Args:
+        user_id (int): Midwife replaying the queue
+        items (list): Dicts with 'key', 'type' (see MUTATIONS) and 'data'
+
+    Returns:
+        list: One result per item with key, status, body and, when the key
+        had already been applied, replayed=True; malformed items get a 400
+        and a key reused for another write a 422
+    """
+    results = []
+    for start in range(0, len(items), REPLAY_TRANSACTION_SIZE):
+        with transaction():
+            # Begin the group's transaction before the first savepoint, so
+            # that releasing a savepoint never commits the items on their own
+            db.session.connection()
+            _purge_expired(user_id)
+            for item in items[start:start + REPLAY_TRANSACTION_SIZE]:
+                results.append(_apply_item(user_id, item))
+    return results
@@ -0,0 +1,508 @@
+import json
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, delete, exists, insert, or_, select, update
+
+from app import db
+from models import Job
+from sharding import dispose_tenant_engines, set_tenant
+from unit_of_work import transaction
+
+# Seconds between two looks at an idle queue
+POLL_INTERVAL = 1.0
+
+# Seconds a runner owns a job without renewing its lease. A job whose
+# runner died (restart, crash) is taken again once its lease has expired.
+LEASE_SECONDS = 300
+
+# Delay before the first retry of a failed job, doubled on every further attempt
+RETRY_DELAY_SECONDS = 30
+
+# Minimum seconds between two progress writes of the same job
+PROGRESS_INTERVAL = 0.5
+
+# Days finished jobs stay readable through the status API
+JOB_RETENTION_DAYS = 7
+
+# Priorities users may ask for; internal jobs can use any integer
+MAX_USER_PRIORITY = 10
+
+# Seconds between two checks of the periodic tasks by a runner
+PERIODIC_CHECK_INTERVAL = 60
+
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+Task = namedtuple('Task', 'function public')
+
+# Job kind -> Task
+TASKS = {}
+
+# Job kind -> seconds between two runs enqueued by the runners
+PERIODIC = {}
+
+_jobs = Job.__table__
+_app = None
+_runner = None
+
+
+def _engine():
+    return db.engines[Job.__bind_key__]
+
+
+def register_task(kind, function, public=False):
+    """
+    Make a function runnable from the job queue.
+
+    The function runs in a worker process, inside an application context
+    with the job's midwife as tenant and inside a unit of work that commits
+    its writes when it returns. It can be run again after a crash, so it
+    must be safe to repeat.
+
+    Args:
+        kind (str): Job kind used when enqueuing
+        function (callable): Function taking (user_id, payload, progress) and
+            returning a JSON-compatible result
+        public (bool): Whether users may enqueue it through the API
+    """
+    TASKS[kind] = Task(function, public)
+
+
+def register_periodic(kind, interval):
+    """
+    Have the job runners enqueue a registered task at a fixed interval.
+
+    Args:
+        kind (str): Registered task, run without user or payload
+        interval (int): Seconds between two runs, 0 disables it
+    """
+    if interval:
+        PERIODIC[kind] = interval
+    else:
+        PERIODIC.pop(kind, None)
+
+
+def enqueue_periodic_jobs(now=None):
+    """
+    Enqueue the periodic tasks that are due.
+
+    A task is due when no job of its kind is waiting or running and none
+    was created during its interval, so several runners, or a restarted
+    one, never multiply the runs.
+
+    Args:
+        now (datetime, optional): Reference time, defaults to utcnow
+
+    Returns:
+        list: Kinds enqueued
+    """
+    now = now or datetime.utcnow()
+    enqueued = []
+    with _engine().begin() as connection:
+        for kind, interval in PERIODIC.items():
+            recent = exists().where(_jobs.c.kind == kind, or_(
+                _jobs.c.status.in_(('queued', 'running')),
+                _jobs.c.created_at > now - timedelta(seconds=interval)))
+            if connection.execute(select(recent)).scalar():
+                continue
+            connection.execute(insert(_jobs).values(kind=kind, run_after=now, created_at=now))
+            enqueued.append(kind)
+    return enqueued
+
+
+def enqueue(kind, payload=None, user_id=None, priority=0, max_attempts=3, delay=0):
+    """
+    Add a job to the queue.
+
+    The job is written through the session, so it only becomes visible to
+    runners when the caller's unit of work commits, together with the data
+    it depends on.
+
+    Args:
+        kind (str): Registered task (see TASKS)
+        payload (dict, optional): JSON-compatible arguments of the task
+        user_id (int, optional): Midwife the task runs for
+        priority (int): Higher priorities run first
+        max_attempts (int): Runs allowed before the job is marked failed
+        delay (int): Seconds to wait before the first run
+
+    Returns:
+        Job: New job, flushed so that it has an id
+    """
+    if kind not in TASKS:
+        raise ValueError(f"Tâche inconnue : {kind}")
+
+    job = Job(kind=kind, payload=json.dumps(payload) if payload is not None else None, user_id=user_id,
+              priority=priority, max_attempts=max_attempts,
+              run_after=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def serialize_job(job):
+    """
+    Format a job for the status API.
+
+    Args:
+        job (Job): Job to describe
+
+    Returns:
+        dict: Status, progress, result or error of the job
+    """
+    percent = None
+    if job.status == 'succeeded':
+        # The last progress write may have been throttled away
+        percent = 100.0
+    elif job.progress_total:
+        percent = round(min(job.progress_done or 0, job.progress_total) * 100 / job.progress_total, 1)
+    return {
+        'id': job.id,
+        'type': job.kind,
+        'status': job.status,
+        'priority': job.priority,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'progress': {
+            'done': job.progress_done,
+            'total': job.progress_total,
+            'percent': percent,
+            'message': job.progress_message
+        },
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at
+    }
+
+
+def cancel_job(job):
+    """
+    Cancel a job that has not started yet.
+
+    Args:
+        job (Job): Job to cancel
+
+    Returns:
+        bool: False if the job was already taken by a runner or finished
+    """
+    cancelled = db.session.execute(
+        update(_jobs).where(_jobs.c.id == job.id, _jobs.c.status == 'queued')
+        .values(status='cancelled', finished_at=datetime.utcnow())
+    ).rowcount
+    db.session.expire(job)
+    return bool(cancelled)
+
+
+def claim_job(now=None):
+    """
+    Take the highest priority job that is ready to run.
+
+    Queued jobs whose delay has passed and running jobs whose lease has
+    expired are eligible. The claim is a single UPDATE, so concurrent
+    runners never take the same job.
+
+    Args:
+        now (datetime, optional): Reference time, defaults to utcnow
+
+    Returns:
+        Row: id, kind, attempts and max_attempts of the job, or None
+    """
+    now = now or datetime.utcnow()
+    ready = or_(and_(_jobs.c.status == 'queued', _jobs.c.run_after <= now),
+                and_(_jobs.c.status == 'running', _jobs.c.lease_expires_at < now))
+
+    with _engine().begin() as connection:
+        while True:
+            # Read first so that an idle queue never takes the write lock
+            if not connection.execute(select(exists().where(ready))).scalar():
+                return None
+
+            candidate = select(_jobs.c.id).where(ready).order_by(_jobs.c.priority.desc(), _jobs.c.id) \
+                .limit(1).scalar_subquery()
+            job = connection.execute(
+                update(_jobs).where(_jobs.c.id == candidate)
+                .values(status='running', attempts=_jobs.c.attempts + 1, started_at=now,
+                        lease_expires_at=now + timedelta(seconds=LEASE_SECONDS),
+                        progress_done=None, progress_total=None, progress_message=None)
+                .returning(_jobs.c.id, _jobs.c.kind, _jobs.c.attempts, _jobs.c.max_attempts)
+            ).first()
+            if job is None:
+                return None
+            if job.attempts <= job.max_attempts:
+                return job
+
+            # Its runners kept dying before finishing it
+            connection.execute(update(_jobs).where(_jobs.c.id == job.id).values(
+                status='failed', finished_at=now, lease_expires_at=None,
+                error="Le processus exécutant la tâche s'est arrêté trop de fois"))
+
+
+def renew_leases(job_ids):
+    """
+    Extend the leases of jobs still being run by this runner.
+
+    Args:
+        job_ids (list): Ids of the running jobs
+    """
+    with _engine().begin() as connection:
+        connection.execute(update(_jobs).where(_jobs.c.id.in_(job_ids), _jobs.c.status == 'running').values(
+            lease_expires_at=datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)))
+
+
+def finish_job(job_id, result=None, error=None, retry=True):
+    """
+    Record the outcome of a run.
+
+    A failed job goes back to the queue with an exponential delay until it
+    has used all its attempts.
+
+    Args:
+        job_id (int): Job that was run
+        result: JSON-compatible result when the run succeeded
+        error (str, optional): Error message when it failed
+        retry (bool): Whether a failure may be retried
+    """
+    now = datetime.utcnow()
+    running = and_(_jobs.c.id == job_id, _jobs.c.status == 'running')
+    with _engine().begin() as connection:
+        if error is None:
+            connection.execute(update(_jobs).where(running).values(
+                status='succeeded', result=json.dumps(result, default=str), error=None,
+                finished_at=now, lease_expires_at=None))
+            return
+
+        job = connection.execute(select(_jobs.c.attempts, _jobs.c.max_attempts).where(_jobs.c.id == job_id)).first()
+        if retry and job is not None and job.attempts < job.max_attempts:
+            delay = RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1)
+            values = {'status': 'queued', 'run_after': now + timedelta(seconds=delay)}
+        else:
+            values = {'status': 'failed', 'finished_at': now}
+        connection.execute(update(_jobs).where(running).values(error=error, lease_expires_at=None, **values))
+
+
+def purge_finished_jobs(now=None):
+    """
+    Delete finished jobs older than the retention window.
+
+    Args:
+        now (datetime, optional): Reference time, defaults to utcnow
+
+    Returns:
+        int: Number of jobs deleted
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=JOB_RETENTION_DAYS)
+    with _engine().begin() as connection:
+        return connection.execute(delete(_jobs).where(_jobs.c.status.in_(FINISHED_STATUSES),
+                                                      _jobs.c.finished_at < cutoff)).rowcount
+
+
+class JobProgress:
+    """
+    Callable given to tasks to report how far they are.
+
+    Writes are throttled to one every PROGRESS_INTERVAL seconds, except the
+    last one (done == total), and go through their own connection so that
+    they are visible while the task's transaction is still open.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._next_write = 0.0
+
+    def __call__(self, done, total=None, message=None):
+        now = time.monotonic()
+        if now < self._next_write and (total is None or done < total):
+            return
+        self._next_write = now + PROGRESS_INTERVAL
+        with _engine().begin() as connection:
+            connection.execute(update(_jobs).where(_jobs.c.id == self.job_id).values(
+                progress_done=done, progress_total=total, progress_message=message[:256] if message else None))
+
+
+def reset_forked_worker():
+    """
+    Initializer of pool processes forked from a web process.
+
+    Forgets the parent's signal handlers (gunicorn's) and pooled connections.
+    """
+    for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT, signal.SIGUSR1, signal.SIGUSR2,
+                   signal.SIGCHLD, signal.SIGTTIN, signal.SIGTTOU, signal.SIGWINCH):
+        signal.signal(signum, signal.SIG_DFL)
+    # Ctrl-C is handled by the runner, which lets running jobs finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.set_wakeup_fd(-1)
+    with _app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    dispose_tenant_engines(close=False)
+
+
+def _execute(job_id):
+    # Runs in a worker process. Errors are returned as text rather than
+    # raised, as not every exception survives pickling back to the runner.
+    try:
+        with _app.app_context():
+            job = db.session.get(Job, job_id)
+            task = TASKS[job.kind]
+            payload = json.loads(job.payload) if job.payload else {}
+            set_tenant(job.user_id)
+            with transaction():
+                result = task.function(job.user_id, payload, JobProgress(job_id))
+        return True, result
+    except Exception as exc:
+        logging.exception("Échec de la tâche %s", job_id)
+        return False, f"{type(exc).__name__}: {exc}"
+
+
+class JobRunner:
+    """
+    Claim queued jobs and run them on a pool of worker processes.
+
+    Args:
+        app (Flask): Application
+        workers (int): Number of worker processes, i.e. jobs run at once
+    """
+
+    def __init__(self, app, workers):
+        self.app = app
+        self.workers = workers
+        self.stop_event = threading.Event()
+        self._pool = None
+        self._running = {}  # future -> job id
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _submit(self, job):
+        if job.kind not in TASKS:
+            finish_job(job.id, error=f"Tâche inconnue : {job.kind}", retry=False)
+            return
+        for _ in range(2):
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=reset_forked_worker,
+                                                 mp_context=multiprocessing.get_context('fork'))
+            try:
+                self._running[self._pool.submit(_execute, job.id)] = job.id
+                return
+            except BrokenProcessPool:
+                # A worker died: replace the whole pool
+                self._pool = None
+        finish_job(job.id, error="Impossible de démarrer un processus de travail")
+
+    def _collect(self, future):
+        job_id = self._running.pop(future)
+        try:
+            succeeded, value = future.result()
+        except BrokenProcessPool:
+            succeeded, value = False, "Processus de travail interrompu"
+        except Exception as exc:
+            succeeded, value = False, f"{type(exc).__name__}: {exc}"
+        if succeeded:
+            finish_job(job_id, result=value)
+        else:
+            finish_job(job_id, error=value)
+
+    def run(self):
+        """
+        Run jobs until stop() is called.
+        """
+        next_renewal = next_purge = next_periodic = 0.0
+        with self.app.app_context():
+            while not self.stop_event.is_set():
+                try:
+                    while len(self._running) < self.workers:
+                        job = claim_job()
+                        if job is None:
+                            break
+                        self._submit(job)
+
+                    if self._running:
+                        done, _ = wait(list(self._running), timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._collect(future)
+                    else:
+                        self.stop_event.wait(POLL_INTERVAL)
+
+                    now = time.monotonic()
+                    if self._running and now >= next_renewal:
+                        renew_leases(list(self._running.values()))
+                        next_renewal = now + LEASE_SECONDS / 3
+                    if now >= next_purge:
+                        purge_finished_jobs()
+                        next_purge = now + 3600
+                    if now >= next_periodic:
+                        enqueue_periodic_jobs()
+                        next_periodic = now + PERIODIC_CHECK_INTERVAL
+                except Exception:
+                    logging.exception("Erreur de la file de tâches")
+                    self.stop_event.wait(POLL_INTERVAL)
+
+            # Let running jobs finish; queued ones wait for the next start
+            for future in list(self._running):
+                self._collect(future)
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+def start_job_runner(app, workers=None):
+    """
+    Start a job runner on a daemon thread of this process.
+
+    Only for processes that serve no forked children: the runner forks its
+    worker pool from a process that already runs threads.
+
+    Args:
+        app (Flask): Application
+        workers (int, optional): Worker processes (JOB_WORKERS by default)
+
+    Returns:
+        JobRunner: Started runner
+    """
+    global _runner
+    _runner = JobRunner(app, workers or app.config.get('JOB_WORKERS') or 1)
+    thread = threading.Thread(target=_runner.run, name='job-runner', daemon=True)
+    thread.start()
+    return _runner
+
+
+def init_jobs(app):
+    """
+    Register the job runner CLI.
+
+    Jobs are run by a dedicated `flask run-jobs` process. Importing the app
+    starts no thread and no pool, unless JOB_RUNNER_IN_PROCESS asks for a
+    runner in this process (single-process setups without gunicorn).
+
+    Args:
+        app (Flask): Application
+
+    Returns:
+        JobRunner: Runner started on a daemon thread, or None
+    """
+    global _app
+    _app = app
+
+    @app.cli.command('run-jobs')
+    @click.option('--workers', type=int, default=None, help="Worker processes (JOB_WORKERS by default)")
+    def run_jobs_command(workers):
+        """Run queued background jobs and the periodic tasks until interrupted."""
+        if _runner is not None:
+            _runner.stop()
+        runner = JobRunner(app, workers or app.config.get('JOB_WORKERS') or 1)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: runner.stop())
+        runner.run()
+
+    if not app.config.get('JOB_RUNNER_IN_PROCESS'):
+        return None
+    return start_job_runner(app)
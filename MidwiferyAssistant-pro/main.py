@@ -1,4 +1,14 @@
+import os
+
 from app import app
 
+# Development server only; in production run: gunicorn -c gunicorn.conf.py main:app
+# and the background jobs with: flask --app main run-jobs
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    debug = os.environ.get("FLASK_DEBUG") == "1"
+    # The development server runs its own job runner; with the reloader,
+    # only in the child process that serves requests
+    if not app.config["JOB_RUNNER_IN_PROCESS"] and (not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+        from jobs import start_job_runner
+        start_job_runner(app)
+    app.run(host="0.0.0.0", port=5000, debug=debug)
@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from sqlalchemy import select, inspect
 from app import db
 import json
 
@@ -237,6 +238,8 @@ class PostnatalCareReminder(db.Model):
         return f'<PostnatalCareReminder {self.title} on {self.reminder_date}>'
 
 class AuditLog(db.Model):
+    __table_args__ = (db.Index('ix_audit_log_user_timestamp', 'user_id', 'timestamp'),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     action = db.Column(db.String(128), nullable=False)
@@ -249,3 +252,228 @@ class AuditLog(db.Model):
 
     def __repr__(self):
         return f'<AuditLog {self.action}>'
+
+class ChangeLogEntry(db.Model):
+    """Latest change of each clinical record, numbered by a monotonic sequence for delta sync."""
+    __table_args__ = (
+        db.UniqueConstraint('record_type', 'record_id'),
+        db.Index('ix_change_log_entry_user_seq', 'user_id', 'id'),
+        # AUTOINCREMENT guarantees a sequence number is never reused after a delete
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)  # change sequence
+    record_type = db.Column(db.String(32), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    deleted = db.Column(db.Boolean, default=False, nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ChangeLogEntry {self.id} {self.record_type}:{self.record_id}>'
+
+class DataVersion(db.Model):
+    """Version of one midwife's cached collection, increased by every write to it (see versioning.py)."""
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    collection = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DataVersion {self.user_id}:{self.collection} {self.version}>'
+
+class DailyClinicalStat(db.Model):
+    """Daily rollup of one clinical indicator for one midwife (see analytics.py)."""
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    metric = db.Column(db.String(32), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False, default=0)  # trimester, Apgar score...
+    numerator = db.Column(db.Integer, nullable=False, default=0)
+    denominator = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DailyClinicalStat {self.metric} {self.day}>'
+
+class BloodPressureMilestone(db.Model):
+    """First reading of a patient in a trimester, or first hypertensive reading (see analytics.py)."""
+    # Kept when the readings themselves are archived into vitals blocks
+    __table_args__ = (db.Index('ix_blood_pressure_milestone_user_day', 'user_id', 'day'),
+                      {'sqlite_with_rowid': False})
+
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), primary_key=True, autoincrement=False)
+    kind = db.Column(db.String(16), primary_key=True)  # 'trimester_1' to 'trimester_3', or 'hypertensive'
+    reading_id = db.Column(db.Integer, nullable=False)
+    recorded_at = db.Column(db.DateTime, nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    trimester = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    def __repr__(self):
+        return f'<BloodPressureMilestone {self.patient_id} {self.kind} {self.day}>'
+
+class ClinicalStatDirtyDay(db.Model):
+    """Day whose rollups are out of date and must be recomputed before being read."""
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+
+    def __repr__(self):
+        return f'<ClinicalStatDirtyDay {self.user_id} {self.day}>'
+
+class IdempotencyKey(db.Model):
+    """Response of an already applied mutation, keyed by a hash of the client's idempotency key."""
+    # The primary key is the dedupe index itself, no separate rowid b-tree
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    key_hash = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    # The key only replays the same write: mutation type and hash of its data
+    operation = db.Column(db.String(32), nullable=False)
+    request_hash = db.Column(db.BigInteger, nullable=False)
+    status_code = db.Column(db.SmallInteger, nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.user_id}:{self.key_hash:x}>'
+
+class ChecklistState(db.Model):
+    """Checked items of a patient's checklist for one pregnancy stage, as a bitset (see checklists.py)."""
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), primary_key=True, autoincrement=False)
+    stage = db.Column(db.String(8), primary_key=True)
+    checked = db.Column(db.BigInteger, nullable=False, default=0)  # bit n = item n of the stage in the catalogue
+    catalogue_version = db.Column(db.SmallInteger, nullable=False)  # catalogue of the last write
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<ChecklistState {self.patient_id} {self.stage} {self.checked:b}>'
+
+class PatientMatchKey(db.Model):
+    """Blocking key of a patient for duplicate detection (see duplicates.py)."""
+    # The primary key is the lookup index: (midwife, key) -> patients
+    __table_args__ = (db.Index('ix_patient_match_key_patient', 'patient_id'),
+                      {'sqlite_with_rowid': False})
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    key = db.Column(db.String(48), primary_key=True)  # phonetic name and birth year, e.g. 'n:dl:1990'
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), primary_key=True, autoincrement=False)
+
+    def __repr__(self):
+        return f'<PatientMatchKey {self.key} {self.patient_id}>'
+
+class VitalsBlock(db.Model):
+    """Archived readings of one patient, compressed column by column (see vitals_archive.py)."""
+    __table_args__ = (db.Index('ix_vitals_block_patient', 'patient_id', 'series', 'last_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    series = db.Column(db.String(16), nullable=False)  # 'blood_pressure' or 'postnatal'
+    first_at = db.Column(db.DateTime, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    raw_size = db.Column(db.Integer, nullable=False)  # encoded size before compression
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<VitalsBlock {self.patient_id} {self.series} x{self.count}>'
+
+class Job(db.Model):
+    """Background task waiting in or taken from the local job queue (see jobs.py)."""
+    # Sidecar database: a task holding the main database's write lock can still report progress
+    __bind_key__ = 'jobs'
+    __table_args__ = (db.Index('ix_job_queue', 'status', 'priority', 'run_after'),
+                      db.Index('ix_job_user_created', 'user_id', 'created_at'))
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text)  # JSON
+    user_id = db.Column(db.Integer)  # tenant the task runs for (user.id, in another database)
+    priority = db.Column(db.Integer, nullable=False, default=0)  # higher runs first
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    progress_done = db.Column(db.Integer)
+    progress_total = db.Column(db.Integer)
+    progress_message = db.Column(db.String(256))
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    lease_expires_at = db.Column(db.DateTime)  # a running job past its lease is taken again
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+
+class AIRequestSlot(db.Model):
+    """AI request in progress, holding one of its user's numbered slots (see ai_proxy.py)."""
+    # Shared by every worker process; kept out of the main database's write lock
+    __bind_key__ = 'jobs'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    slot = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<AIRequestSlot {self.user_id}:{self.slot}>'
+
+
+def get_owner_id(connection, record):
+    """
+    Get the id of the midwife owning a clinical record.
+
+    Records without a user_id column are owned through their patient (or mother).
+
+    Args:
+        connection (Connection): Connection used to look up the patient
+        record (db.Model): Any clinical record
+
+    Returns:
+        int: Owner user id, or None if it cannot be resolved
+    """
+    user_id = getattr(record, 'user_id', None)
+    if user_id is not None:
+        return user_id
+
+    patient_id = getattr(record, 'patient_id', None) or getattr(record, 'mother_id', None)
+    if patient_id is None:
+        return None
+    return connection.execute(select(Patient.user_id).where(Patient.id == patient_id)).scalar()
+
+
+# Columns through which a record is owned by a midwife
+OWNER_COLUMNS = ('user_id', 'patient_id', 'mother_id')
+
+
+def get_previous_owner_id(connection, record):
+    """
+    Get the midwife who owned a record before its pending changes.
+
+    Args:
+        connection (Connection): Connection used to look up the patient
+        record (db.Model): Any clinical record being flushed
+
+    Returns:
+        int: Previous owner user id, or None if ownership did not change
+    """
+    state = inspect(record)
+    for column in OWNER_COLUMNS:
+        if column not in state.attrs:
+            continue
+        deleted = state.attrs[column].history.deleted
+        if not deleted or deleted[0] is None:
+            continue
+        if column == 'user_id':
+            return deleted[0]
+        return connection.execute(select(Patient.user_id).where(Patient.id == deleted[0])).scalar()
+    return None
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import threading
+
+from flask import current_app, url_for
+
+from assets import asset_urls
+
+# Pages opened at the bedside that must load without network (endpoint names)
+PRECACHE_PAGES = ('emergency', 'checklists', 'calculator', 'ultrasound')
+
+# Templates the precached pages are built from
+PRECACHE_TEMPLATES = ('base.html', '_navbar.html', '_flash_messages.html',
+                      'emergency.html', 'checklists.html', 'calculator.html', 'ultrasound.html')
+
+# Files under static/ used by the precached pages besides the script bundles,
+# including the reference data fetched by ultrasound.js
+PRECACHE_STATIC = (
+    'css/styles.css',
+    'js/emergency.js',
+    'js/checklists.js',
+    'js/calculator.js',
+    'js/ultrasound.js',
+    'js/ultrasound_reference.json',
+    'js/ultrasound_growth_chart.json',
+    'img/icon.svg',
+)
+
+_version = None
+_version_lock = threading.Lock()
+
+
+def _compute_version():
+    digest = hashlib.sha256()
+    loader = current_app.jinja_env.loader
+    for name in PRECACHE_TEMPLATES + ('service_worker.js',):
+        source, _, _ = loader.get_source(current_app.jinja_env, name)
+        digest.update(name.encode())
+        digest.update(source.encode())
+    for filename in PRECACHE_STATIC:
+        digest.update(filename.encode())
+        with open(os.path.join(current_app.static_folder, filename), 'rb') as f:
+            digest.update(f.read())
+    # Bundle and vendor URLs change with their content
+    for url in asset_urls():
+        digest.update(url.encode())
+    return digest.hexdigest()[:16]
+
+
+def cache_version():
+    """
+    Get the content hash of everything the service worker precaches.
+
+    It changes with any precached template, static file, script bundle or
+    vendor library, which changes the service worker script and makes
+    browsers install the new cache. Computed once per process (on every call in debug mode, where files are edited
+    while the server runs).
+
+    Returns:
+        str: 16 hex characters
+    """
+    global _version
+    if current_app.debug:
+        return _compute_version()
+    with _version_lock:
+        if _version is None:
+            _version = _compute_version()
+        return _version
+
+
+def precache_urls():
+    """
+    Get the URLs the service worker stores when it is installed.
+
+    Returns:
+        tuple: (same-origin URLs, external URLs)
+    """
+    urls = [url_for(endpoint) for endpoint in PRECACHE_PAGES]
+    urls += [url_for('static', filename=filename) for filename in PRECACHE_STATIC]
+    external = []
+    for url in asset_urls():
+        (external if url.startswith('http') else urls).append(url)
+    return urls, external
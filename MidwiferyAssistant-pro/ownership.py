@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+
+from flask import g, has_app_context
+from sqlalchemy import event, literal, union_all, select
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Patient, BabyRecord, DeliveryRecord
+from versioning import current_version, transaction_versions
+
+# Kinds of resolvable ids. Each name is also the versioned collection that
+# changes whenever ownership of that kind can change (see versioning.track).
+OWNERSHIP_KINDS = ('patients', 'babies', 'deliveries')
+
+# Users whose ownership answers are remembered per process
+OWNERSHIP_CACHE_USERS = 256
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _ownership_query(user_id, ids):
+    selects = []
+    if ids.get('patients'):
+        selects.append(select(literal('patients').label('kind'), Patient.id.label('id')).where(
+            Patient.id.in_(ids['patients']), Patient.user_id == user_id))
+    if ids.get('babies'):
+        selects.append(select(literal('babies').label('kind'), BabyRecord.id.label('id')).join(
+            Patient, Patient.id == BabyRecord.mother_id).where(
+            BabyRecord.id.in_(ids['babies']), Patient.user_id == user_id))
+    if ids.get('deliveries'):
+        selects.append(select(literal('deliveries').label('kind'), DeliveryRecord.id.label('id')).join(
+            Patient, Patient.id == DeliveryRecord.patient_id).where(
+            DeliveryRecord.id.in_(ids['deliveries']), Patient.user_id == user_id))
+    return selects[0] if len(selects) == 1 else union_all(*selects)
+
+
+def _versions(user_id):
+    return tuple(current_version(user_id, kind) for kind in OWNERSHIP_KINDS)
+
+
+def _shared_answers(user_id, versions):
+    # Answers remembered across requests, valid while the user's versions match
+    with _memo_lock:
+        entry = _memo.get(user_id)
+        if entry is None or entry[0] != versions:
+            entry = (versions, {kind: {} for kind in OWNERSHIP_KINDS})
+            _memo[user_id] = entry
+        _memo.move_to_end(user_id)
+        while len(_memo) > OWNERSHIP_CACHE_USERS:
+            _memo.popitem(last=False)
+        return entry[1]
+
+
+def _request_answers(user_id):
+    memo = g.setdefault('ownership_memo', {})
+    return memo.setdefault(user_id, {kind: {} for kind in OWNERSHIP_KINDS})
+
+
+def resolve_ownership(user_id, patients=(), babies=(), deliveries=()):
+    """
+    Find which of the given ids belong to a midwife, in at most one query.
+
+    Answers are memoized for the current request and, between requests, for
+    as long as the user's patient/baby/delivery versions are unchanged.
+    Uncommitted writes in the current transaction only clear the request
+    memo, so a rollback can never leave a stale answer behind.
+
+    Args:
+        user_id (int): Midwife whose ownership is checked
+        patients (iterable): Patient ids
+        babies (iterable): Baby record ids (owned through the mother)
+        deliveries (iterable): Delivery record ids (owned through the patient)
+
+    Returns:
+        dict: Kind ('patients', 'babies', 'deliveries') -> set of owned ids
+    """
+    requested = {'patients': set(patients), 'babies': set(babies), 'deliveries': set(deliveries)}
+    session = db.session()
+    shared_ok = not transaction_versions(session)
+    versions = _versions(user_id)
+    shared = _shared_answers(user_id, versions)
+    local = _request_answers(user_id)
+
+    owned = {kind: set() for kind in OWNERSHIP_KINDS}
+    missing = {}
+    for kind, ids in requested.items():
+        for record_id in ids:
+            answer = local[kind].get(record_id)
+            if answer is None and shared_ok:
+                answer = shared[kind].get(record_id)
+            if answer is None:
+                missing.setdefault(kind, set()).add(record_id)
+            elif answer:
+                owned[kind].add(record_id)
+
+    if missing:
+        found = {kind: set() for kind in OWNERSHIP_KINDS}
+        for kind, record_id in session.execute(_ownership_query(user_id, missing)):
+            found[kind].add(record_id)
+        # Only share answers read outside a pending write, under the versions
+        # read before the query
+        share = shared_ok and not transaction_versions(session)
+        for kind, ids in missing.items():
+            for record_id in ids:
+                is_owned = record_id in found[kind]
+                local[kind][record_id] = is_owned
+                if share:
+                    shared[kind][record_id] = is_owned
+            owned[kind] |= found[kind]
+
+    return owned
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_request_memo(session, flush_context):
+    # Any write to an owning model may change the answers of this request
+    if not has_app_context() or 'ownership_memo' not in g:
+        return
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Patient, BabyRecord, DeliveryRecord)):
+            g.pop('ownership_memo', None)
+            return
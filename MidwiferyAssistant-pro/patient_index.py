@@ -0,0 +1,250 @@
+import heapq
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, attributes
+
+from app import db
+from models import Patient
+from versioning import current_version, transaction_versions
+
+# Users whose index is kept in memory (least recently used are dropped)
+INDEX_CACHE_USERS = 256
+
+# Seconds between two reads of a user's 'patients' version. Writes of this
+# process update the index at commit; writes of other processes show up
+# within this delay.
+INDEX_VERSION_CHECK_INTERVAL = 2
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Letters NFKD does not decompose, and separators inside French names
+_FOLD = str.maketrans({'œ': 'oe', 'æ': 'ae', "'": ' ', '’': ' ', '-': ' ', '.': ' '})
+
+_indexes = OrderedDict()
+_next_check = {}
+_indexes_lock = threading.Lock()
+
+
+def normalize_name(text):
+    """
+    Fold a name for matching: lower case, no accents or ligatures, hyphens
+    and apostrophes as spaces ("Lætitia N'Diaye-Hérault" -> "laetitia n diaye herault").
+
+    Args:
+        text (str): Name or query
+
+    Returns:
+        str: Folded words separated by single spaces
+    """
+    text = unicodedata.normalize('NFKD', (text or '').casefold().translate(_FOLD))
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).split())
+
+
+class PatientNameIndex:
+    """
+    Immutable name index of one midwife's patients.
+
+    Every word of every name is a key of a sorted array, next to an array
+    of patient ids: a prefix is a bisect range. Updates build a new index
+    so that readers never see a half-modified one.
+    """
+
+    __slots__ = ('version', 'names', 'keys', 'ids', '_ranked', '_rank')
+
+    def __init__(self, names, version):
+        """
+        Args:
+            names (dict): Patient id -> (first_name, last_name)
+            version (int): 'patients' version the names were read at
+        """
+        self.version = version
+        self.names = names
+        entries = []
+        order = []
+        for patient_id, (first_name, last_name) in names.items():
+            last, first = normalize_name(last_name), normalize_name(first_name)
+            order.append((last, first, patient_id))
+            entries.extend((word, patient_id) for word in set((last + ' ' + first).split()))
+        entries.sort()
+        self.keys = [word for word, _ in entries]
+        self.ids = array('q', [patient_id for _, patient_id in entries])
+        # Display order (last name, first name) as plain integers
+        order.sort()
+        self._ranked = array('q', [patient_id for _, _, patient_id in order])
+        self._rank = {patient_id: rank for rank, patient_id in enumerate(self._ranked)}
+
+    def _prefix_range(self, word):
+        start = bisect_left(self.keys, word)
+        return start, bisect_left(self.keys, word + '\uffff', start)
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """
+        Find the patients whose names have a word starting with each word
+        of the query ("dia aw" finds "Awa Diallo").
+
+        Args:
+            query (str): Words typed by the user, in any order
+            limit (int): Maximum number of results
+
+        Returns:
+            list: Patient ids in last name, first name order
+        """
+        words = normalize_name(query).split()
+        if not words:
+            return self._ranked[:limit].tolist()
+
+        # Intersect the id ranges of the words, narrowest first
+        ranges = sorted((self._prefix_range(word) for word in words), key=lambda r: r[1] - r[0])
+        start, end = ranges[0]
+        candidates = set(self.ids[start:end])
+        for start, end in ranges[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(self.ids[start:end])
+
+        if len(candidates) * 4 < len(self._ranked):
+            return heapq.nsmallest(limit, candidates, key=self._rank.__getitem__)
+        # Most patients match: walking the display order fills the page sooner
+        results = []
+        for patient_id in self._ranked:
+            if patient_id in candidates:
+                results.append(patient_id)
+                if len(results) == limit:
+                    break
+        return results
+
+    def updated(self, changes, version):
+        """
+        Build the index with committed changes applied.
+
+        Args:
+            changes (dict): Patient id -> (first_name, last_name), or None if removed
+            version (int): 'patients' version including the changes
+
+        Returns:
+            PatientNameIndex: New index
+        """
+        names = dict(self.names)
+        for patient_id, name in changes.items():
+            if name is None:
+                names.pop(patient_id, None)
+            else:
+                names[patient_id] = name
+        return PatientNameIndex(names, version)
+
+
+def _load_index(user_id):
+    # Read the version first: a write committed during the query makes the
+    # index outdated at once instead of hiding the write
+    version = current_version(user_id, 'patients')
+    rows = db.session.execute(select(Patient.id, Patient.first_name, Patient.last_name)
+                              .where(Patient.user_id == user_id))
+    return PatientNameIndex({row.id: (row.first_name, row.last_name) for row in rows}, version)
+
+
+def get_patient_index(user_id):
+    """
+    Get a midwife's patient name index, built on first use and whenever a
+    write made by another process changed the midwife's patients.
+
+    The version is read from the database at most every
+    INDEX_VERSION_CHECK_INTERVAL seconds; in between, keystrokes are
+    answered from memory without a query.
+
+    Args:
+        user_id (int): Midwife
+
+    Returns:
+        PatientNameIndex: Current index
+    """
+    now = time.monotonic()
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is not None and _next_check.get(user_id, 0) > now:
+            _indexes.move_to_end(user_id)
+            return index
+
+    version = current_version(user_id, 'patients')
+    if index is None or index.version != version:
+        index = _load_index(user_id)
+    with _indexes_lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        _next_check[user_id] = now + INDEX_VERSION_CHECK_INTERVAL
+        while len(_indexes) > INDEX_CACHE_USERS:
+            dropped, _ = _indexes.popitem(last=False)
+            _next_check.pop(dropped, None)
+    return index
+
+
+def search_patient_names(user_id, query, limit=DEFAULT_LIMIT):
+    """
+    Typeahead search over a midwife's patients, answered from memory.
+
+    Args:
+        user_id (int): Midwife
+        query (str): Beginning of first and/or last name, accents optional
+        limit (int): Maximum number of results
+
+    Returns:
+        list: Dicts with id, first_name and last_name
+    """
+    index = get_patient_index(user_id)
+    return [{'id': patient_id, 'first_name': index.names[patient_id][0], 'last_name': index.names[patient_id][1]}
+            for patient_id in index.search(query, limit)]
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_patient_changes(session, flush_context):
+    changes = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Patient):
+            continue
+        if changes is None:
+            changes = session.info.setdefault('patient_index_changes', [])
+        previous = attributes.get_history(obj, 'user_id').deleted
+        for user_id in previous:
+            if user_id is not None and user_id != obj.user_id:
+                changes.append((user_id, obj.id, None))
+        name = None if obj in session.deleted else (obj.first_name, obj.last_name)
+        changes.append((obj.user_id, obj.id, name))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_patient_changes(session):
+    pending = session.info.pop('patient_index_changes', None)
+    if not pending:
+        return
+
+    by_user = {}
+    for user_id, patient_id, name in pending:
+        by_user.setdefault(user_id, {})[patient_id] = name
+
+    # Bumped at flush, still known until the transaction has ended
+    versions = transaction_versions(session)
+    with _indexes_lock:
+        for user_id, changes in by_user.items():
+            index = _indexes.get(user_id)
+            if index is None:
+                continue
+            before, after = versions.get((user_id, 'patients'), (None, None))
+            # The index is exactly the state this transaction started from;
+            # anything else means a write from another process, so the index
+            # is rebuilt on next use
+            if before == index.version:
+                _indexes[user_id] = index.updated(changes, after)
+            else:
+                del _indexes[user_id]
+                _next_check.pop(user_id, None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_patient_changes(session):
+    session.info.pop('patient_index_changes', None)
@@ -0,0 +1,458 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import and_, func, or_, select, union, union_all
+
+from app import app, db
+from clinical_rules import get_rules
+from growth import compute_growth_series
+from jobs import register_task, reset_forked_worker
+from models import (Patient, BloodPressureRecord, BiomedicalRecord, UltrasoundRecord, DeliveryRecord,
+                    BabyRecord, PostnatalCheckup, VaccinationRecord, BreastfeedingRecord, ChangeLogEntry)
+from sync import SYNCED_MODELS
+from utils import calculate_gestational_age
+from vitals_archive import read_vitals
+
+# PDF output is optional, installed with the "pdf" extra (pip install
+# ".[pdf]", WeasyPrint also needs the Pango system libraries): without it
+# reports are served as printable HTML, which the browser prints or saves
+# as PDF itself.
+try:
+    from weasyprint import HTML
+except ImportError:
+    HTML = None
+
+TEMPLATE = 'patient_report.html'
+
+MIMETYPES = {'html': 'text/html; charset=utf-8', 'pdf': 'application/pdf'}
+
+# Reports rendered at once by each web process
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+
+# Seconds a request waits for its report
+RENDER_TIMEOUT = 60
+
+# Rendered reports kept on disk; the oldest are removed beyond this
+REPORT_CACHE_FILES = 1000
+
+# Blood pressure readings shown in the trend
+BP_TREND_READINGS = 10
+
+# Difference (mmHg) between the mean of the last 3 readings and of the 3
+# before them above which the trend is reported as rising or falling
+BP_TREND_THRESHOLD = 5
+
+# Ultrasound examinations listed
+ULTRASOUND_RECORDS = 3
+
+# Hours looked back when printing the reports of a shift
+SHIFT_HOURS = 12
+
+# Maximum number of patients in one batch
+MAX_BATCH_PATIENTS = 200
+
+_pool = None
+_pool_lock = threading.Lock()
+_log = ChangeLogEntry.__table__
+
+
+def _template_token():
+    # Reports rendered by an older template are never served from the cache
+    with open(os.path.join(app.root_path, app.template_folder, TEMPLATE), 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+
+_template_version = _template_token()
+
+
+def available_formats():
+    return ['pdf', 'html'] if HTML is not None else ['html']
+
+
+def default_format():
+    return available_formats()[0]
+
+
+def _cache_dir():
+    path = app.config.get('REPORT_CACHE_DIR') or os.path.join(app.instance_path, 'reports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _cache_path(key, fmt):
+    return os.path.join(_cache_dir(), f"{key}.{fmt}")
+
+
+def read_cached_report(key, fmt):
+    """
+    Read a rendered report from the disk cache.
+
+    Args:
+        key (str): Report key (see report_key)
+        fmt (str): 'pdf' or 'html'
+
+    Returns:
+        bytes: Rendered report, or None when not cached
+    """
+    try:
+        with open(_cache_path(key, fmt), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _store_report(key, fmt, body):
+    path = _cache_path(key, fmt)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+    _evict()
+
+
+def _evict():
+    entries = [entry for entry in os.scandir(_cache_dir()) if not entry.name.endswith('.tmp')]
+    if len(entries) <= REPORT_CACHE_FILES:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - REPORT_CACHE_FILES]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def patient_data_version(patient_id):
+    """
+    Get a version of everything a patient's report shows.
+
+    Derived from the sync change log, which keeps the latest change
+    sequence of every record: any insert or update of a record of the
+    patient or of the patient's babies gives a new version. One query.
+
+    Args:
+        patient_id (int): Patient
+
+    Returns:
+        str: Opaque version string
+    """
+    babies = select(BabyRecord.id).where(BabyRecord.mother_id == patient_id)
+    conditions = {
+        'patient': Patient.id == patient_id,
+        'blood_pressure': BloodPressureRecord.patient_id == patient_id,
+        'biomedical': BiomedicalRecord.patient_id == patient_id,
+        'ultrasound': UltrasoundRecord.patient_id == patient_id,
+        'delivery': DeliveryRecord.patient_id == patient_id,
+        'baby': BabyRecord.mother_id == patient_id,
+        'postnatal_checkup': or_(PostnatalCheckup.patient_id == patient_id, PostnatalCheckup.baby_id.in_(babies)),
+        'vaccination': VaccinationRecord.baby_id.in_(babies),
+        'breastfeeding': BreastfeedingRecord.mother_id == patient_id,
+    }
+    changes = union_all(*(
+        select(_log.c.id.label('id')).join(
+            SYNCED_MODELS[record_type],
+            and_(_log.c.record_type == record_type, _log.c.record_id == SYNCED_MODELS[record_type].id)
+        ).where(condition)
+        for record_type, condition in conditions.items()
+    )).subquery()
+    # Count and sum as well as the maximum: a record moving to another
+    # patient can bring the maximum back to an earlier value
+    last, count, total = db.session.execute(
+        select(func.max(changes.c.id), func.count(), func.coalesce(func.sum(changes.c.id), 0))).one()
+    return f"{last or 0}.{count}.{int(total)}"
+
+
+def report_key(user_id, patient_id, version, fmt):
+    """
+    Build the cache key of a patient report.
+
+    Besides the data version, the key covers what else changes the output:
+    the day (gestational age), the clinical rules and the template.
+
+    Args:
+        user_id (int): Midwife (patient ids are only unique per shard)
+        patient_id (int): Patient
+        version (str): Result of patient_data_version
+        fmt (str): 'pdf' or 'html'
+
+    Returns:
+        str: Hex digest
+    """
+    parts = (user_id, patient_id, version, date.today().isoformat(), get_rules().version, _template_version, fmt)
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def _bp_trend(readings):
+    if len(readings) < 6:
+        return None
+    recent = sum(reading['systolic'] for reading in readings[-3:]) / 3
+    before = sum(reading['systolic'] for reading in readings[-6:-3]) / 3
+    if recent - before >= BP_TREND_THRESHOLD:
+        return 'hausse'
+    if before - recent >= BP_TREND_THRESHOLD:
+        return 'baisse'
+    return 'stable'
+
+
+def _pregnancy(patient, deliveries):
+    if not patient.last_period_date:
+        return None
+    last_period = datetime.combine(patient.last_period_date, time())
+    if any(delivery.delivery_date >= last_period for delivery in deliveries):
+        return None
+    cycle_length = patient.cycle_length or 28
+    weeks, days = calculate_gestational_age(last_period, cycle_length)
+    if weeks < 0 or weeks > 44:
+        return None
+    return {'weeks': weeks, 'days': days,
+            'term_date': (last_period + timedelta(days=280 - (cycle_length - 28))).date()}
+
+
+def _baby_summary(baby):
+    weighings = db.session.query(PostnatalCheckup.checkup_date, PostnatalCheckup.weight).filter(
+        PostnatalCheckup.baby_id == baby.id,
+        PostnatalCheckup.weight.isnot(None)
+    ).order_by(PostnatalCheckup.checkup_date).all()
+    series = compute_growth_series(baby.gender, baby.birth_weight,
+                                   [((checkup_date - baby.birth_date).days, weight) for checkup_date, weight in weighings])
+    vaccines = db.session.query(VaccinationRecord.vaccine_name, VaccinationRecord.date_administered).filter(
+        VaccinationRecord.baby_id == baby.id).order_by(VaccinationRecord.date_administered).all()
+    return {
+        'name': ' '.join(filter(None, (baby.first_name, baby.last_name))) or 'Bébé',
+        'birth_date': baby.birth_date,
+        'gender': baby.gender,
+        'birth_weight': baby.birth_weight,
+        'apgar': (baby.apgar_1min, baby.apgar_5min, baby.apgar_10min),
+        'nicu_required': baby.nicu_required,
+        'latest_growth': series[-1] if series else None,
+        'latest_weighing': weighings[-1][0] if weighings else None,
+        'vaccines': [{'name': name, 'date': administered} for name, administered in vaccines]
+    }
+
+
+def build_report_context(patient):
+    """
+    Gather the data printed in a patient's summary.
+
+    Runs in the requesting process (it needs the database); the result is
+    made of plain values so that it can be sent to a render process.
+
+    Args:
+        patient (Patient): Patient whose summary is printed
+
+    Returns:
+        dict: Template context of one patient
+    """
+    # Recent rows and archived blocks alike
+    readings = [
+        {column: reading[column] for column in ('recorded_at', 'systolic', 'diastolic', 'heart_rate')}
+        for reading in reversed(read_vitals(patient.id, 'blood_pressure', limit=BP_TREND_READINGS))
+    ]
+    rules = get_rules()
+    for reading in readings:
+        classification = rules.classify_blood_pressure(reading['systolic'], reading['diastolic'])
+        reading['status'] = classification.status
+        reading['message'] = classification.message
+
+    labs = None
+    record = BiomedicalRecord.query.filter_by(patient_id=patient.id).order_by(
+        BiomedicalRecord.recorded_at.desc()).first()
+    if record is not None:
+        values = {name: getattr(record, name)
+                  for name in ('hemoglobin', 'platelets', 'ferritin', 'hematocrit', 'ldh', 'alt', 'ast')}
+        labs = {'recorded_at': record.recorded_at, 'values': values, 'analysis': None}
+        if values['hemoglobin'] is not None and values['platelets'] is not None:
+            labs['analysis'] = rules.analyze_blood_results(values)
+
+    ultrasounds = [
+        {column: getattr(exam, column) for column in ('recorded_at', 'gestational_age', 'estimated_weight', 'bpd',
+                                                      'hc', 'ac', 'fl', 'placenta_location', 'amniotic_fluid_index')}
+        for exam in UltrasoundRecord.query.filter_by(patient_id=patient.id).order_by(
+            UltrasoundRecord.recorded_at.desc()).limit(ULTRASOUND_RECORDS)
+    ]
+
+    deliveries = DeliveryRecord.query.filter_by(patient_id=patient.id).order_by(
+        DeliveryRecord.delivery_date.desc()).all()
+    last_checkup = next(iter(read_vitals(patient.id, 'postnatal', limit=1)), None)
+    feeding = BreastfeedingRecord.query.filter_by(mother_id=patient.id).order_by(
+        BreastfeedingRecord.feeding_date.desc()).first()
+
+    postnatal = None
+    if deliveries:
+        delivery = deliveries[0]
+        postnatal = {
+            'delivery_date': delivery.delivery_date,
+            'delivery_type': delivery.delivery_type,
+            'delivery_location': delivery.delivery_location,
+            'blood_loss': delivery.blood_loss,
+            'complications': delivery.complications,
+            'days_since_delivery': (datetime.now() - delivery.delivery_date).days,
+            'last_checkup': {
+                'date': last_checkup['checkup_date'],
+                'temperature': last_checkup['temperature'],
+                'blood_pressure': (last_checkup['blood_pressure_systolic'], last_checkup['blood_pressure_diastolic']),
+                'symptoms': last_checkup['symptoms'],
+                'next_checkup_date': last_checkup['next_checkup_date']
+            } if last_checkup else None,
+            'feeding_type': feeding.feeding_type if feeding else None,
+            'babies': [_baby_summary(baby) for baby in BabyRecord.query.filter_by(mother_id=patient.id).order_by(
+                BabyRecord.birth_date.desc())]
+        }
+
+    return {
+        'patient': {
+            'id': patient.id,
+            'first_name': patient.first_name,
+            'last_name': patient.last_name,
+            'date_of_birth': patient.date_of_birth,
+            'age': (date.today() - patient.date_of_birth).days // 365 if patient.date_of_birth else None,
+            'last_period_date': patient.last_period_date,
+            'notes': patient.notes
+        },
+        'pregnancy': _pregnancy(patient, deliveries),
+        'blood_pressure': {'readings': readings, 'trend': _bp_trend(readings)},
+        'labs': labs,
+        'ultrasounds': ultrasounds,
+        'postnatal': postnatal,
+        'rules_version': rules.version
+    }
+
+
+def render_report(contexts, fmt):
+    """
+    Render one document holding the summaries of one or more patients.
+
+    Pure function of its arguments, run in a pool process.
+
+    Args:
+        contexts (list): Results of build_report_context, one page each
+        fmt (str): 'pdf' or 'html'
+
+    Returns:
+        bytes: Rendered document
+    """
+    html = app.jinja_env.get_template(TEMPLATE).render(reports=contexts, generated_at=datetime.now())
+    if fmt == 'pdf':
+        return HTML(string=html).write_pdf()
+    return html.encode('utf-8')
+
+
+def _render_in_pool(contexts, fmt):
+    global _pool
+    for _ in range(2):
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=REPORT_WORKERS, initializer=reset_forked_worker,
+                                            mp_context=multiprocessing.get_context('fork'))
+            pool = _pool
+        try:
+            return pool.submit(render_report, contexts, fmt).result(timeout=RENDER_TIMEOUT)
+        except BrokenProcessPool:
+            logging.exception("Processus de rendu des rapports interrompu")
+            with _pool_lock:
+                if _pool is pool:
+                    _pool = None
+    raise RuntimeError("Rendu du rapport impossible")
+
+
+def patient_report(user_id, patient, fmt):
+    """
+    Get a patient's printable summary, rendering it only when it changed.
+
+    Args:
+        user_id (int): Midwife printing the report
+        patient (Patient): Patient owned by the midwife
+        fmt (str): 'pdf' or 'html'
+
+    Returns:
+        tuple: (rendered document, cache key)
+    """
+    key = report_key(user_id, patient.id, patient_data_version(patient.id), fmt)
+    body = read_cached_report(key, fmt)
+    if body is None:
+        body = _render_in_pool([build_report_context(patient)], fmt)
+        _store_report(key, fmt, body)
+    return body, key
+
+
+def shift_patient_ids(user_id, hours=SHIFT_HOURS):
+    """
+    List the patients a midwife recorded something for during the last hours.
+
+    Args:
+        user_id (int): Midwife
+        hours (int): Length of the shift
+
+    Returns:
+        list: Patient ids, sorted
+    """
+    since = datetime.utcnow() - timedelta(hours=hours)
+    owned = Patient.user_id == user_id
+    seen = union(
+        select(BloodPressureRecord.patient_id).where(BloodPressureRecord.user_id == user_id,
+                                                     BloodPressureRecord.recorded_at >= since),
+        select(BiomedicalRecord.patient_id).join(Patient, Patient.id == BiomedicalRecord.patient_id).where(
+            owned, BiomedicalRecord.recorded_at >= since),
+        select(UltrasoundRecord.patient_id).join(Patient, Patient.id == UltrasoundRecord.patient_id).where(
+            owned, UltrasoundRecord.recorded_at >= since),
+        select(DeliveryRecord.patient_id).where(DeliveryRecord.user_id == user_id, DeliveryRecord.created_at >= since),
+        select(PostnatalCheckup.patient_id).where(PostnatalCheckup.user_id == user_id,
+                                                  PostnatalCheckup.patient_id.isnot(None),
+                                                  PostnatalCheckup.created_at >= since),
+        select(BabyRecord.mother_id).join(PostnatalCheckup, PostnatalCheckup.baby_id == BabyRecord.id).where(
+            PostnatalCheckup.user_id == user_id, PostnatalCheckup.created_at >= since)
+    ).subquery()
+    return sorted(db.session.execute(select(seen.c[0]).limit(MAX_BATCH_PATIENTS)).scalars())
+
+
+def batch_report(user_id, patient_ids, fmt, progress=None):
+    """
+    Render the summaries of several patients into one document.
+
+    The document is cached under a key built from every patient's report
+    key, so printing the same unchanged shift again costs nothing.
+
+    Args:
+        user_id (int): Midwife printing the reports
+        patient_ids (list): Patients to include, in order (others' patients are skipped)
+        fmt (str): 'pdf' or 'html'
+        progress (callable, optional): Called with (done, total, message)
+
+    Returns:
+        dict: key and format of the cached document, number of patients
+    """
+    patients = {patient.id: patient for patient in Patient.query.filter(
+        Patient.user_id == user_id, Patient.id.in_(patient_ids[:MAX_BATCH_PATIENTS]))}
+    ordered = [patients[patient_id] for patient_id in patient_ids if patient_id in patients]
+
+    keys = [report_key(user_id, patient.id, patient_data_version(patient.id), fmt) for patient in ordered]
+    key = hashlib.blake2b('|'.join(keys).encode(), digest_size=16).hexdigest()
+    result = {'key': key, 'format': fmt, 'patients': len(ordered)}
+    if read_cached_report(key, fmt) is not None:
+        return result
+
+    contexts = []
+    for done, patient in enumerate(ordered):
+        if progress:
+            progress(done, len(ordered) + 1, f"{patient.last_name} {patient.first_name}")
+        contexts.append(build_report_context(patient))
+    if progress:
+        progress(len(ordered), len(ordered) + 1, "Mise en page")
+    # Already in a job worker process: render here rather than in another pool
+    _store_report(key, fmt, render_report(contexts, fmt))
+    return result
+
+
+def _batch_report_task(user_id, payload, progress):
+    fmt = payload.get('format') if payload.get('format') in available_formats() else default_format()
+    patient_ids = payload.get('patient_ids') or shift_patient_ids(user_id, payload.get('hours') or SHIFT_HOURS)
+    return batch_report(user_id, [int(patient_id) for patient_id in patient_ids], fmt, progress)
+
+
+register_task('report_batch', _batch_report_task)
@@ -1,14 +1,42 @@
 import json
+import logging
+import math
+from functools import partial
 from datetime import datetime, timedelta
-from flask import render_template, redirect, url_for, flash, request, jsonify, session
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from flask import render_template, redirect, url_for, flash, request, jsonify, session, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
 from app import app, db
-from models import User, Patient, BloodPressureRecord, BiomedicalRecord, UltrasoundRecord, AuditLog, DeliveryRecord, BabyRecord, PostnatalCheckup, VaccinationRecord, BreastfeedingRecord, PostnatalCareReminder
-from utils import calculate_gestational_age, get_gestational_age_recommendations, analyze_blood_results, evaluate_blood_pressure
+from models import User, Patient, BloodPressureRecord, BiomedicalRecord, UltrasoundRecord, AuditLog, DeliveryRecord, BabyRecord, PostnatalCheckup, VaccinationRecord, BreastfeedingRecord, PostnatalCareReminder, Job
+from utils import calculate_gestational_age, get_gestational_age_recommendations, analyze_blood_results
+from clinical_rules import get_rules
+from versioning import versioned_json
+from fragments import render_cached_page
+from ai_proxy import find_provider, limiter, stream_answer
+from search import search_records
+from sync import get_changes
+from serializers import api_response, rows_as_dicts
+from audit_archive import query_audit_logs
+from growth import compute_growth_series
+from ownership import resolve_ownership
+from unit_of_work import unit_of_work, savepoint, get_commit_stats
+from idempotency import idempotent, register_mutation, replay_mutations, MAX_REPLAY_ITEMS
+from analytics import ROLLUPS, clinic_summary, daily_trend
+from sharding import set_tenant
+from jobs import TASKS, MAX_USER_PRIORITY, enqueue, serialize_job, cancel_job
+from checklists import CATALOGUE, load_checklist, update_checklist
+from offline import cache_version, precache_urls
+from patient_index import DEFAULT_LIMIT, MAX_LIMIT, search_patient_names
+from duplicates import find_duplicates
+from vaccination_schedule import STATUSES, get_vaccination_schedule, vaccination_reminders
+from vitals_archive import SERIES, read_vitals, vitals_scan_stats, vitals_storage_stats
+from reports import MIMETYPES, MAX_BATCH_PATIENTS, SHIFT_HOURS, available_formats, default_format, patient_report, read_cached_report
 
 # Authentication routes
 @app.route('/login', methods=['GET', 'POST'])
+@unit_of_work
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('dashboard'))
@@ -25,8 +53,8 @@ def login():
             return redirect(url_for('login'))
 
         login_user(user, remember=remember)
+        set_tenant(user.id)
         user.last_login = datetime.utcnow()
-        db.session.commit()
 
         # Log the login action
         log = AuditLog(
@@ -35,7 +63,6 @@ def login():
             ip_address=request.remote_addr
         )
         db.session.add(log)
-        db.session.commit()
 
         next_page = request.args.get('next')
         return redirect(next_page or url_for('dashboard'))
@@ -43,6 +70,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@unit_of_work
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('dashboard'))
@@ -73,7 +101,8 @@ def register():
         new_user.set_password(password)
 
         db.session.add(new_user)
-        db.session.commit()
+        db.session.flush()
+        set_tenant(new_user.id)
 
         # Log the registration
         log = AuditLog(
@@ -82,7 +111,6 @@ def register():
             ip_address=request.remote_addr
         )
         db.session.add(log)
-        db.session.commit()
 
         flash('Inscription réussie ! Vous pouvez maintenant vous connecter.', 'success')
         return redirect(url_for('login'))
@@ -91,6 +119,7 @@ def register():
 
 @app.route('/logout')
 @login_required
+@unit_of_work
 def logout():
     # Log the logout action
     log = AuditLog(
@@ -99,7 +128,6 @@ def logout():
         ip_address=request.remote_addr
     )
     db.session.add(log)
-    db.session.commit()
 
     logout_user()
     flash('Vous avez été déconnecté.', 'info')
@@ -108,7 +136,7 @@ def logout():
 # Main application routes
 @app.route('/')
 def index():
-    return render_template('index.html') # THIS IS THE CORRECTED LINE - Servir index.html
+    return render_cached_page('index.html') # THIS IS THE CORRECTED LINE - Servir index.html
 
 @app.route('/dashboard')
 @login_required
@@ -154,15 +182,38 @@ def api_calculate_gestational_age():
 @app.route('/checklists')
 @login_required
 def checklists():
-    return render_template('checklists.html')
+    return render_cached_page('checklists.html')
+
+@app.route('/api/patients/<int:patient_id>/checklists/<stage>', methods=['GET', 'PATCH'])
+@login_required
+@unit_of_work
+def api_patient_checklist(patient_id, stage):
+    if stage not in CATALOGUE:
+        return jsonify({'error': 'Checklist inconnue'}), 404
+    if patient_id not in resolve_ownership(current_user.id, patients=[patient_id])['patients']:
+        return jsonify({'error': 'Patient non trouvé'}), 404
+
+    if request.method == 'GET':
+        return api_response(load_checklist(patient_id, stage))
+
+    # {"items": {"c1-2": true, "l1-3": false}} : seuls ces éléments changent
+    changes = (request.json or {}).get('items')
+    if not isinstance(changes, dict) or not changes:
+        return jsonify({'error': 'Aucun élément à modifier'}), 400
+    try:
+        state = update_checklist(patient_id, stage, changes)
+    except KeyError:
+        return jsonify({'error': 'Élément de checklist inconnu'}), 400
+    return api_response(state)
 
 @app.route('/biomedical')
 @login_required
 def biomedical():
-    return render_template('biomedical.html')
+    return render_cached_page('biomedical.html')
 
 @app.route('/api/analyze_blood_results', methods=['POST'])
 @login_required
+@unit_of_work
 def api_analyze_blood_results():
     data = request.json
     hemoglobin = float(data.get('hemoglobin', 0))
@@ -192,7 +243,6 @@ def api_analyze_blood_results():
         )
 
         db.session.add(record)
-        db.session.commit()
 
         # Log the action
         log = AuditLog(
@@ -202,29 +252,63 @@ def api_analyze_blood_results():
             ip_address=request.remote_addr
         )
         db.session.add(log)
-        db.session.commit()
 
     return jsonify(results)
 
 
+@app.route('/api/ai/ask', methods=['POST'])
+@login_required
+def api_ai_ask():
+    data = request.json
+    prompt = (data.get('prompt') or '').strip()
+    provider_class = find_provider(data.get('provider', 'openai'), app.debug or app.testing)
+
+    if not prompt:
+        return jsonify({'error': 'Question vide'}), 400
+    if not provider_class:
+        return jsonify({'error': 'Fournisseur inconnu'}), 400
+
+    provider = provider_class.from_request(data.get('apiKey'))
+
+    slot = limiter.acquire(current_user.id)
+    if slot is None:
+        return jsonify({'error': 'Trop de requêtes simultanées'}), 429
+
+    # Les fragments sont relayés au fur et à mesure ; le créneau est libéré à la fermeture
+    # de la réponse, y compris si le client se déconnecte avant la fin
+    response = Response(stream_with_context(stream_answer(provider, prompt, current_user.id)),
+                        mimetype='text/event-stream')
+    response.call_on_close(partial(limiter.release, slot))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @app.route('/blood_pressure')
 @login_required
 def blood_pressure():
-    patients = Patient.query.filter_by(user_id=current_user.id).all()
-    return render_template('blood_pressure.html', patients=patients)
+    # La patiente est choisie par saisie semi-automatique (/api/patients/typeahead)
+    return render_cached_page('blood_pressure.html')
 
 
 @app.route('/api/record_blood_pressure', methods=['POST'])
 @login_required
+@unit_of_work
+@idempotent('blood_pressure')
 def api_record_blood_pressure():
-    data = request.json
+    payload, status = record_blood_pressure(request.json)
+    return jsonify(payload), status
+
+
+# Partagé par la route et le rejeu des écritures hors ligne
+def record_blood_pressure(data):
     systolic = int(data['systolic'])
     diastolic = int(data['diastolic'])
     heart_rate = int(data.get('heartRate', 0)) if data.get('heartRate') else None
     patient_id = int(data.get('patientId')) if data.get('patientId') else None
     notes = data.get('notes', '')
 
-    result = evaluate_blood_pressure(systolic, diastolic)
+    result = get_rules().classify_blood_pressure(systolic, diastolic)
 
     # Record the blood pressure measurement if a patient is selected
     if patient_id:
@@ -238,7 +322,6 @@ def api_record_blood_pressure():
         )
 
         db.session.add(record)
-        db.session.commit()
 
         # Log the action
         log = AuditLog(
@@ -248,27 +331,58 @@ def api_record_blood_pressure():
             ip_address=request.remote_addr
         )
         db.session.add(log)
-        db.session.commit()
 
-    return jsonify({
-        'status': result['status'],
-        'message': result['message'],
+    return {
+        'status': result.status,
+        'message': result.message,
         'saved': patient_id is not None
-    })
+    }, 200
 
 
 @app.route('/ultrasound')
 @login_required
 def ultrasound():
-    return render_template('ultrasound.html')
+    return render_cached_page('ultrasound.html')
 
 @app.route('/emergency')
 @login_required
 def emergency():
-    return render_template('emergency.html')
+    return render_cached_page('emergency.html')
+
+# Service worker servi à la racine pour que sa portée couvre toute l'application
+@app.route('/service-worker.js')
+def service_worker():
+    urls, external = precache_urls()
+    script = render_template('service_worker.js', version=cache_version(), urls=urls,
+                             external=external, fallback=url_for('emergency'))
+    response = Response(script, mimetype='application/javascript')
+    # Le navigateur doit revoir le script à chaque vérification pour détecter un nouveau cache
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/manifest.webmanifest')
+def web_manifest():
+    manifest = {
+        'name': 'ANIPS-F - Assistant Sage-Femme Expert',
+        'short_name': 'ANIPS-F',
+        'lang': 'fr',
+        'start_url': url_for('dashboard'),
+        'scope': '/',
+        'display': 'standalone',
+        'background_color': '#ffffff',
+        'theme_color': '#1a73e8',
+        'icons': [{
+            'src': url_for('static', filename='img/icon.svg'),
+            'sizes': 'any',
+            'type': 'image/svg+xml',
+            'purpose': 'any'
+        }]
+    }
+    return Response(json.dumps(manifest, ensure_ascii=False), mimetype='application/manifest+json')
 
 @app.route('/patients', methods=['GET', 'POST'])
 @login_required
+@unit_of_work
 def patients():
     if request.method == 'POST':
         first_name = request.form.get('first_name')
@@ -278,6 +392,14 @@ def patients():
         cycle_length = int(request.form.get('cycle_length', 28))
         notes = request.form.get('notes', '')
 
+        # Doublon probable (autre orthographe, import, transfert) : confirmation demandée
+        if not request.form.get('confirm_duplicate'):
+            duplicates = find_duplicates(current_user.id, first_name, last_name, date_of_birth)
+            if duplicates:
+                patients_list = Patient.query.filter_by(user_id=current_user.id).all()
+                return render_template('patients.html', patients=patients_list,
+                                       duplicates=duplicates, pending=request.form)
+
         new_patient = Patient(
             first_name=first_name,
             last_name=last_name,
@@ -289,7 +411,6 @@ def patients():
         )
 
         db.session.add(new_patient)
-        db.session.commit()
 
         # Log the action
         log = AuditLog(
@@ -299,7 +420,6 @@ def patients():
             ip_address=request.remote_addr
         )
         db.session.add(log)
-        db.session.commit()
 
         flash('Patient ajouté avec succès.', 'success')
         return redirect(url_for('patients'))
@@ -307,9 +427,144 @@ def patients():
     patients_list = Patient.query.filter_by(user_id=current_user.id).all()
     return render_template('patients.html', patients=patients_list)
 
+def _report_response(body, fmt, filename, etag=None):
+    response = Response(body, mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'inline; filename="{filename}.{fmt}"'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if etag:
+        response.set_etag(etag)
+        response.make_conditional(request)
+    return response
+
+
+@app.route('/patients/<int:patient_id>/report')
+@login_required
+def patient_summary_report(patient_id):
+    fmt = request.args.get('format') or default_format()
+    if fmt not in available_formats():
+        return jsonify({'error': 'Format de rapport indisponible', 'formats': available_formats()}), 400
+
+    patient = Patient.query.filter_by(id=patient_id, user_id=current_user.id).first_or_404()
+
+    # Rendu dans un processus séparé, puis mis en cache tant que le dossier ne change pas
+    body, key = patient_report(current_user.id, patient, fmt)
+    return _report_response(body, fmt, f"synthese-{patient.id}", etag=key)
+
+
+@app.route('/api/reports/batch', methods=['POST'])
+@login_required
+@unit_of_work
+def api_batch_reports():
+    data = request.json or {}
+    fmt = data.get('format') or default_format()
+    if fmt not in available_formats():
+        return jsonify({'error': 'Format de rapport indisponible', 'formats': available_formats()}), 400
+    try:
+        patient_ids = [int(patient_id) for patient_id in data.get('patient_ids') or []]
+        hours = min(max(int(data.get('hours', SHIFT_HOURS)), 1), 72)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Données invalides'}), 400
+    if len(patient_ids) > MAX_BATCH_PATIENTS:
+        return jsonify({'error': f'Trop de patientes (maximum {MAX_BATCH_PATIENTS})'}), 413
+
+    # Sans liste, les patientes vues pendant la garde (les dernières heures)
+    job = enqueue('report_batch', {'format': fmt, 'patient_ids': patient_ids, 'hours': hours},
+                  user_id=current_user.id, priority=5)
+    response = api_response({'job': serialize_job(job)}, 202)
+    response.headers['Location'] = url_for('api_job', job_id=job.id)
+    return response
+
+
+@app.route('/api/reports/batch/<int:job_id>')
+@login_required
+def api_batch_report(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id, kind='report_batch').first_or_404()
+    if job.status != 'succeeded':
+        return jsonify({'error': 'Rapports non disponibles', 'job': serialize_job(job)}), 409
+
+    result = json.loads(job.result)
+    body = read_cached_report(result['key'], result['format'])
+    if body is None:
+        return jsonify({'error': 'Rapports expirés, relancez la génération'}), 410
+    return _report_response(body, result['format'], f"garde-{job.id}")
+
+
+@app.route('/api/patients')
+@login_required
+@versioned_json('patients')
+def api_patients():
+    patients_data = rows_as_dicts(db.session.query(
+        Patient.id,
+        Patient.first_name,
+        Patient.last_name
+    ).filter(Patient.user_id == current_user.id).order_by(Patient.last_name, Patient.first_name))
+
+    return api_response({'patients': patients_data})
+
+
+# Saisie semi-automatique : servie depuis l'index des noms en mémoire ; la version
+# des patients n'est relue en base qu'au plus toutes les quelques secondes
+@app.route('/api/patients/typeahead')
+@login_required
+def api_patients_typeahead():
+    query = request.args.get('q', '')
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'Données invalides'}), 400
+
+    patients = search_patient_names(current_user.id, query, limit)
+
+    return api_response({'query': query, 'patients': patients})
+
+
+# Vérification des doublons avant l'enregistrement d'une patiente
+@app.route('/api/patients/duplicates')
+@login_required
+def api_patient_duplicates():
+    try:
+        date_of_birth = datetime.strptime(request.args['date_of_birth'], '%Y-%m-%d').date() \
+            if request.args.get('date_of_birth') else None
+        exclude_id = int(request.args['exclude']) if request.args.get('exclude') else None
+    except ValueError:
+        return jsonify({'error': 'Données invalides'}), 400
+
+    duplicates = find_duplicates(current_user.id, request.args.get('first_name', ''),
+                                 request.args.get('last_name', ''), date_of_birth, exclude_id)
+
+    return api_response({'duplicates': duplicates})
+
+
+@app.route('/api/search')
+@login_required
+def api_search():
+    query = request.args.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+    except ValueError:
+        return jsonify({'error': 'Données invalides'}), 400
+
+    results = search_records(current_user.id, query, limit)
+
+    return api_response({'query': query, 'results': results})
+
+
+@app.route('/api/sync')
+@login_required
+def api_sync():
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'Curseur invalide'}), 400
+    if since < 0:
+        return jsonify({'error': 'Curseur invalide'}), 400
+
+    return api_response(get_changes(current_user.id, since))
+
 
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
+@unit_of_work
 def profile():
     if request.method == 'POST':
         # Update profile
@@ -318,8 +573,6 @@ def profile():
             current_user.email = request.form.get('email')
             current_user.default_cycle_length = int(request.form.get('default_cycle_length', 28))
 
-            db.session.commit()
-
             flash('Profil mis à jour avec succès.', 'success')
 
         # Change password
@@ -334,7 +587,6 @@ def profile():
                 flash('Les nouveaux mots de passe ne correspondent pas.', 'danger')
             else:
                 current_user.set_password(new_password)
-                db.session.commit()
 
                 # Log the action
                 log = AuditLog(
@@ -343,7 +595,6 @@ def profile():
                     ip_address=request.remote_addr
                 )
                 db.session.add(log)
-                db.session.commit()
 
                 flash('Mot de passe modifié avec succès.', 'success')
 
@@ -355,6 +606,129 @@ def profile():
     return render_template('profile.html', user=current_user, audit_logs=audit_logs)
 
 
+@app.route('/api/audit_logs')
+@login_required
+def api_audit_logs():
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('end') else None
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+    except ValueError:
+        return jsonify({'error': 'Données invalides'}), 400
+
+    logs = query_audit_logs(app, current_user.id, start, end, limit)
+
+    return api_response({'logs': logs})
+
+
+# Historique des constantes : lignes récentes et blocs archivés fusionnés
+@app.route('/api/patients/<int:patient_id>/vitals/<series>')
+@login_required
+def api_patient_vitals(patient_id, series):
+    if series not in SERIES:
+        return jsonify({'error': 'Série inconnue'}), 404
+    if patient_id not in resolve_ownership(current_user.id, patients=[patient_id])['patients']:
+        return jsonify({'error': 'Patient non trouvé'}), 404
+
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('end') else None
+        limit = max(1, min(int(request.args.get('limit', 1000)), 10000))
+    except ValueError:
+        return jsonify({'error': 'Données invalides'}), 400
+
+    readings = read_vitals(patient_id, series, start, end, limit)
+
+    return api_response({'series': series, 'readings': readings})
+
+
+@app.route('/api/analytics/summary')
+@login_required
+@unit_of_work
+def api_analytics_summary():
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'error': 'Données invalides'}), 400
+
+    return api_response(clinic_summary(current_user.id, start, end))
+
+
+@app.route('/api/analytics/trend')
+@login_required
+@unit_of_work
+def api_analytics_trend():
+    metric = request.args.get('metric', '')
+    if metric not in ROLLUPS:
+        return jsonify({'error': 'Indicateur inconnu'}), 400
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else None
+        window = min(max(int(request.args.get('window', 30)), 1), 365)
+        bucket = int(request.args['bucket']) if request.args.get('bucket') else None
+    except ValueError:
+        return jsonify({'error': 'Données invalides'}), 400
+
+    return api_response({'metric': metric, 'window': window,
+                         'days': daily_trend(current_user.id, metric, start, end, window, bucket)})
+
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@login_required
+@unit_of_work
+def api_jobs():
+    if request.method == 'GET':
+        jobs = Job.query.filter_by(user_id=current_user.id).order_by(Job.created_at.desc()).limit(50).all()
+        return api_response({'jobs': [serialize_job(job) for job in jobs]})
+
+    data = request.json or {}
+    task = TASKS.get(data.get('type'))
+    if task is None or not task.public:
+        return jsonify({'error': 'Tâche inconnue'}), 400
+    try:
+        priority = max(-MAX_USER_PRIORITY, min(int(data.get('priority', 0)), MAX_USER_PRIORITY))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Priorité invalide'}), 400
+
+    job = enqueue(data['type'], data.get('payload') or {}, user_id=current_user.id, priority=priority)
+    response = api_response({'job': serialize_job(job)}, 202)
+    response.headers['Location'] = url_for('api_job', job_id=job.id)
+    return response
+
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    return api_response({'job': serialize_job(job)})
+
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+@unit_of_work
+def api_cancel_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if not cancel_job(job):
+        return jsonify({'error': 'La tâche a déjà démarré', 'job': serialize_job(job)}), 409
+    return api_response({'job': serialize_job(job)})
+
+
+@app.route('/api/metrics/commits')
+@login_required
+def api_commit_metrics():
+    # Commits par requête de ce worker (chaque commit SQLite est un fsync)
+    return api_response({'endpoints': get_commit_stats()})
+
+
+@app.route('/api/metrics/vitals')
+@login_required
+def api_vitals_metrics():
+    # Archive des constantes : place gagnée, et temps de lecture par mesure
+    # des lignes et des blocs dans ce worker
+    return api_response({'storage': vitals_storage_stats(), 'scan': vitals_scan_stats()})
+
+
 # Error handling
 @app.errorhandler(404)
 def page_not_found(e):
@@ -369,50 +743,152 @@ def internal_server_error(e):
 @app.route('/postnatal')
 @login_required
 def postnatal():
-    return render_template('postnatal.html')
+    return render_cached_page('postnatal.html')
 
 @app.route('/api/postnatal/babies')
 @login_required
+@versioned_json('babies')
 def api_babies():
-    babies = BabyRecord.query.join(Patient).filter(Patient.user_id == current_user.id).all()
+    # Projection de colonnes : ni objets ORM, ni chargement paresseux de la mère
+    babies_data = rows_as_dicts(db.session.query(
+        BabyRecord.id,
+        BabyRecord.first_name,
+        BabyRecord.last_name,
+        func.date(BabyRecord.birth_date).label('birth_date'),
+        BabyRecord.mother_id,
+        (Patient.last_name + ' ' + Patient.first_name).label('mother_name')
+    ).join(Patient, Patient.id == BabyRecord.mother_id).filter(Patient.user_id == current_user.id))
 
-    babies_data = []
-    for baby in babies:
-        babies_data.append({
-            'id': baby.id,
-            'first_name': baby.first_name,
-            'last_name': baby.last_name,
-            'birth_date': baby.birth_date.strftime('%Y-%m-%d'),
-            'mother_id': baby.mother_id,
-            'mother_name': f"{baby.mother.last_name} {baby.mother.first_name}"
-        })
-
-    return jsonify({'babies': babies_data})
+    return api_response({'babies': babies_data})
 
 
 @app.route('/api/postnatal/deliveries')
 @login_required
+@versioned_json('deliveries')
 def api_deliveries():
-    deliveries = DeliveryRecord.query.join(Patient).filter(Patient.user_id == current_user.id).order_by(DeliveryRecord.delivery_date.desc()).all()
-
-    deliveries_data = []
-    for delivery in deliveries:
-        deliveries_data.append({
-            'id': delivery.id,
-            'delivery_date': delivery.delivery_date.isoformat(),
-            'delivery_type': delivery.delivery_type,
-            'delivery_location': delivery.delivery_location,
-            'complications': delivery.complications,
-            'patient_id': delivery.patient_id,
-            'patient_name': f"{delivery.patient.last_name} {delivery.patient.first_name}"
-        })
-
-    return jsonify({'deliveries': deliveries_data})
+    deliveries_data = rows_as_dicts(db.session.query(
+        DeliveryRecord.id,
+        DeliveryRecord.delivery_date,
+        DeliveryRecord.delivery_type,
+        DeliveryRecord.delivery_location,
+        DeliveryRecord.complications,
+        DeliveryRecord.patient_id,
+        (Patient.last_name + ' ' + Patient.first_name).label('patient_name')
+    ).join(Patient, Patient.id == DeliveryRecord.patient_id).filter(
+        Patient.user_id == current_user.id
+    ).order_by(DeliveryRecord.delivery_date.desc()))
+
+    return api_response({'deliveries': deliveries_data})
+
+
+@app.route('/api/postnatal/growth/<int:baby_id>')
+@login_required
+def api_baby_growth(baby_id):
+    # Vérifier que le bébé appartient à un patient du midwife
+    baby = BabyRecord.query.join(Patient).filter(
+        BabyRecord.id == baby_id,
+        Patient.user_id == current_user.id
+    ).first()
+
+    if not baby:
+        return jsonify({'error': 'Bébé non trouvé'}), 404
+
+    # Toutes les pesées en une requête, évaluées en un seul appel
+    weighings = db.session.query(PostnatalCheckup.checkup_date, PostnatalCheckup.weight).filter(
+        PostnatalCheckup.baby_id == baby_id,
+        PostnatalCheckup.weight.isnot(None)
+    ).order_by(PostnatalCheckup.checkup_date).all()
+
+    series = compute_growth_series(
+        baby.gender,
+        baby.birth_weight,
+        [((checkup_date - baby.birth_date).days, weight) for checkup_date, weight in weighings]
+    )
+    for point, (checkup_date, weight) in zip(series, weighings):
+        point['date'] = checkup_date.strftime('%Y-%m-%d')
+
+    return api_response({
+        'baby_id': baby_id,
+        'birth_weight': baby.birth_weight,
+        'reference_available': baby.gender in ('M', 'F'),
+        'measurements': series
+    })
+
+# Calendrier vaccinal : doses dues, en retard et à venir de tous les bébés
+@app.route('/api/postnatal/vaccinations/schedule')
+@login_required
+def api_vaccination_schedule():
+    statuses = [status for status in request.args.get('status', '').split(',') if status]
+    if any(status not in STATUSES for status in statuses):
+        return jsonify({'error': 'Statut inconnu', 'statuses': STATUSES}), 400
+    try:
+        baby_id = int(request.args['baby_id']) if request.args.get('baby_id') else None
+    except ValueError:
+        return jsonify({'error': 'Données invalides'}), 400
+
+    today = datetime.now().date()
+    doses = [dose for dose in get_vaccination_schedule(current_user.id, today)
+             if (not statuses or dose['status'] in statuses) and (baby_id is None or dose['baby_id'] == baby_id)]
+    counts = {status: sum(dose['status'] == status for dose in doses) for status in STATUSES}
+
+    return api_response({'date': today, 'counts': counts, 'doses': doses})
+
+
+# Rappels enregistrés et rappels de vaccination calculés, présentés ensemble
+@app.route('/api/postnatal/reminders')
+@login_required
+def api_postnatal_reminders():
+    reminder_type = request.args.get('type')
+    priority = request.args.get('priority')
+    status = request.args.get('status')
+
+    query = db.session.query(
+        PostnatalCareReminder.id,
+        PostnatalCareReminder.title,
+        PostnatalCareReminder.description,
+        PostnatalCareReminder.reminder_date,
+        PostnatalCareReminder.reminder_type,
+        PostnatalCareReminder.priority,
+        PostnatalCareReminder.completed,
+        PostnatalCareReminder.patient_id,
+        PostnatalCareReminder.baby_id,
+        (Patient.last_name + ' ' + Patient.first_name).label('patient_name'),
+        BabyRecord.first_name.label('baby_name')
+    ).outerjoin(Patient, Patient.id == PostnatalCareReminder.patient_id).outerjoin(
+        BabyRecord, BabyRecord.id == PostnatalCareReminder.baby_id
+    ).filter(PostnatalCareReminder.user_id == current_user.id)
+    if reminder_type:
+        query = query.filter(PostnatalCareReminder.reminder_type == reminder_type)
+    if priority:
+        query = query.filter(PostnatalCareReminder.priority == priority)
+    if status in ('pending', 'completed'):
+        query = query.filter(PostnatalCareReminder.completed.is_(status == 'completed'))
+    reminders = [dict(reminder, source='reminder') for reminder in
+                 rows_as_dicts(query.order_by(PostnatalCareReminder.reminder_date).limit(500))]
+
+    # Les rappels de vaccination disparaissent quand la dose est enregistrée
+    if reminder_type in (None, 'baby') and status != 'completed':
+        reminders.extend(reminder for reminder in vaccination_reminders(current_user.id)
+                         if not priority or reminder['priority'] == priority)
+    reminders.sort(key=lambda reminder: (reminder['completed'], str(reminder['reminder_date'])))
+
+    return api_response({'reminders': reminders})
+
 
 @app.route('/api/postnatal/checkup', methods=['POST'])
 @login_required
+@unit_of_work
+@idempotent('checkup')
 def api_record_checkup():
-    data = request.json
+    try:
+        payload, status = record_checkup(request.json)
+    except (KeyError, ValueError, TypeError):
+        return jsonify({'error': 'Données invalides'}), 400
+    return jsonify(payload), status
+
+
+# Partagé par la route et le rejeu des écritures hors ligne
+def record_checkup(data):
     checkup_type = data.get('checkup_type')
 
     # Créer le checkup de base
@@ -432,6 +908,8 @@ def api_record_checkup():
         notes=data.get('notes'),
         user_id=current_user.id
     )
+    if checkup.weight is not None and not (checkup.weight > 0 and math.isfinite(checkup.weight)):
+        return {'error': 'Poids invalide'}, 400
 
     # Ajouter la date du prochain checkup si fournie
     if data.get('next_checkup_date'):
@@ -445,22 +923,16 @@ def api_record_checkup():
     if checkup_type == 'mother':
         patient_id = int(data.get('patient_id'))
         # Vérifier que le patient appartient au midwife connecté
-        patient = Patient.query.filter_by(id=patient_id, user_id=current_user.id).first()
-        if not patient:
-            return jsonify({'error': 'Patient non trouvé'}), 404
+        if patient_id not in resolve_ownership(current_user.id, patients=[patient_id])['patients']:
+            return {'error': 'Patient non trouvé'}, 404
 
         checkup.patient_id = patient_id
 
     elif checkup_type == 'baby':
         baby_id = int(data.get('baby_id'))
         # Vérifier que le bébé appartient à un patient du midwife connecté
-        baby = BabyRecord.query.join(Patient).filter(
-            BabyRecord.id == baby_id,
-            Patient.user_id == current_user.id
-        ).first()
-
-        if not baby:
-            return jsonify({'error': 'Bébé non trouvé'}), 404
+        if baby_id not in resolve_ownership(current_user.id, babies=[baby_id])['babies']:
+            return {'error': 'Bébé non trouvé'}, 404
 
         checkup.baby_id = baby_id
 
@@ -480,10 +952,10 @@ def api_record_checkup():
         ip_address=request.remote_addr
     )
     db.session.add(log)
+    db.session.flush()
 
-    db.session.commit()
-
-    # Créer un rappel automatique pour le prochain checkup si la date est fournie
+    # Créer un rappel automatique pour le prochain checkup si la date est fournie ;
+    # un échec du rappel ne doit pas annuler le suivi
     if checkup.next_checkup_date:
         reminder = PostnatalCareReminder(
             title=f"Prochain suivi postnatal ({checkup_type})",
@@ -499,26 +971,31 @@ def api_record_checkup():
         else:
             reminder.baby_id = baby_id
 
-        db.session.add(reminder)
-        db.session.commit()
+        try:
+            with savepoint():
+                db.session.add(reminder)
+                db.session.flush()
+        except SQLAlchemyError:
+            logging.exception("Impossible de créer le rappel de suivi postnatal")
 
-    return jsonify({'success': True, 'checkup_id': checkup.id})
+    return {'success': True, 'checkup_id': checkup.id}, 200
 
 
 @app.route('/api/postnatal/vaccination', methods=['POST'])
 @login_required
+@unit_of_work
+@idempotent('vaccination')
 def api_record_vaccination():
-    data = request.json
+    payload, status = record_vaccination(request.json)
+    return jsonify(payload), status
 
+
+# Partagé par la route et le rejeu des écritures hors ligne
+def record_vaccination(data):
     # Vérifier que le bébé appartient à un patient du midwife
     baby_id = int(data.get('baby_id'))
-    baby = BabyRecord.query.join(Patient).filter(
-        BabyRecord.id == baby_id,
-        Patient.user_id == current_user.id
-    ).first()
-
-    if not baby:
-        return jsonify({'error': 'Bébé non trouvé'}), 404
+    if baby_id not in resolve_ownership(current_user.id, babies=[baby_id])['babies']:
+        return {'error': 'Bébé non trouvé'}, 404
 
     # Analyser la date d'expiration si fournie
     expiration_date = None
@@ -550,32 +1027,31 @@ def api_record_vaccination():
         ip_address=request.remote_addr
     )
     db.session.add(log)
+    db.session.flush()
 
-    db.session.commit()
-
-    return jsonify({'success': True, 'vaccination_id': vaccination.id})
+    return {'success': True, 'vaccination_id': vaccination.id}, 200
 
 @app.route('/api/postnatal/breastfeeding', methods=['POST'])
 @login_required
+@unit_of_work
+@idempotent('breastfeeding')
 def api_record_breastfeeding():
-    data = request.json
+    payload, status = record_breastfeeding(request.json)
+    return jsonify(payload), status
 
-    # Vérifier que le bébé appartient à un patient du midwife
-    baby_id = int(data.get('baby_id'))
-    baby = BabyRecord.query.join(Patient).filter(
-        BabyRecord.id == baby_id,
-        Patient.user_id == current_user.id
-    ).first()
 
-    if not baby:
-        return jsonify({'error': 'Bébé non trouvé'}), 404
-
-    # Vérifier que la mère est bien la patiente du midwife
+# Partagé par la route et le rejeu des écritures hors ligne
+def record_breastfeeding(data):
+    # Vérifier en une requête que le bébé et la mère appartiennent au midwife
+    baby_id = int(data.get('baby_id'))
     mother_id = int(data.get('mother_id'))
-    mother = Patient.query.filter_by(id=mother_id, user_id=current_user.id).first()
+    owned = resolve_ownership(current_user.id, patients=[mother_id], babies=[baby_id])
+
+    if baby_id not in owned['babies']:
+        return {'error': 'Bébé non trouvé'}, 404
 
-    if not mother:
-        return jsonify({'error': 'Mère non trouvée'}), 404
+    if mother_id not in owned['patients']:
+        return {'error': 'Mère non trouvée'}, 404
 
     # Créer l'enregistrement d'allaitement
     breastfeeding = BreastfeedingRecord(
@@ -599,7 +1075,26 @@ def api_record_breastfeeding():
         ip_address=request.remote_addr
     )
     db.session.add(log)
+    db.session.flush()
 
-    db.session.commit()
+    return {'success': True, 'breastfeeding_id': breastfeeding.id}, 200
 
-    return jsonify({'success': True, 'breastfeeding_id': breastfeeding.id})
+
+# Rejeu des écritures mises en file par les tablettes hors ligne
+register_mutation('blood_pressure', record_blood_pressure)
+register_mutation('checkup', record_checkup)
+register_mutation('vaccination', record_vaccination)
+register_mutation('breastfeeding', record_breastfeeding)
+
+
+@app.route('/api/replay', methods=['POST'])
+@login_required
+def api_replay():
+    body = request.get_json(silent=True)
+    items = (body.get('mutations') or []) if isinstance(body, dict) else None
+    if not isinstance(items, list):
+        return jsonify({'error': 'Données invalides'}), 400
+    if len(items) > MAX_REPLAY_ITEMS:
+        return jsonify({'error': f'Trop de mutations (maximum {MAX_REPLAY_ITEMS})'}), 413
+
+    return api_response({'results': replay_mutations(current_user.id, items)})
@@ -0,0 +1,191 @@
+import logging
+import re
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from app import db
+from jobs import register_task
+from sharding import register_shard_initializer, register_after_split
+from models import (Patient, BloodPressureRecord, BiomedicalRecord, UltrasoundRecord, DeliveryRecord,
+                    BabyRecord, PostnatalCheckup, VaccinationRecord, BreastfeedingRecord,
+                    PostnatalCareReminder, get_owner_id)
+
+SEARCH_TABLE = 'clinical_search'
+
+# record type -> (model, code used in the FTS rowid, indexed text columns)
+INDEXED_MODELS = {
+    'patient': (Patient, 1, ('last_name', 'first_name', 'notes')),
+    'blood_pressure': (BloodPressureRecord, 2, ('notes',)),
+    'biomedical': (BiomedicalRecord, 3, ('notes',)),
+    'ultrasound': (UltrasoundRecord, 4, ('placenta_location', 'notes')),
+    'delivery': (DeliveryRecord, 5, ('delivery_type', 'complications', 'anesthesia_type', 'notes')),
+    'baby': (BabyRecord, 6, ('last_name', 'first_name', 'resuscitation_details', 'congenital_anomalies', 'notes')),
+    'postnatal_checkup': (PostnatalCheckup, 7, ('symptoms', 'physical_exam', 'recommendations', 'medications', 'notes')),
+    'vaccination': (VaccinationRecord, 8, ('vaccine_name', 'reaction', 'notes')),
+    'breastfeeding': (BreastfeedingRecord, 9, ('feeding_type', 'issues', 'notes')),
+    'reminder': (PostnatalCareReminder, 10, ('title', 'description')),
+}
+
+# The FTS rowid packs the record id and its type so that a record can be
+# replaced or removed by rowid instead of scanning the unindexed columns.
+TYPE_CODE_BITS = 4
+
+_by_model = {model: (record_type, code, columns)
+             for record_type, (model, code, columns) in INDEXED_MODELS.items()}
+
+_enabled = False
+
+
+def _rowid(code, record_id):
+    return (record_id << TYPE_CODE_BITS) | code
+
+
+def create_search_table(connection):
+    """
+    Create the FTS5 table on a connection if it does not exist yet.
+
+    Args:
+        connection (Connection): SQLite connection
+
+    Returns:
+        bool: True if the table was created, False if it already existed
+    """
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': SEARCH_TABLE}
+    ).scalar()
+    if not exists:
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            "body, record_type UNINDEXED, record_id UNINDEXED, "
+            "user_id UNINDEXED, patient_id UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+    return not exists
+
+
+def init_search_index():
+    """
+    Create the FTS5 index if needed and fill it from existing records.
+
+    Must be called inside an application context. The index is only
+    maintained on SQLite builds that include FTS5; in sharded mode every
+    shard gets its own index.
+    """
+    global _enabled
+    if db.engine.dialect.name != 'sqlite':
+        logging.info("Index de recherche désactivé : base de données non SQLite")
+        return
+
+    try:
+        with db.engine.begin() as connection:
+            created = create_search_table(connection)
+    except Exception:
+        logging.exception("FTS5 indisponible, recherche désactivée")
+        return
+
+    _enabled = True
+    register_shard_initializer(create_search_table)
+    register_after_split(rebuild_search_index)
+    if created:
+        rebuild_search_index()
+
+
+def rebuild_search_index(progress=None):
+    """
+    Rebuild the whole index from the clinical tables.
+
+    Args:
+        progress (callable, optional): Called with (done, total, record type) after each table
+    """
+    connection = db.session.connection()
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    for done, (record_type, (model, code, columns)) in enumerate(INDEXED_MODELS.items(), 1):
+        for record in db.session.query(model).yield_per(1000):
+            _index_record(connection, record)
+        if progress:
+            progress(done, len(INDEXED_MODELS), record_type)
+    db.session.commit()
+
+
+def _record_body(record, columns):
+    return '\n'.join(str(getattr(record, column)) for column in columns if getattr(record, column))
+
+
+def _index_record(connection, record):
+    record_type, code, columns = _by_model[type(record)]
+    rowid = _rowid(code, record.id)
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"), {'rowid': rowid})
+
+    body = _record_body(record, columns)
+    if not body:
+        return
+    patient_id = getattr(record, 'patient_id', None) or getattr(record, 'mother_id', None)
+    if record_type == 'patient':
+        patient_id = record.id
+    connection.execute(
+        text(f"INSERT INTO {SEARCH_TABLE} (rowid, body, record_type, record_id, user_id, patient_id) "
+             "VALUES (:rowid, :body, :record_type, :record_id, :user_id, :patient_id)"),
+        {'rowid': rowid, 'body': body, 'record_type': record_type, 'record_id': record.id,
+         'user_id': get_owner_id(connection, record), 'patient_id': patient_id}
+    )
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    # Runs inside the flush transaction, so the index commits or rolls back with the data
+    if not _enabled:
+        return
+    connection = session.connection()
+    for record in list(session.new) + list(session.dirty):
+        if type(record) in _by_model:
+            _index_record(connection, record)
+    for record in session.deleted:
+        if type(record) in _by_model:
+            code = _by_model[type(record)][1]
+            connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"),
+                               {'rowid': _rowid(code, record.id)})
+
+
+def _match_expression(query):
+    # Each word becomes a quoted prefix term so user input never reaches the FTS5 syntax
+    words = re.findall(r'\w+', query, re.UNICODE)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_records(user_id, query, limit=20):
+    """
+    Search the clinical free text of a midwife's records.
+
+    Args:
+        user_id (int): Midwife whose records are searched
+        query (str): Words to look for (prefix match, accents ignored)
+        limit (int): Maximum number of hits
+
+    Returns:
+        list: Hits as dicts with type, id, patient_id and snippet, best first
+    """
+    match = _match_expression(query)
+    if not _enabled or not match:
+        return []
+
+    rows = db.session.execute(
+        text(f"SELECT record_type, record_id, patient_id, "
+             f"snippet({SEARCH_TABLE}, 0, '', '', '…', 12) AS snippet "
+             f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match AND user_id = :user_id "
+             f"ORDER BY bm25({SEARCH_TABLE}) LIMIT :limit"),
+        {'match': match, 'user_id': user_id, 'limit': limit}
+    )
+    return [{'type': row.record_type, 'id': row.record_id, 'patient_id': row.patient_id,
+             'snippet': row.snippet} for row in rows]
+
+
+def _rebuild_search_index_task(user_id, payload, progress):
+    if not _enabled:
+        return {'rebuilt': False}
+    rebuild_search_index(progress)
+    return {'rebuilt': True}
+
+
+register_task('search_rebuild', _rebuild_search_index_task)
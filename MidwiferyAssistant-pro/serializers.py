@@ -0,0 +1,134 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+# Both encoders are optional: without them responses fall back to the
+# standard library JSON encoder and JSON only.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+def _default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type non sérialisable : {type(value).__name__}")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider using orjson when it is installed.
+
+    Dates are written in ISO 8601, like the API already formats them by hand,
+    including when falling back to the standard library encoder.
+    """
+
+    @staticmethod
+    def default(value):
+        # Flask's own default writes dates in RFC 822 ("Fri, 01 Mar 2024 ...")
+        if isinstance(value, (date, datetime, Decimal)):
+            return _default(value)
+        return DefaultJSONProvider.default(value)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('indent'):
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None or self._app.debug:
+            return super().response(obj)
+        body = orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def _dump_json(payload):
+    return current_app.json.response(payload).get_data()
+
+
+def _dump_msgpack(payload):
+    return msgpack.packb(payload, default=_default, use_bin_type=True)
+
+
+# mimetype -> function turning a payload into bytes
+SERIALIZERS = {JSON_MIMETYPE: _dump_json}
+if msgpack is not None:
+    SERIALIZERS[MSGPACK_MIMETYPE] = _dump_msgpack
+    SERIALIZERS['application/x-msgpack'] = _dump_msgpack
+
+
+def register_serializer(mimetype, dump):
+    """
+    Make a response format available through the Accept header.
+
+    Args:
+        mimetype (str): Media type clients ask for
+        dump (callable): Function serializing a payload to bytes
+    """
+    SERIALIZERS[mimetype] = dump
+
+
+def negotiate_mimetype():
+    """
+    Choose the response format from the request's Accept header.
+
+    Returns:
+        str: Best supported mimetype, JSON when nothing else matches
+    """
+    return request.accept_mimetypes.best_match(list(SERIALIZERS), default=JSON_MIMETYPE)
+
+
+def api_response(payload, status=200):
+    """
+    Serialize an API payload in the format negotiated with the client.
+
+    Args:
+        payload: JSON-compatible data (dates are allowed)
+        status (int): HTTP status code
+
+    Returns:
+        Response: Serialized response
+    """
+    mimetype = negotiate_mimetype()
+    response = current_app.response_class(SERIALIZERS[mimetype](payload), status=status, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def rows_as_dicts(query):
+    """
+    Run a column projection and return its rows as plain dicts.
+
+    Unlike loading ORM objects, this builds no identity map entries and
+    never lazy-loads relationships. The dicts are kept on purpose: the API
+    sends each row as an object, and orjson and msgpack only write objects
+    from dicts (a Row or RowMapping would need converting anyway).
+
+    Args:
+        query (Query): Query selecting labelled columns
+
+    Returns:
+        list: One dict per row, keyed by column label
+    """
+    result = query.session.execute(query.statement)
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
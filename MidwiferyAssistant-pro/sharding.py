@@ -0,0 +1,256 @@
+import logging
+import os
+import re
+import threading
+
+import click
+import sqlalchemy as sa
+from flask import g, has_app_context, has_request_context, request
+from flask_login import current_user
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy.sql.util import find_tables
+
+# Directory holding one SQLite file per midwife. Sharding is off when unset:
+# everything then lives in SQLALCHEMY_DATABASE_URI as before.
+SHARD_DIR = os.environ.get('TENANT_SHARD_DIR')
+
+# Tables shared by all tenants (accounts and authentication)
+CATALOG_TABLES = {'user'}
+
+# Rows copied per INSERT when splitting an existing database
+SPLIT_BATCH_SIZE = 1000
+
+_SHARD_FILE = re.compile(r'^tenant-(\d+)\.db$')
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+# Functions run once on every new shard, e.g. to create virtual tables
+_initializers = []
+
+# Functions run inside each tenant's context after a split (index rebuilds...)
+_after_split = []
+
+
+def sharding_enabled():
+    return bool(SHARD_DIR)
+
+
+def register_shard_initializer(initialize):
+    """
+    Run a function on the connection of every shard when it is first opened.
+
+    Args:
+        initialize (callable): Function taking a Connection
+    """
+    _initializers.append(initialize)
+
+
+def register_after_split(hook):
+    """
+    Run a function for every shard after a split, with the tenant active.
+
+    Args:
+        hook (callable): Function without arguments using db.session
+    """
+    _after_split.append(hook)
+
+
+def shard_path(user_id):
+    return os.path.join(SHARD_DIR, f"tenant-{int(user_id)}.db")
+
+
+def tenant_tables(metadata):
+    return [table for table in metadata.sorted_tables if table.name not in CATALOG_TABLES]
+
+
+def tenant_engine(db, user_id):
+    """
+    Get (opening and initializing it if needed) the engine of a midwife's shard.
+
+    Args:
+        db (SQLAlchemy): Extension whose metadata defines the tables
+        user_id (int): Midwife owning the shard
+
+    Returns:
+        Engine: Engine bound to the midwife's database file
+    """
+    engine = _engines.get(user_id)
+    if engine is not None:
+        return engine
+
+    with _engines_lock:
+        engine = _engines.get(user_id)
+        if engine is None:
+            os.makedirs(SHARD_DIR, exist_ok=True)
+            engine = sa.create_engine(f"sqlite:///{shard_path(user_id)}")
+            db.metadata.create_all(engine, tables=tenant_tables(db.metadata))
+            with engine.begin() as connection:
+                for initialize in _initializers:
+                    initialize(connection)
+            _engines[user_id] = engine
+    return engine
+
+
+def dispose_tenant_engines(close=True):
+    """
+    Drop the pooled connections of every open shard (e.g. after a fork).
+
+    Args:
+        close (bool): Close the connections, False when they belong to another process
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose(close=close)
+
+
+def set_tenant(user_id):
+    """
+    Route the rest of the current request or app context to a midwife's shard.
+
+    Needed when writing for a user who is not logged in yet (registration)
+    and in background jobs looping over tenants.
+
+    Args:
+        user_id (int): Midwife whose shard is used, None for the catalog
+    """
+    g.tenant_id = user_id
+
+
+def current_tenant():
+    if not has_app_context():
+        return None
+    if 'tenant_id' not in g:
+        # Resolved once; loading the user only touches the catalog
+        g.tenant_id = current_user.id if has_request_context() and current_user.is_authenticated else None
+    return g.tenant_id
+
+
+def tenant_ids():
+    """
+    List the midwives that have a shard.
+
+    Returns:
+        list: User ids, sorted
+    """
+    if not sharding_enabled() or not os.path.isdir(SHARD_DIR):
+        return []
+    return sorted(int(match.group(1)) for match in map(_SHARD_FILE.match, os.listdir(SHARD_DIR)) if match)
+
+
+def _is_shared(table):
+    # Tables of other binds (the job queue) are never sharded either
+    return table.name in CATALOG_TABLES or table.metadata.info.get('bind_key') is not None
+
+
+def _is_catalog(mapper, clause):
+    if mapper is not None:
+        return _is_shared(sa.inspect(mapper).local_table)
+    if clause is not None:
+        tables = find_tables(clause, include_crud=True)
+        return bool(tables) and all(_is_shared(table) for table in tables)
+    return False
+
+
+class TenantSession(FlaskSession):
+    """
+    Session sending clinical tables to the current midwife's shard.
+
+    Catalog tables, and everything when sharding is off or no tenant is
+    active, use the default engine.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and sharding_enabled() and not _is_catalog(mapper, clause):
+            user_id = current_tenant()
+            if user_id is not None:
+                return tenant_engine(self._db, user_id)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _owned_rows(table, patient_table, user_id):
+    if 'user_id' in table.c:
+        return table.select().where(table.c.user_id == user_id)
+    owned_patients = sa.select(patient_table.c.id).where(patient_table.c.user_id == user_id)
+    for column in ('patient_id', 'mother_id'):
+        if column in table.c:
+            return table.select().where(table.c[column].in_(owned_patients))
+    return None
+
+
+def split_into_shards(db, user_ids=None):
+    """
+    Copy each midwife's rows from the single database into their own shard.
+
+    The source database is left untouched; existing shards are refilled.
+
+    Args:
+        db (SQLAlchemy): Extension, inside an application context
+        user_ids (iterable, optional): Midwives to split, all users by default
+
+    Returns:
+        dict: User id -> number of rows copied per table
+    """
+    source = db.engine
+    patient_table = db.metadata.tables['patient']
+    with source.connect() as connection:
+        if user_ids is None:
+            user_ids = connection.execute(sa.select(db.metadata.tables['user'].c.id)).scalars().all()
+
+        report = {}
+        for user_id in user_ids:
+            engine = tenant_engine(db, user_id)
+            copied = {}
+            with engine.begin() as shard:
+                for table in reversed(tenant_tables(db.metadata)):
+                    shard.execute(table.delete())
+                for table in tenant_tables(db.metadata):
+                    query = _owned_rows(table, patient_table, user_id)
+                    if query is None:
+                        continue
+                    result = connection.execute(query)
+                    copied[table.name] = 0
+                    while True:
+                        rows = result.mappings().fetchmany(SPLIT_BATCH_SIZE)
+                        if not rows:
+                            break
+                        shard.execute(table.insert(), [dict(row) for row in rows])
+                        copied[table.name] += len(rows)
+            report[user_id] = copied
+            logging.info("Tenant %s : %d lignes copiées", user_id, sum(copied.values()))
+    return report
+
+
+def _resolve_tenant():
+    # Fix the tenant when the request starts, so that a write flushed after
+    # logout_user() still goes to the shard of the midwife who made it
+    if request.endpoint != 'static':
+        current_tenant()
+
+
+def init_sharding(app, db):
+    """
+    Register the sharding CLI and resolve the tenant of every request.
+
+    Args:
+        app (Flask): Application
+        db (SQLAlchemy): Extension
+    """
+    if sharding_enabled():
+        app.before_request(_resolve_tenant)
+
+    @app.cli.command('split-shards')
+    @click.option('--user', 'user_ids', type=int, multiple=True, help="Midwife to split (all by default)")
+    def split_shards_command(user_ids):
+        """Copy each midwife's data from the single database into TENANT_SHARD_DIR."""
+        if not sharding_enabled():
+            raise click.ClickException("TENANT_SHARD_DIR n'est pas défini")
+        report = split_into_shards(db, user_ids or None)
+        for user_id, copied in report.items():
+            click.echo(f"tenant {user_id}: {sum(copied.values())} lignes")
+        for user_id in report:
+            set_tenant(user_id)
+            for hook in _after_split:
+                hook()
+            db.session.commit()
+            db.session.remove()
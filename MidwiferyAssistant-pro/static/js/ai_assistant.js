@@ -449,8 +449,8 @@ class AIAssistant {
                 this.apiKey = document.getElementById('deepseek-api-key').value;
             }
             
-            // Activer le bouton d'envoi si une clé API est définie et qu'il y a du texte
-            sendButton.disabled = !chatInput.value.trim() || !this.apiKey;
+            // La clé est facultative : le serveur utilise la sienne s'il en a une
+            sendButton.disabled = !chatInput.value.trim();
             
             // Enregistrer la configuration en localStorage
             this.saveConfiguration();
@@ -509,50 +509,29 @@ class AIAssistant {
             prompt = this.config.promptTemplates.general.replace('{query}', message);
         }
         
-        // Appeler l'API en fonction du fournisseur sélectionné
-        if (this.currentProvider === 'openai') {
-            this.callOpenAI(prompt).then(response => {
-                // Supprimer l'indicateur de frappe
-                chatBox.removeChild(typingIndicator);
-                
-                // Afficher la réponse
-                this.showAIMessage(response);
-            }).catch(error => {
-                // Supprimer l'indicateur de frappe
-                chatBox.removeChild(typingIndicator);
-                
-                // Afficher l'erreur
-                this.showAIMessage(`Désolé, une erreur est survenue: ${error.message}. Veuillez vérifier votre clé API.`);
-            });
-        } else if (this.currentProvider === 'gemini') {
-            this.callGemini(prompt).then(response => {
-                // Supprimer l'indicateur de frappe
+        // Interroger le proxy serveur, qui relaie la réponse au fur et à mesure
+        let aiMessageElement = null;
+        this.callProxy(prompt, token => {
+            if (!aiMessageElement) {
+                // Remplacer l'indicateur de frappe dès le premier fragment
                 chatBox.removeChild(typingIndicator);
-                
-                // Afficher la réponse
-                this.showAIMessage(response);
-            }).catch(error => {
-                // Supprimer l'indicateur de frappe
-                chatBox.removeChild(typingIndicator);
-                
-                // Afficher l'erreur
-                this.showAIMessage(`Désolé, une erreur est survenue: ${error.message}. Veuillez vérifier votre clé API.`);
-            });
-        } else if (this.currentProvider === 'deepseek') {
-            this.callDeepSeek(prompt).then(response => {
-                // Supprimer l'indicateur de frappe
+                aiMessageElement = this.showAIMessage('');
+            }
+            aiMessageElement.textContent += token;
+            chatBox.scrollTop = chatBox.scrollHeight;
+        }).then(response => {
+            if (!aiMessageElement) {
                 chatBox.removeChild(typingIndicator);
-                
-                // Afficher la réponse
                 this.showAIMessage(response);
-            }).catch(error => {
-                // Supprimer l'indicateur de frappe
+            }
+        }).catch(error => {
+            if (!aiMessageElement) {
                 chatBox.removeChild(typingIndicator);
-                
-                // Afficher l'erreur
-                this.showAIMessage(`Désolé, une erreur est survenue: ${error.message}. Veuillez vérifier votre clé API.`);
-            });
-        }
+            }
+
+            // Afficher l'erreur
+            this.showAIMessage(`Désolé, une erreur est survenue: ${error.message}. Veuillez vérifier votre clé API.`);
+        });
     }
     
     // Afficher un message de l'IA
@@ -569,145 +548,61 @@ class AIAssistant {
         
         // Faire défiler vers le bas
         chatBox.scrollTop = chatBox.scrollHeight;
-    }
-    
-    // Appeler l'API OpenAI
-    async callOpenAI(prompt) {
-        if (!this.apiKey) {
-            // Réponse de démonstration sans API
-            return this.getDemoResponse(prompt);
-        }
         
-        try {
-            const response = await fetch('https://api.openai.com/v1/chat/completions', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${this.apiKey}`
-                },
-                body: JSON.stringify({
-                    model: this.config.openaiModel,
-                    messages: [
-                        {
-                            role: "system",
-                            content: "Vous êtes un assistant médical spécialisé en obstétrique pour les sages-femmes. " +
-                                    "Vos réponses sont basées sur les recommandations médicales actuelles et la littérature scientifique. " +
-                                    "Soyez précis, concis et professionnel. Rappelez toujours que vos conseils ne remplacent pas " +
-                                    "le jugement clinique d'un professionnel de santé."
-                        },
-                        {
-                            role: "user",
-                            content: prompt
-                        }
-                    ],
-                    temperature: 0.7
-                })
-            });
-            
-            if (!response.ok) {
-                const error = await response.json();
-                throw new Error(error.error.message);
-            }
-            
-            const data = await response.json();
-            return data.choices[0].message.content;
-        } catch (error) {
-            console.error('Erreur OpenAI:', error);
-            throw error;
-        }
+        return aiMessageElement;
     }
     
-    // Appeler l'API Google Gemini
-    async callGemini(prompt) {
-        if (!this.apiKey) {
-            // Réponse de démonstration sans API
-            return this.getDemoResponse(prompt);
+    // Appeler le proxy IA du serveur (OpenAI, Gemini ou DeepSeek) en streaming
+    async callProxy(prompt, onToken) {
+        const response = await fetch('/api/ai/ask', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                provider: this.currentProvider,
+                prompt: prompt,
+                apiKey: this.apiKey || null
+            })
+        });
+        
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || "Erreur lors de l'appel à l'assistant IA");
         }
         
-        try {
-            // Exemple de requête à l'API Gemini (à adapter selon la documentation officielle)
-            const response = await fetch(`https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key=${this.apiKey}`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    contents: [
-                        {
-                            parts: [
-                                {
-                                    text: "Vous êtes un assistant médical spécialisé en obstétrique pour les sages-femmes. " +
-                                          "Vos réponses sont basées sur les recommandations médicales actuelles et la littérature scientifique. " +
-                                          "Soyez précis, concis et professionnel. Rappelez toujours que vos conseils ne remplacent pas " +
-                                          "le jugement clinique d'un professionnel de santé. " +
-                                          "Voici la question: " + prompt
-                                }
-                            ]
-                        }
-                    ],
-                    generationConfig: {
-                        temperature: 0.7
-                    }
-                })
-            });
-            
-            if (!response.ok) {
-                const error = await response.json();
-                throw new Error(error.error.message);
+        // Lire les événements "data:" au fur et à mesure de leur arrivée
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
             }
             
-            const data = await response.json();
-            return data.candidates[0].content.parts[0].text;
-        } catch (error) {
-            console.error('Erreur Gemini:', error);
-            throw error;
-        }
-    }
-    
-    // Appeler l'API DeepSeek
-    async callDeepSeek(prompt) {
-        if (!this.apiKey) {
-            // Réponse de démonstration sans API
-            return this.getDemoResponse(prompt);
-        }
-        
-        try {
-            const response = await fetch('https://api.deepseek.com/v1/chat/completions', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${this.apiKey}`
-                },
-                body: JSON.stringify({
-                    model: 'deepseek-chat',
-                    messages: [
-                        {
-                            role: "system",
-                            content: "Vous êtes un assistant médical spécialisé en obstétrique pour les sages-femmes. " +
-                                    "Vos réponses sont basées sur les recommandations médicales actuelles et la littérature scientifique. " +
-                                    "Soyez précis, concis et professionnel. Rappelez toujours que vos conseils ne remplacent pas " +
-                                    "le jugement clinique d'un professionnel de santé."
-                        },
-                        {
-                            role: "user",
-                            content: prompt
-                        }
-                    ],
-                    temperature: 0.7
-                })
-            });
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
             
-            if (!response.ok) {
-                const error = await response.json();
-                throw new Error(error.error?.message || "Erreur lors de l'appel à l'API DeepSeek");
+            for (const event of events) {
+                if (!event.startsWith('data:')) {
+                    continue;
+                }
+                const data = JSON.parse(event.slice(5));
+                if (data.error) {
+                    throw new Error(data.error);
+                }
+                if (data.token) {
+                    answer += data.token;
+                    onToken(data.token);
+                }
             }
-            
-            const data = await response.json();
-            return data.choices[0].message.content;
-        } catch (error) {
-            console.error('Erreur DeepSeek:', error);
-            throw error;
         }
+        
+        return answer;
     }
     
     // Sauvegarder la configuration dans localStorage
@@ -766,7 +661,7 @@ class AIAssistant {
         // Mettre à jour l'état du bouton d'envoi
         const chatInput = document.getElementById('ai-input-message');
         const sendButton = document.getElementById('ai-send-button');
-        // Permettre l'envoi même sans clé API pour la démonstration
+        // Permettre l'envoi même sans clé API : le serveur peut avoir la sienne
         sendButton.disabled = !chatInput.value.trim();
     }
     
@@ -781,42 +676,6 @@ class AIAssistant {
         // Envoyer le message avec le contexte
         this.sendMessage("Analyse des données fournies", data);
     }
-    
-    // Fournir une réponse de démonstration sans appel API
-    getDemoResponse(prompt) {
-        // Réponses prédéfinies pour la démonstration
-        const demoResponses = {
-            default: "Bonjour, je suis l'assistant ANIPS-F en mode démonstration. Pour utiliser mes fonctionnalités complètes, veuillez configurer une clé API dans les paramètres. Je peux vous aider avec des questions sur la grossesse, l'accouchement et le suivi obstétrical.",
-            
-            grossesse: "La grossesse dure en moyenne 40 semaines d'aménorrhée (ou 38 semaines de conception). Elle est divisée en trois trimestres. Le premier trimestre est crucial pour le développement des organes du fœtus. Les consultations prénatales recommandées sont une par mois, avec des échographies vers 12 SA, 22 SA et 32 SA.",
-            
-            tension: "L'hypertension artérielle pendant la grossesse est définie par une pression systolique ≥ 140 mmHg et/ou une pression diastolique ≥ 90 mmHg. La pré-éclampsie est caractérisée par une hypertension associée à une protéinurie après 20 SA. Une prise en charge rapide est essentielle pour éviter des complications comme l'éclampsie.",
-            
-            fer: "L'anémie ferriprive est courante pendant la grossesse avec des valeurs d'hémoglobine < 11 g/dL au 1er et 3ème trimestre, et < 10,5 g/dL au 2ème trimestre. Une supplémentation en fer est souvent recommandée, avec une dose de 30 à 60 mg/jour de fer élémentaire.",
-            
-            accouchement: "Le travail se déroule en trois phases : la dilatation du col (phase de latence puis phase active), l'expulsion (poussées), et la délivrance (expulsion du placenta). La durée moyenne du travail chez une primipare est de 10-12h, et de 6-8h chez une multipare.",
-            
-            allaitement: "L'allaitement maternel est recommandé exclusivement pendant les 6 premiers mois, puis en complément d'une diversification alimentaire. Il apporte une protection immunitaire au nouveau-né et favorise le lien mère-enfant. La mise au sein précoce et à la demande est encouragée."
-        };
-        
-        // Analyser la question pour déterminer la réponse appropriée
-        const lowerPrompt = prompt.toLowerCase();
-        let response = demoResponses.default;
-        
-        if (lowerPrompt.includes('grossesse') || lowerPrompt.includes('enceinte') || lowerPrompt.includes('trimestre')) {
-            response = demoResponses.grossesse;
-        } else if (lowerPrompt.includes('tension') || lowerPrompt.includes('hypertension') || lowerPrompt.includes('éclampsie')) {
-            response = demoResponses.tension;
-        } else if (lowerPrompt.includes('fer') || lowerPrompt.includes('anémie') || lowerPrompt.includes('hémoglobine')) {
-            response = demoResponses.fer;
-        } else if (lowerPrompt.includes('accouchement') || lowerPrompt.includes('travail') || lowerPrompt.includes('contractions')) {
-            response = demoResponses.accouchement;
-        } else if (lowerPrompt.includes('allaitement') || lowerPrompt.includes('lait') || lowerPrompt.includes('sein')) {
-            response = demoResponses.allaitement;
-        }
-        
-        return response + "\n\n*Note: ceci est une réponse de démonstration. Pour des réponses personnalisées et plus précises, configurez une clé API.*";
-    }
 }
 
 // Fonction pour initialiser l'assistant sur une page
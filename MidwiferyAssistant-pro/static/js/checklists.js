@@ -5,7 +5,35 @@
  * for pregnancy monitoring.
  */
 
+// Checked items of the selected patient for the displayed stage
+const checklistState = {
+    patientId: null,
+    stage: null,
+    checked: new Set()
+};
+
 document.addEventListener('DOMContentLoaded', function() {
+    // Patient whose checklist is saved on the server
+    const patientSelect = document.getElementById('checklistPatient');
+    if (patientSelect) {
+        loadChecklistPatients(patientSelect);
+        patientSelect.addEventListener('change', function() {
+            checklistState.patientId = this.value || null;
+            checklistState.stage = null;
+            loadChecklistState();
+        });
+    }
+
+    // Each checkbox change is saved on its own
+    const checklistContainer = document.getElementById('checklistContainer');
+    if (checklistContainer) {
+        checklistContainer.addEventListener('change', function(e) {
+            if (e.target.classList.contains('checklist-item')) {
+                toggleChecklistItem(e.target);
+            }
+        });
+    }
+
     // Initialize weeks slider
     const weeksSlider = document.getElementById('weeksSlider');
     const weeksValue = document.getElementById('weeksValue');
@@ -101,7 +129,7 @@ function updateChecklist(weeks) {
         html += `
             <li class="list-group-item">
                 <div class="form-check">
-                    <input class="form-check-input" type="checkbox" id="clinical-${item.id}">
+                    <input class="form-check-input checklist-item" type="checkbox" id="clinical-${item.id}" data-item="${item.id}"${checklistState.checked.has(item.id) ? ' checked' : ''}>
                     <label class="form-check-label" for="clinical-${item.id}">
                         ${item.text}
                     </label>
@@ -131,7 +159,7 @@ function updateChecklist(weeks) {
         html += `
             <li class="list-group-item">
                 <div class="form-check">
-                    <input class="form-check-input" type="checkbox" id="lab-${item.id}">
+                    <input class="form-check-input checklist-item" type="checkbox" id="lab-${item.id}" data-item="${item.id}"${checklistState.checked.has(item.id) ? ' checked' : ''}>
                     <label class="form-check-label" for="lab-${item.id}">
                         ${item.text}
                     </label>
@@ -161,7 +189,7 @@ function updateChecklist(weeks) {
         html += `
             <li class="list-group-item">
                 <div class="form-check">
-                    <input class="form-check-input" type="checkbox" id="img-${item.id}">
+                    <input class="form-check-input checklist-item" type="checkbox" id="img-${item.id}" data-item="${item.id}"${checklistState.checked.has(item.id) ? ' checked' : ''}>
                     <label class="form-check-label" for="img-${item.id}">
                         ${item.text}
                     </label>
@@ -191,7 +219,7 @@ function updateChecklist(weeks) {
         html += `
             <li class="list-group-item">
                 <div class="form-check">
-                    <input class="form-check-input" type="checkbox" id="edu-${item.id}">
+                    <input class="form-check-input checklist-item" type="checkbox" id="edu-${item.id}" data-item="${item.id}"${checklistState.checked.has(item.id) ? ' checked' : ''}>
                     <label class="form-check-label" for="edu-${item.id}">
                         ${item.text}
                     </label>
@@ -222,7 +250,7 @@ function updateChecklist(weeks) {
             html += `
                 <li class="list-group-item list-group-item-warning">
                     <div class="form-check">
-                        <input class="form-check-input" type="checkbox" id="special-${item.id}">
+                        <input class="form-check-input checklist-item" type="checkbox" id="special-${item.id}" data-item="${item.id}"${checklistState.checked.has(item.id) ? ' checked' : ''}>
                         <label class="form-check-label" for="special-${item.id}">
                             <strong>${item.text}</strong>
                         </label>
@@ -253,6 +281,24 @@ function updateChecklist(weeks) {
     
     // Update the container
     checklistContainer.innerHTML = html;
+
+    // Load the saved state when the stage changes
+    if (stageForWeeks(weeks) !== checklistState.stage) {
+        checklistState.stage = stageForWeeks(weeks);
+        loadChecklistState();
+    }
+}
+
+/**
+ * Get the checklist stage of a gestational age (same bounds as getChecklistData)
+ *
+ * @param {number} weeks - Gestational age in weeks
+ * @returns {string} Stage key used by the API
+ */
+function stageForWeeks(weeks) {
+    if (weeks < 14) return 't1';
+    if (weeks < 28) return 't2';
+    return 't3';
 }
 
 /**
@@ -369,8 +415,139 @@ function getChecklistData(weeks) {
 }
 
 /**
- * Save the current checklist (placeholder function)
+ * Fill the patient selector
+ *
+ * @param {HTMLSelectElement} select - Patient selector
+ */
+function loadChecklistPatients(select) {
+    fetch('/api/patients')
+        .then(response => response.ok ? response.json() : { patients: [] })
+        .then(data => {
+            data.patients.forEach(patient => {
+                const option = document.createElement('option');
+                option.value = patient.id;
+                option.textContent = `${patient.first_name} ${patient.last_name}`;
+                select.appendChild(option);
+            });
+        });
+}
+
+/**
+ * Checklist endpoint of the selected patient for the displayed stage
+ */
+function checklistUrl() {
+    return `/api/patients/${checklistState.patientId}/checklists/${checklistState.stage}`;
+}
+
+/**
+ * Show the result of the last save
+ *
+ * @param {string} message - Message to display
+ * @param {boolean} isError - Whether the save failed
+ */
+function showChecklistStatus(message, isError) {
+    const status = document.getElementById('checklistSaveStatus');
+    if (status) {
+        status.textContent = message;
+        status.className = 'form-text ' + (isError ? 'text-danger' : 'text-muted');
+    }
+}
+
+/**
+ * Tick the checkboxes saved for the selected patient
+ */
+function applyChecklistState() {
+    document.querySelectorAll('#checklistContainer .checklist-item').forEach(checkbox => {
+        checkbox.checked = checklistState.checked.has(checkbox.dataset.item);
+    });
+}
+
+/**
+ * Load the selected patient's checklist for the displayed stage
+ */
+function loadChecklistState() {
+    checklistState.checked = new Set();
+    if (!checklistState.patientId || !checklistState.stage) {
+        applyChecklistState();
+        showChecklistStatus('', false);
+        return;
+    }
+
+    const patientId = checklistState.patientId;
+    const stage = checklistState.stage;
+    fetch(checklistUrl())
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Impossible de charger la checklist.');
+            }
+            return response.json();
+        })
+        .then(data => {
+            // Ignore answers for a patient or stage no longer displayed
+            if (patientId !== checklistState.patientId || stage !== checklistState.stage) return;
+            checklistState.checked = new Set(data.checked);
+            applyChecklistState();
+            showChecklistStatus('', false);
+        })
+        .catch(error => showChecklistStatus(error.message, true));
+}
+
+/**
+ * Send checked/unchecked items to the server (only these items change)
+ *
+ * @param {Object} items - Item id -> checked
+ * @returns {Promise} Resolves with the new state
+ */
+function patchChecklist(items) {
+    return fetch(checklistUrl(), {
+        method: 'PATCH',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ items: items })
+    })
+    .then(response => {
+        if (!response.ok) {
+            throw new Error('Erreur lors de l\'enregistrement de la checklist.');
+        }
+        return response.json();
+    })
+    .then(data => {
+        checklistState.checked = new Set(data.checked);
+        return data;
+    });
+}
+
+/**
+ * Save one checkbox change
+ *
+ * @param {HTMLInputElement} checkbox - Changed checkbox
+ */
+function toggleChecklistItem(checkbox) {
+    if (!checklistState.patientId) return;
+
+    patchChecklist({ [checkbox.dataset.item]: checkbox.checked })
+        .then(() => showChecklistStatus('Enregistré', false))
+        .catch(error => {
+            checkbox.checked = !checkbox.checked;
+            showChecklistStatus(error.message, true);
+        });
+}
+
+/**
+ * Save every checkbox of the displayed checklist
  */
 function saveChecklist() {
-    alert('Cette fonctionnalité sera disponible dans une prochaine mise à jour.');
+    if (!checklistState.patientId) {
+        alert('Sélectionnez une patiente pour enregistrer la checklist.');
+        return;
+    }
+
+    const items = {};
+    document.querySelectorAll('#checklistContainer .checklist-item').forEach(checkbox => {
+        items[checkbox.dataset.item] = checkbox.checked;
+    });
+    patchChecklist(items)
+        .then(() => showChecklistStatus('Checklist enregistrée', false))
+        .catch(error => showChecklistStatus(error.message, true));
 }
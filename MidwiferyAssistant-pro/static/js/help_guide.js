@@ -334,90 +334,13 @@ function showHelpGuide(pageId) {
     $('#helpGuideModal').modal('show');
 }
 
-// Au chargement du document, ajouter le bouton d'aide à la navbar
-document.addEventListener('DOMContentLoaded', function() {
-    // Déterminer la page actuelle
-    const path = window.location.pathname;
-    let currentPage = 'dashboard'; // Par défaut
-    
-    // Extraire l'ID de la page à partir du chemin
-    if (path.includes('/login')) {
-        currentPage = 'login';
-    } else if (path.includes('/register')) {
-        currentPage = 'register';
-    } else if (path.includes('/dashboard')) {
-        currentPage = 'dashboard';
-    } else if (path.includes('/calculator')) {
-        currentPage = 'calculator';
-    } else if (path.includes('/checklists')) {
-        currentPage = 'checklists';
-    } else if (path.includes('/biomedical')) {
-        currentPage = 'biomedical';
-    } else if (path.includes('/blood_pressure')) {
-        currentPage = 'blood_pressure';
-    } else if (path.includes('/ultrasound')) {
-        currentPage = 'ultrasound';
-    } else if (path.includes('/emergency')) {
-        currentPage = 'emergency';
-    } else if (path.includes('/patients')) {
-        currentPage = 'patients';
-    } else if (path.includes('/profile')) {
-        currentPage = 'profile';
+// Style des sections du guide (le bouton d'aide est créé par lazy_loader.js)
+const helpGuideStyle = document.createElement('style');
+helpGuideStyle.textContent = `
+    .help-guide-section h4 {
+        color: #1a73e8;
+        font-size: 1.2rem;
+        margin-bottom: 0.5rem;
     }
-    
-    // Ajouter le bouton d'aide à la navbar si connecté
-    const navbar = document.querySelector('.navbar-nav.mr-auto');
-    if (navbar) {
-        const helpButton = document.createElement('li');
-        helpButton.className = 'nav-item';
-        helpButton.innerHTML = `
-            <a class="nav-link" href="#" id="showHelpGuide">
-                <i class="fas fa-question-circle"></i> Aide
-            </a>
-        `;
-        navbar.appendChild(helpButton);
-        
-        // Ajouter l'événement de clic
-        document.getElementById('showHelpGuide').addEventListener('click', function(e) {
-            e.preventDefault();
-            showHelpGuide(currentPage);
-        });
-    }
-    
-    // Ajouter le bouton d'aide flottant (visible même sur les pages de login/register)
-    const helpFloating = document.createElement('div');
-    helpFloating.className = 'help-floating';
-    helpFloating.innerHTML = `
-        <button class="btn btn-info rounded-circle" id="floatingHelpBtn" title="Aide contextuelle">
-            <i class="fas fa-question"></i>
-        </button>
-    `;
-    document.body.appendChild(helpFloating);
-    
-    // Ajouter le style pour le bouton flottant
-    const style = document.createElement('style');
-    style.textContent = `
-        .help-floating {
-            position: fixed;
-            bottom: 20px;
-            right: 20px;
-            z-index: 1000;
-        }
-        .help-floating button {
-            width: 50px;
-            height: 50px;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.2);
-        }
-        .help-guide-section h4 {
-            color: #1a73e8;
-            font-size: 1.2rem;
-            margin-bottom: 0.5rem;
-        }
-    `;
-    document.head.appendChild(style);
-    
-    // Ajouter l'événement de clic au bouton flottant
-    document.getElementById('floatingHelpBtn').addEventListener('click', function() {
-        showHelpGuide(currentPage);
-    });
-});
\ No newline at end of file
+`;
+document.head.appendChild(helpGuideStyle);
@@ -0,0 +1,138 @@
+/**
+ * Chargement différé de l'aide contextuelle et de l'assistant IA
+ * 
+ * Ces scripts ne servent qu'après une action de l'utilisateur : ils ne sont
+ * téléchargés qu'à la première interaction (survol ou clic) au lieu d'être
+ * chargés sur chaque page. Les URL des bundles sont fournies par base.html
+ * dans window.LAZY_BUNDLES.
+ */
+
+// Promesses de chargement, par bundle
+const lazyBundles = {};
+
+/**
+ * Charger un bundle une seule fois
+ * 
+ * @param {string} name - Nom du bundle (help, assistant)
+ * @returns {Promise} Résolue une fois le script exécuté
+ */
+function loadBundle(name) {
+    if (!lazyBundles[name]) {
+        lazyBundles[name] = new Promise((resolve, reject) => {
+            const script = document.createElement('script');
+            script.src = window.LAZY_BUNDLES[name];
+            script.onload = resolve;
+            script.onerror = () => {
+                // Permettre une nouvelle tentative (ex : réseau revenu)
+                delete lazyBundles[name];
+                script.remove();
+                reject(new Error('Impossible de charger le script ' + name));
+            };
+            document.head.appendChild(script);
+        });
+    }
+    return lazyBundles[name];
+}
+
+/**
+ * Déterminer le guide d'aide de la page courante
+ * 
+ * @returns {string} Identifiant de la page dans helpGuides
+ */
+function getHelpPageId() {
+    const path = window.location.pathname;
+    
+    if (path.includes('/login')) return 'login';
+    if (path.includes('/register')) return 'register';
+    if (path.includes('/dashboard')) return 'dashboard';
+    if (path.includes('/calculator')) return 'calculator';
+    if (path.includes('/checklists')) return 'checklists';
+    if (path.includes('/biomedical')) return 'biomedical';
+    if (path.includes('/blood_pressure')) return 'blood_pressure';
+    if (path.includes('/ultrasound')) return 'ultrasound';
+    if (path.includes('/emergency')) return 'emergency';
+    if (path.includes('/patients')) return 'patients';
+    if (path.includes('/profile')) return 'profile';
+    return 'dashboard';
+}
+
+/**
+ * Afficher le guide d'aide, en chargeant son script au premier appel
+ */
+function openHelpGuide() {
+    loadBundle('help')
+        .then(() => showHelpGuide(getHelpPageId()))
+        .catch(error => alert(error.message));
+}
+
+/**
+ * Commencer le téléchargement dès que l'utilisateur s'approche d'un bouton
+ * 
+ * @param {HTMLElement} element - Bouton déclencheur
+ * @param {string} name - Bundle à précharger
+ */
+function prefetchOnIntent(element, name) {
+    const prefetch = () => loadBundle(name).catch(() => null);
+    element.addEventListener('pointerenter', prefetch, { once: true });
+    element.addEventListener('focus', prefetch, { once: true });
+}
+
+/**
+ * Remplacer un emplacement d'assistant IA par l'assistant, au premier clic
+ * 
+ * @param {HTMLElement} container - Élément portant l'attribut data-ai-assistant
+ */
+function initLazyAssistant(container) {
+    const button = container.querySelector('[data-ai-assistant-open]');
+    if (!button) return;
+    
+    prefetchOnIntent(button, 'assistant');
+    button.addEventListener('click', function() {
+        button.disabled = true;
+        loadBundle('assistant')
+            .then(() => initializeAIAssistant('#' + container.id))
+            .catch(error => {
+                button.disabled = false;
+                alert(error.message);
+            });
+    });
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    // Ajouter le bouton d'aide à la navbar si connecté
+    const navbar = document.querySelector('.navbar-nav.mr-auto');
+    if (navbar) {
+        const helpButton = document.createElement('li');
+        helpButton.className = 'nav-item';
+        helpButton.innerHTML = `
+            <a class="nav-link" href="#" id="showHelpGuide">
+                <i class="fas fa-question-circle"></i> Aide
+            </a>
+        `;
+        navbar.appendChild(helpButton);
+        
+        const helpLink = document.getElementById('showHelpGuide');
+        prefetchOnIntent(helpLink, 'help');
+        helpLink.addEventListener('click', function(e) {
+            e.preventDefault();
+            openHelpGuide();
+        });
+    }
+    
+    // Ajouter le bouton d'aide flottant (visible même sur les pages de login/register)
+    const helpFloating = document.createElement('div');
+    helpFloating.className = 'help-floating';
+    helpFloating.innerHTML = `
+        <button class="btn btn-info rounded-circle" id="floatingHelpBtn" title="Aide contextuelle">
+            <i class="fas fa-question"></i>
+        </button>
+    `;
+    document.body.appendChild(helpFloating);
+    
+    const floatingButton = document.getElementById('floatingHelpBtn');
+    prefetchOnIntent(floatingButton, 'help');
+    floatingButton.addEventListener('click', openHelpGuide);
+    
+    // Assistants IA de la page
+    document.querySelectorAll('[data-ai-assistant]').forEach(initLazyAssistant);
+});
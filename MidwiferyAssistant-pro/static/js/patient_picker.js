@@ -0,0 +1,141 @@
+/**
+ * Sélection de patiente par saisie semi-automatique
+ *
+ * Remplace les listes déroulantes de toutes les patientes : chaque champ
+ * texte portant data-patient-typeahead="<id>" interroge
+ * /api/patients/typeahead et écrit l'identifiant choisi dans le champ
+ * caché <id>, lu par les formulaires comme l'ancien <select>.
+ */
+
+// Délai avant d'interroger le serveur pendant la frappe (ms)
+const TYPEAHEAD_DELAY = 80;
+const TYPEAHEAD_LIMIT = 8;
+
+/**
+ * Brancher la saisie semi-automatique sur un champ
+ *
+ * @param {HTMLInputElement} input - Champ de recherche
+ */
+function attachPatientTypeahead(input) {
+    const hidden = document.getElementById(input.dataset.patientTypeahead);
+    if (!hidden) return;
+
+    const wrapper = document.createElement('div');
+    wrapper.className = 'position-relative';
+    input.parentNode.insertBefore(wrapper, input);
+    wrapper.appendChild(input);
+
+    const menu = document.createElement('div');
+    menu.className = 'dropdown-menu w-100';
+    menu.setAttribute('role', 'listbox');
+    wrapper.appendChild(menu);
+
+    let results = [];
+    let active = -1;
+    let timer = null;
+    let controller = null;
+
+    function updateValidity() {
+        input.setCustomValidity(input.required && !hidden.value ? 'Sélectionnez une patiente dans la liste.' : '');
+    }
+
+    function close() {
+        menu.classList.remove('show');
+        active = -1;
+    }
+
+    function choose(patient) {
+        hidden.value = patient.id;
+        input.value = `${patient.last_name} ${patient.first_name}`;
+        updateValidity();
+        hidden.dispatchEvent(new Event('change', { bubbles: true }));
+        close();
+    }
+
+    function render() {
+        menu.innerHTML = '';
+        if (!results.length) {
+            const empty = document.createElement('span');
+            empty.className = 'dropdown-item-text text-muted';
+            empty.textContent = 'Aucune patiente trouvée';
+            menu.appendChild(empty);
+        }
+        results.forEach((patient, i) => {
+            const item = document.createElement('button');
+            item.type = 'button';
+            item.className = 'dropdown-item' + (i === active ? ' active' : '');
+            item.setAttribute('role', 'option');
+            // textContent : les noms ne sont jamais interprétés comme du HTML
+            item.textContent = `${patient.last_name} ${patient.first_name}`;
+            // mousedown : choisir avant que le champ ne perde le focus
+            item.addEventListener('mousedown', e => {
+                e.preventDefault();
+                choose(patient);
+            });
+            menu.appendChild(item);
+        });
+        menu.classList.add('show');
+    }
+
+    function search() {
+        if (controller) controller.abort();
+        controller = new AbortController();
+        const url = `/api/patients/typeahead?q=${encodeURIComponent(input.value)}&limit=${TYPEAHEAD_LIMIT}`;
+        fetch(url, { signal: controller.signal })
+            .then(response => response.json())
+            .then(data => {
+                results = data.patients;
+                active = results.length ? 0 : -1;
+                render();
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') console.error('Erreur:', error);
+            });
+    }
+
+    input.addEventListener('input', function() {
+        // Le texte ne correspond plus à la patiente choisie
+        if (hidden.value) {
+            hidden.value = '';
+            hidden.dispatchEvent(new Event('change', { bubbles: true }));
+        }
+        updateValidity();
+        clearTimeout(timer);
+        timer = setTimeout(search, TYPEAHEAD_DELAY);
+    });
+
+    input.addEventListener('focus', function() {
+        if (!hidden.value) search();
+    });
+
+    input.addEventListener('keydown', function(e) {
+        if (!menu.classList.contains('show') || !results.length) return;
+        if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+            e.preventDefault();
+            const step = e.key === 'ArrowDown' ? 1 : -1;
+            active = (active + step + results.length) % results.length;
+            render();
+        } else if (e.key === 'Enter' && active >= 0) {
+            e.preventDefault();
+            choose(results[active]);
+        } else if (e.key === 'Escape') {
+            close();
+        }
+    });
+
+    input.addEventListener('blur', close);
+
+    // form.reset() vide le champ texte mais pas la valeur du champ caché
+    if (input.form) {
+        input.form.addEventListener('reset', function() {
+            hidden.value = '';
+            setTimeout(updateValidity);
+        });
+    }
+
+    updateValidity();
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('[data-patient-typeahead]').forEach(attachPatientTypeahead);
+});
@@ -8,8 +8,7 @@
 
 // Gestion des événements au chargement de la page
 document.addEventListener('DOMContentLoaded', function() {
-    // Charger les données initiales
-    loadPatients();
+    // Charger les données initiales (les patientes sont choisies par saisie semi-automatique)
     loadBabies();
     loadDeliveries();
     loadReminders();
@@ -54,16 +53,6 @@ function updateContent(tabId) {
     }
 }
 
-// Charger la liste des patientes
-function loadPatients() {
-    fetch('/api/patients')
-        .then(response => response.json())
-        .then(data => {
-            updatePatientSelects(data.patients);
-        })
-        .catch(error => console.error('Erreur:', error));
-}
-
 // Charger la liste des bébés
 function loadBabies() {
     fetch('/api/postnatal/babies')
@@ -84,25 +73,6 @@ function loadDeliveries() {
         .catch(error => console.error('Erreur:', error));
 }
 
-// Mettre à jour tous les selects de patientes
-function updatePatientSelects(patients) {
-    const selects = [
-        'delivery-patient',
-        'mother-checkup-patient',
-        'reminder-patient'
-    ];
-
-    selects.forEach(selectId => {
-        const select = document.getElementById(selectId);
-        if (select) {
-            select.innerHTML = '<option value="">Sélectionnez une patiente...</option>';
-            patients.forEach(patient => {
-                select.innerHTML += `<option value="${patient.id}">${patient.last_name} ${patient.first_name}</option>`;
-            });
-        }
-    });
-}
-
 // Mettre à jour tous les selects de bébés
 function updateBabySelects(babies) {
     const selects = [
@@ -590,33 +560,51 @@ function initConditionalFields() {
 }
 
 
+// Nombre de rappels affichés dans le panneau latéral
+const UPCOMING_REMINDERS = 5;
+
 /**
- * Charge les rappels à venir
+ * Charge les rappels à venir (rappels enregistrés et vaccinations dues)
  */
 function loadReminders() {
-    // Simuler le chargement des rappels (à remplacer par un appel API réel)
-    setTimeout(() => {
-        const upcomingRemindersDiv = document.getElementById('upcoming-reminders');
-        if (upcomingRemindersDiv) {
-            upcomingRemindersDiv.innerHTML = '<div class="reminder-list">' +
-                '<div class="reminder-item">' +
-                    '<div class="reminder-date">Aujourd\'hui</div>' +
-                    '<div class="reminder-title">Visite postnatale - Mme Dupont</div>' +
-                    '<div class="reminder-badge high">Haute</div>' +
-                '</div>' +
-                '<div class="reminder-item">' +
-                    '<div class="reminder-date">Demain</div>' +
-                    '<div class="reminder-title">Vaccination BCG - Bébé Martin</div>' +
-                    '<div class="reminder-badge normal">Normale</div>' +
-                '</div>' +
-                '<div class="reminder-item">' +
-                    '<div class="reminder-date">24 Mars</div>' +
-                    '<div class="reminder-title">Suivi allaitement - Mme Bernard</div>' +
-                    '<div class="reminder-badge normal">Normale</div>' +
-                '</div>' +
-            '</div>';
-        }
-    }, 1000);
+    const upcomingRemindersDiv = document.getElementById('upcoming-reminders');
+    if (!upcomingRemindersDiv) return;
+
+    fetch('/api/postnatal/reminders?status=pending')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Erreur lors du chargement des rappels');
+            }
+            return response.json();
+        })
+        .then(data => {
+            const list = document.createElement('div');
+            list.className = 'reminder-list';
+            data.reminders.slice(0, UPCOMING_REMINDERS).forEach(reminder => {
+                const item = document.createElement('div');
+                item.className = 'reminder-item';
+                // textContent : les noms saisis ne sont jamais interprétés comme du HTML
+                [
+                    ['reminder-date', new Date(reminder.reminder_date).toLocaleDateString('fr-FR')],
+                    ['reminder-title', [reminder.title, reminder.baby_name || reminder.patient_name].filter(Boolean).join(' - ')],
+                    [`reminder-badge ${reminder.priority}`, translatePriority(reminder.priority)]
+                ].forEach(([className, text]) => {
+                    const part = document.createElement('div');
+                    part.className = className;
+                    part.textContent = text;
+                    item.appendChild(part);
+                });
+                list.appendChild(item);
+            });
+            if (!list.children.length) {
+                list.textContent = 'Aucun rappel à venir.';
+            }
+            upcomingRemindersDiv.replaceChildren(list);
+        })
+        .catch(error => {
+            console.error('Erreur:', error);
+            upcomingRemindersDiv.textContent = 'Impossible de charger les rappels.';
+        });
 }
 
 /**
@@ -898,6 +886,7 @@ function initBreastfeedingChart() {
  * Charge les informations d'un bébé et met à jour les graphiques
  */
 function loadBabyInfo(babyId) {
+    loadBabyGrowth(babyId);
     fetch(`/api/postnatal/baby/${babyId}`)
         .then(response => {
             if (!response.ok) {
@@ -915,6 +904,24 @@ function loadBabyInfo(babyId) {
         });
 }
 
+/**
+ * Charge l'évaluation de croissance d'un bébé (z-scores OMS, perte de poids)
+ */
+function loadBabyGrowth(babyId) {
+    fetch(`/api/postnatal/growth/${babyId}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Erreur lors du chargement de la croissance du bébé');
+            }
+            return response.json();
+        })
+        .then(data => displayBabyGrowth(data))
+        .catch(error => {
+            console.error('Erreur:', error);
+            showError('Impossible de charger l\'évaluation de croissance');
+        });
+}
+
 /**
  * Charge les suivis post-partum d'une mère
  */
@@ -1121,6 +1128,90 @@ function displayBabyInfo(data) {
     babyInfo.innerHTML = content;
 }
 
+const GROWTH_FLAG_LABELS = {
+    excessive_weight_loss: { label: 'Perte de poids ≥ 10 %', badge: 'bg-danger' },
+    weight_loss_warning: { label: 'Perte de poids ≥ 7 %', badge: 'bg-warning text-dark' },
+    birth_weight_not_regained: { label: 'Poids de naissance non repris', badge: 'bg-warning text-dark' },
+    low_weight_for_age: { label: 'Poids faible pour l\'âge', badge: 'bg-danger' }
+};
+
+/**
+ * Affiche l'évaluation de croissance d'un bébé
+ */
+function displayBabyGrowth(data) {
+    const container = document.getElementById('baby-growth-assessment');
+    if (!container) return;
+
+    if (!data.measurements || data.measurements.length === 0) {
+        container.innerHTML = '';
+        return;
+    }
+
+    let content = `
+        <div class="card mt-4">
+            <div class="card-header bg-light">
+                <h5 class="mb-0">Évaluation de la croissance</h5>
+            </div>
+            <div class="card-body">
+    `;
+
+    if (!data.reference_available) {
+        content += `
+                <div class="alert alert-info">
+                    Sexe non renseigné : z-scores OMS non calculés.
+                </div>
+        `;
+    }
+
+    content += `
+                <div class="table-responsive">
+                    <table class="table table-sm">
+                        <thead>
+                            <tr>
+                                <th>Date</th>
+                                <th>Âge</th>
+                                <th>Poids</th>
+                                <th>Variation</th>
+                                <th>Z-score poids/âge</th>
+                                <th>Alertes</th>
+                            </tr>
+                        </thead>
+                        <tbody>
+    `;
+
+    data.measurements.forEach(point => {
+        const checkupDate = new Date(point.date).toLocaleDateString('fr-FR');
+        const change = point.weight_change_percent !== null
+            ? `${point.weight_change_percent > 0 ? '+' : ''}${point.weight_change_percent} %`
+            : '-';
+        const flags = point.flags.map(flag => {
+            const info = GROWTH_FLAG_LABELS[flag];
+            return info ? `<span class="badge ${info.badge} me-1">${info.label}</span>` : '';
+        }).join('');
+
+        content += `
+                            <tr>
+                                <td>${checkupDate}</td>
+                                <td>${point.age_days} j</td>
+                                <td>${point.weight} kg</td>
+                                <td>${change}</td>
+                                <td>${point.z_score !== null ? point.z_score : '-'}</td>
+                                <td>${flags || '-'}</td>
+                            </tr>
+        `;
+    });
+
+    content += `
+                        </tbody>
+                    </table>
+                </div>
+            </div>
+        </div>
+    `;
+
+    container.innerHTML = content;
+}
+
 /**
  * Affiche les suivis post-partum d'une mère
  */
@@ -1690,7 +1781,7 @@ function displayReminders(data) {
                     <button class="btn btn-sm btn-outline-primary view-reminder-details" data-reminder-id="${reminder.id}">
                         <i class="fas fa-eye"></i>
                     </button>
-                    ${!reminder.completed ? `
+                    ${!reminder.completed && reminder.source !== 'vaccination' ? `
                         <button class="btn btn-sm btn-outline-success complete-reminder" data-reminder-id="${reminder.id}">
                             <i class="fas fa-check"></i>
                         </button>
@@ -0,0 +1,229 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+from sqlalchemy import inspect
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_LEVEL = 'INFO'
+
+# Share of the successful requests of an endpoint that are logged; errors
+# and warnings are always kept. Overridden by LOG_SAMPLE_RATES.
+DEFAULT_SAMPLE_RATES = {
+    'static': 0.01,
+    'script_bundle': 0.01,
+    'api_patients_typeahead': 0.05,
+    'api_sync': 0.1,
+}
+
+# Requests slower than this are logged even when not sampled
+SLOW_REQUEST_MS = 1000
+
+# Records waiting for the writer thread; beyond this they are dropped
+# rather than blocking requests on a stalled stderr
+QUEUE_SIZE = 10000
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# LogRecord attributes that are not extra fields passed by the caller
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_handler = None
+_listener = None
+_sample_rates = dict(DEFAULT_SAMPLE_RATES)
+
+
+def _parse_mapping(value, convert):
+    # "name=value,other=value" as set in the environment
+    mapping = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        name, _, setting = item.partition('=')
+        try:
+            mapping[name.strip()] = convert(setting.strip())
+        except ValueError:
+            print(f"Réglage de journalisation ignoré : {item}", file=sys.stderr)
+    return mapping
+
+
+def _user_id():
+    # Only the user flask-login already loaded, and its identity rather than
+    # its (possibly expired) id attribute: logging must never query the
+    # database, nor read the session cookie, which would add Vary: Cookie
+    user = g.get('_login_user')
+    if user is None or not user.is_authenticated:
+        return None
+    identity = inspect(user).identity
+    return identity[0] if identity else None
+
+
+def _request_context():
+    if not has_request_context():
+        return {}
+    return {
+        'request_id': g.get('request_id'),
+        'user_id': _user_id(),
+        'route': request.endpoint,
+        'method': request.method,
+    }
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with the request context and the caller's extra fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items()
+                     if key not in _RECORD_FIELDS and value is not None)
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if orjson is not None:
+            return orjson.dumps(entry, default=str).decode('utf-8')
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Hand records to the writer thread.
+
+    The request context and the message are captured on the calling
+    thread; JSON encoding and the write happen on the writer thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        for key, value in _request_context().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        # Arguments may be changed by the caller after this returns
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class SamplingFilter(logging.Filter):
+    """Drop the debug and info records of requests that were not sampled."""
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not has_request_context():
+            return True
+        return g.get('log_sampled', True)
+
+
+def _start_listener():
+    global _listener
+    target = logging.StreamHandler(sys.stderr)
+    if os.environ.get('LOG_FORMAT', 'json') == 'text':
+        target.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s', defaults={'request_id': '-'}))
+    else:
+        target.setFormatter(JSONFormatter())
+    _handler.queue = queue.Queue(QUEUE_SIZE)
+    _listener = QueueListener(_handler.queue, target, respect_handler_level=False)
+    _listener.start()
+
+
+def _stop_listener():
+    # Writes the records still queued before the process exits
+    if _listener is not None:
+        _listener.stop()
+
+
+def configure_logging():
+    """
+    Send every log record through a queue to a background writer thread.
+
+    Levels come from the environment: LOG_LEVEL for the root logger (INFO by
+    default) and LOG_LEVELS for specific loggers, e.g.
+    "sqlalchemy.engine=INFO,werkzeug=WARNING". LOG_FORMAT=text writes
+    readable lines instead of JSON in development.
+    """
+    global _handler
+    root = logging.getLogger()
+    root.setLevel(os.environ.get('LOG_LEVEL', DEFAULT_LEVEL).upper())
+    for name, level in _parse_mapping(os.environ.get('LOG_LEVELS'), str.upper).items():
+        logging.getLogger(name).setLevel(level)
+
+    if _handler is not None:
+        return
+    _handler = ContextQueueHandler(queue.Queue(QUEUE_SIZE))
+    _handler.addFilter(SamplingFilter())
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    _start_listener()
+
+    # The writer thread does not survive fork(): gunicorn workers and the
+    # job and report pools start their own, on a fresh queue whose lock no
+    # thread of the parent can be holding
+    os.register_at_fork(after_in_child=_start_listener)
+    atexit.register(_stop_listener)
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    request_id = request.headers.get(REQUEST_ID_HEADER, '')
+    g.request_id = request_id if _REQUEST_ID.match(request_id) else uuid.uuid4().hex
+    rate = _sample_rates.get(request.endpoint, 1.0)
+    g.log_sampled = rate >= 1 or random.random() < rate
+
+
+def _log_request(response):
+    # An earlier before_request hook may have answered before ours ran
+    if 'request_id' not in g:
+        return response
+    duration_ms = round((time.perf_counter() - g.request_started) * 1000, 1)
+    if response.status_code >= 500:
+        level = logging.ERROR
+    elif duration_ms >= SLOW_REQUEST_MS:
+        level = logging.WARNING
+    else:
+        level = logging.INFO
+    logging.getLogger('request').log(level, "%s %s %s", request.method, request.path, response.status_code,
+                                     extra={'status': response.status_code, 'duration_ms': duration_ms})
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+
+def init_request_logging(app):
+    """
+    Give every request an id and log one line per request with its status
+    and duration, sampled per endpoint by LOG_SAMPLE_RATES.
+
+    Args:
+        app (Flask): Application
+    """
+    _sample_rates.update(_parse_mapping(app.config.get('LOG_SAMPLE_RATES'), float))
+    app.before_request(_start_request)
+    app.after_request(_log_request)
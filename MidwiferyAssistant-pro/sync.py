@@ -0,0 +1,189 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from app import db
+from models import (Patient, BloodPressureRecord, BiomedicalRecord, UltrasoundRecord, DeliveryRecord,
+                    BabyRecord, PostnatalCheckup, VaccinationRecord, BreastfeedingRecord,
+                    PostnatalCareReminder, ChangeLogEntry, get_owner_id)
+from vitals_archive import archived_readings
+
+# record type -> model, for every model replicated to the tablets
+SYNCED_MODELS = {
+    'patient': Patient,
+    'blood_pressure': BloodPressureRecord,
+    'biomedical': BiomedicalRecord,
+    'ultrasound': UltrasoundRecord,
+    'delivery': DeliveryRecord,
+    'baby': BabyRecord,
+    'postnatal_checkup': PostnatalCheckup,
+    'vaccination': VaccinationRecord,
+    'breastfeeding': BreastfeedingRecord,
+    'reminder': PostnatalCareReminder,
+}
+
+# record type -> vitals_archive series whose archived readings are records of that type
+ARCHIVED_SERIES = {
+    'blood_pressure': 'blood_pressure',
+    'postnatal_checkup': 'postnatal',
+}
+
+# Maximum number of changed records returned by one sync call
+SYNC_PAGE_SIZE = 1000
+
+# Seconds during which a change may still be overtaken by a lower sequence
+# number: on PostgreSQL an id is drawn when the entry is flushed, so a
+# transaction still open can commit an id below one a sync already read.
+# Cursors never pass an entry younger than this; its neighbours are read
+# (and sent) again on the next sync instead of being skipped.
+SYNC_SETTLE_SECONDS = 60
+
+_record_types = {model: record_type for record_type, model in SYNCED_MODELS.items()}
+_change_log = ChangeLogEntry.__table__
+
+
+def _log_change(connection, record_type, record_id, user_id, deleted):
+    # Only the latest change of a record is kept, so the log grows with the
+    # number of records rather than the number of writes.
+    connection.execute(_change_log.delete().where(
+        (_change_log.c.record_type == record_type) & (_change_log.c.record_id == record_id)
+    ))
+    connection.execute(_change_log.insert().values(
+        record_type=record_type, record_id=record_id, user_id=user_id,
+        deleted=deleted, changed_at=datetime.utcnow()
+    ))
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_changes(session, flush_context):
+    connection = session.connection()
+    for records, deleted in ((list(session.new) + list(session.dirty), False), (session.deleted, True)):
+        for record in records:
+            record_type = _record_types.get(type(record))
+            if record_type is None:
+                continue
+            user_id = get_owner_id(connection, record)
+            if user_id is not None:
+                _log_change(connection, record_type, record.id, user_id, deleted)
+
+
+def serialize_row(record):
+    """
+    Convert a record to a JSON-ready dict of its column values.
+
+    Args:
+        record (db.Model): Any mapped record
+
+    Returns:
+        dict: Column name -> value, dates in ISO format
+    """
+    return _json_ready({column.key: getattr(record, column.key) for column in record.__table__.columns})
+
+
+def _json_ready(row):
+    for key, value in row.items():
+        if isinstance(value, (date, datetime)):
+            row[key] = value.isoformat()
+    return row
+
+
+def owned_query(model, user_id):
+    """
+    Query the records of a model belonging to a midwife.
+
+    Args:
+        model (db.Model): Clinical model
+        user_id (int): Midwife id
+
+    Returns:
+        Query: Records owned directly or through their patient
+    """
+    if hasattr(model, 'user_id'):
+        return model.query.filter(model.user_id == user_id)
+    patient_column = model.patient_id if hasattr(model, 'patient_id') else model.mother_id
+    return model.query.join(Patient, Patient.id == patient_column).filter(Patient.user_id == user_id)
+
+
+def _settled_before():
+    return datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+
+
+def _snapshot(user_id):
+    # Records of transactions committing after this read are picked up by
+    # the next delta sync, as long as their entries are recent
+    cursor = db.session.query(func.max(ChangeLogEntry.id)).filter(
+        ChangeLogEntry.changed_at < _settled_before()
+    ).scalar() or 0
+    changes = {}
+    for record_type, model in SYNCED_MODELS.items():
+        rows = [serialize_row(record) for record in owned_query(model, user_id)]
+        if record_type in ARCHIVED_SERIES:
+            # Archived readings are no longer rows but are still records of
+            # the midwife; an id in both places (racing archivers) is sent once
+            ids = {row['id'] for row in rows}
+            rows.extend(_json_ready(reading) for reading in archived_readings(ARCHIVED_SERIES[record_type], user_id)
+                        if reading['id'] not in ids)
+        if rows:
+            changes[record_type] = rows
+    return {'cursor': cursor, 'full': True, 'has_more': False, 'changes': changes, 'deleted': {}}
+
+
+def get_changes(user_id, since=0, limit=SYNC_PAGE_SIZE):
+    """
+    Get a midwife's records changed after a sync cursor.
+
+    A cursor of 0 returns a full snapshot, which also covers records written
+    before the change log existed and archived vitals readings. The cursor
+    returned stays below changes younger than SYNC_SETTLE_SECONDS, so these
+    are sent again by the next call: records must be applied as upserts.
+
+    Args:
+        user_id (int): Midwife id
+        since (int): Cursor returned by the previous sync
+        limit (int): Maximum number of changed records
+
+    Returns:
+        dict: New cursor, changed rows and deleted ids grouped by record type
+    """
+    if not since:
+        return _snapshot(user_id)
+
+    entries = ChangeLogEntry.query.filter(
+        ChangeLogEntry.user_id == user_id,
+        ChangeLogEntry.id > since
+    ).order_by(ChangeLogEntry.id).limit(limit + 1).all()
+
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    settled_before = _settled_before()
+    cursor = since
+    for entry in entries:
+        if entry.changed_at >= settled_before:
+            break
+        cursor = entry.id
+    if entries and cursor != entries[-1].id:
+        # Paging on from a held-back cursor would return this same page
+        # until its entries settle: wait for the next periodic sync
+        has_more = False
+
+    updated_ids = {}
+    deleted = {}
+    for entry in entries:
+        target = deleted if entry.deleted else updated_ids
+        target.setdefault(entry.record_type, []).append(entry.record_id)
+
+    # One IN query per record type instead of one query per change
+    changes = {}
+    for record_type, ids in updated_ids.items():
+        model = SYNCED_MODELS[record_type]
+        changes[record_type] = [serialize_row(record) for record in model.query.filter(model.id.in_(ids))]
+
+    return {
+        'cursor': cursor,
+        'full': False,
+        'has_more': has_more,
+        'changes': changes,
+        'deleted': deleted
+    }
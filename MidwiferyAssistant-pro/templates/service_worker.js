@@ -0,0 +1,89 @@
+/**
+ * Service worker: offline access to the bedside pages
+ *
+ * Emergency protocols, checklists, calculator, ultrasound references and
+ * the assets they need are stored when the worker is installed, then served
+ * from the cache and refreshed in the background. The cache name carries
+ * the content hash of the precached files: any change to them produces a
+ * new worker, whose activation removes the previous cache.
+ */
+
+const CACHE_PREFIX = 'anips-f-';
+const CACHE_NAME = CACHE_PREFIX + {{ version|tojson }};
+const PRECACHE_URLS = {{ urls|tojson }};
+const PRECACHE_EXTERNAL = {{ external|tojson }};
+const OFFLINE_FALLBACK = {{ fallback|tojson }};
+
+const precached = new Set(PRECACHE_URLS.map(url => new URL(url, self.location.origin).href)
+    .concat(PRECACHE_EXTERNAL));
+
+/**
+ * Store a response unless it is an error or a redirect (to the login page)
+ */
+function cacheResponse(cache, request, response) {
+    if (response.type === 'opaque' || (response.ok && !response.redirected)) {
+        return cache.put(request, response.clone());
+    }
+    return Promise.resolve();
+}
+
+/**
+ * Fetch and store the precached URLs missing from the cache
+ */
+function precacheMissing() {
+    return caches.open(CACHE_NAME).then(cache => {
+        const requests = PRECACHE_URLS.map(url => new Request(url, { credentials: 'same-origin' }))
+            .concat(PRECACHE_EXTERNAL.map(url => new Request(url, { mode: 'no-cors' })));
+        // One failed URL (e.g. pages while logged out) must not abort the others
+        return Promise.all(requests.map(request =>
+            cache.match(request, { ignoreVary: true }).then(cached => cached || fetch(request)
+                .then(response => cacheResponse(cache, request, response))
+                .catch(() => null))
+        ));
+    });
+}
+
+self.addEventListener('install', event => {
+    event.waitUntil(precacheMissing().then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(caches.keys().then(names => Promise.all(
+        names.filter(name => name.startsWith(CACHE_PREFIX) && name !== CACHE_NAME)
+            .map(name => caches.delete(name))
+    )).then(() => self.clients.claim()));
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+
+    const url = new URL(request.url);
+    const key = url.origin === self.location.origin ? url.origin + url.pathname : request.url;
+
+    if (precached.has(key)) {
+        // Stale-while-revalidate: answer from the cache, refresh it from the network
+        event.respondWith(caches.open(CACHE_NAME).then(cache =>
+            cache.match(key, { ignoreVary: true }).then(cached => {
+                const network = fetch(request)
+                    .then(response => cacheResponse(cache, key, response).then(() => response));
+                if (cached) {
+                    event.waitUntil(network.catch(() => null));
+                    return cached;
+                }
+                return network;
+            })
+        ));
+    } else if (request.mode === 'navigate') {
+        // Pages refused while logged out are stored once a page loads normally
+        const network = fetch(request);
+        event.waitUntil(network.then(response => {
+            if (response.ok && !response.redirected) return precacheMissing();
+        }).catch(() => null));
+        // Without network, any page falls back to the emergency protocols
+        event.respondWith(network.catch(() =>
+            caches.match(new URL(OFFLINE_FALLBACK, self.location.origin).href, { ignoreVary: true })
+                .then(cached => cached || Response.error())
+        ));
+    }
+});
@@ -0,0 +1,38 @@
+import os
+import tempfile
+
+import pytest
+
+# The application reads its configuration at import: point it at a
+# throwaway database before anything imports it
+_database_dir = tempfile.mkdtemp(prefix='midwifery-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_database_dir, 'app.db')}"
+os.environ['JOB_QUEUE_DATABASE_URL'] = f"sqlite:///{os.path.join(_database_dir, 'jobs.db')}"
+os.environ.pop('TENANT_SHARD_DIR', None)
+
+from app import app as flask_app, db as database  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        yield database
+        database.session.remove()
+
+
+@pytest.fixture
+def login(app):
+    """Register a midwife and return a test client logged in as them."""
+    def client(username):
+        client = app.test_client()
+        client.post('/register', data={'username': username, 'email': f'{username}@example.org',
+                                       'password': 'secret', 'confirm_password': 'secret'})
+        client.post('/login', data={'username': username, 'password': 'secret'})
+        return client
+    return client
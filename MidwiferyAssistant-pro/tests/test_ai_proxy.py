@@ -0,0 +1,41 @@
+from ai_proxy import ConcurrencyLimiter, StubProvider, answer_cache, find_provider, stream_answer
+
+
+def test_slots_are_shared_between_limiters(db):
+    # Two workers: two limiters over the same table
+    first, second = ConcurrencyLimiter(2), ConcurrencyLimiter(2)
+    held = [first.acquire(42), second.acquire(42)]
+    assert None not in held
+    assert first.acquire(42) is None
+    assert second.acquire(43) is not None
+
+    first.release(held[0])
+    assert second.acquire(42) is not None
+
+
+def test_answers_are_cached_per_user(db):
+    answer_cache.clear()
+    provider = StubProvider()
+    first = ''.join(stream_answer(provider, 'Dose de fer ?', 1))
+    assert '"cached": false' in first
+    assert '"cached": true' in ''.join(stream_answer(provider, 'dose de fer', 1))
+    assert '"cached": false' in ''.join(stream_answer(provider, 'dose de fer', 2))
+
+
+def test_stub_provider_only_in_debug():
+    assert find_provider('stub') is None
+    assert find_provider('stub', debug=True) is StubProvider
+    assert find_provider('openai') is not None
+
+
+def test_ask_endpoint_limits_concurrent_requests(app, login, monkeypatch):
+    client = login('ai-limit')
+    monkeypatch.setattr('ai_proxy.limiter.max_per_user', 1)
+    first = client.post('/api/ai/ask', json={'prompt': 'Question', 'provider': 'stub'})
+    assert first.status_code == 200
+    # The first answer is still open: its slot is held
+    assert client.post('/api/ai/ask', json={'prompt': 'Autre', 'provider': 'stub'}).status_code == 429
+    first.close()
+    second = client.post('/api/ai/ask', json={'prompt': 'Autre', 'provider': 'stub'})
+    assert second.status_code == 200
+    second.close()
@@ -0,0 +1,31 @@
+import gzip
+import json
+from datetime import datetime
+
+from audit_archive import archive_old_audit_logs, query_audit_logs, _bucket_file
+from models import AuditLog, User
+
+
+def test_entries_sharing_an_id_are_all_read(app, db, login, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'AUDIT_ARCHIVE_DIR', str(tmp_path))
+    login('audit_reader')
+    user_id = User.query.filter_by(username='audit_reader').one().id
+    db.session.add_all([
+        AuditLog(user_id=user_id, action='view_patient', timestamp=datetime(2020, 1, 5, 9, 0)),
+        AuditLog(user_id=user_id, action='edit_patient', timestamp=datetime(2020, 1, 6, 9, 0)),
+    ])
+    db.session.commit()
+    assert archive_old_audit_logs(app, now=datetime(2021, 1, 1)) >= 2
+
+    rows = [row for row in query_audit_logs(app, user_id) if row['timestamp'].startswith('2020-01')]
+    assert len(rows) == 2
+    # The same rows archived again by a run that crashed before deleting them,
+    # and an entry of another database that was given the same id
+    other = dict(rows[0], action='login', timestamp='2020-01-07T08:00:00')
+    payload = ''.join(json.dumps(row) + '\n' for row in rows + [other])
+    with open(_bucket_file(str(tmp_path), '2020-01'), 'ab') as f:
+        f.write(gzip.compress(payload.encode('utf-8')))
+
+    entries = query_audit_logs(app, user_id)
+    assert [row['action'] for row in entries if row['timestamp'].startswith('2020-01')] == \
+        ['login', 'edit_patient', 'view_patient']
@@ -0,0 +1,255 @@
+"""
+Check that the compiled clinical rules give the same results as the
+hard-coded thresholds they replaced.
+
+The reference functions are utils.analyze_blood_results and
+utils.evaluate_blood_pressure as they were before clinical_rules.
+"""
+import json
+import os
+from itertools import product
+
+import pytest
+
+import clinical_rules
+import utils
+from clinical_rules import DEFAULT_RULES, RuleSet
+
+SYSTOLIC = range(60, 201)
+DIASTOLIC = range(30, 131)
+
+HEMOGLOBIN = [5, 7.9, 8, 8.5, 9.99, 10, 10.5, 10.99, 11, 12.5, 16]
+PLATELETS = [20, 49, 50, 75, 99, 100, 120, 149, 150, 300]
+FERRITIN = [None, 5, 14.9, 15, 20, 29.9, 30, 80]
+LDH = [None, 200, 600, 600.5, 900]
+LIVER = [None, 30, 70, 71, 150]
+
+
+def reference_analyze_blood_results(hemoglobin, platelets, ferritin=None, hematocrit=None, ldh=None, alt=None, ast=None):
+    analysis = {
+        'hemoglobin': {
+            'value': hemoglobin,
+            'status': 'normal',
+            'message': 'Taux d\'hémoglobine normal'
+        },
+        'platelets': {
+            'value': platelets,
+            'status': 'normal',
+            'message': 'Taux de plaquettes normal'
+        },
+        'overall': {
+            'status': 'normal',
+            'message': 'Résultats dans les normes',
+            'recommendations': []
+        }
+    }
+
+    # Analyze hemoglobin
+    if hemoglobin < 8:
+        analysis['hemoglobin']['status'] = 'critical'
+        analysis['hemoglobin']['message'] = 'Anémie sévère'
+        analysis['overall']['recommendations'].append('Fer intraveineux recommandé')
+        analysis['overall']['status'] = 'critical'
+    elif hemoglobin < 10:
+        analysis['hemoglobin']['status'] = 'warning'
+        analysis['hemoglobin']['message'] = 'Anémie modérée'
+        analysis['overall']['recommendations'].append('Supplément en fer oral (80-100 mg/jour)')
+        analysis['overall']['status'] = 'warning'
+    elif hemoglobin < 11:
+        analysis['hemoglobin']['status'] = 'mild'
+        analysis['hemoglobin']['message'] = 'Anémie légère'
+        analysis['overall']['recommendations'].append('Supplément en fer oral (30-60 mg/jour)')
+        analysis['overall']['status'] = 'mild'
+
+    # Analyze platelets
+    if platelets < 50:
+        analysis['platelets']['status'] = 'critical'
+        analysis['platelets']['message'] = 'Thrombopénie sévère'
+        analysis['overall']['recommendations'].append('Consultation hématologique urgente')
+        analysis['overall']['status'] = 'critical'
+    elif platelets < 100:
+        analysis['platelets']['status'] = 'warning'
+        analysis['platelets']['message'] = 'Thrombopénie modérée'
+        analysis['overall']['recommendations'].append('Surveillance rapprochée, LDH et frottis sanguin')
+        analysis['overall']['status'] = 'warning'
+    elif platelets < 150:
+        analysis['platelets']['status'] = 'mild'
+        analysis['platelets']['message'] = 'Thrombopénie légère'
+        analysis['overall']['recommendations'].append('Surveillance à la prochaine consultation')
+
+    # Add ferritin analysis if provided
+    if ferritin is not None:
+        analysis['ferritin'] = {
+            'value': ferritin,
+            'status': 'normal',
+            'message': 'Taux de ferritine normal'
+        }
+
+        if ferritin < 15:
+            analysis['ferritin']['status'] = 'warning'
+            analysis['ferritin']['message'] = 'Déplétion des réserves en fer'
+            analysis['overall']['recommendations'].append('Supplément en fer oral')
+            if analysis['overall']['status'] == 'normal':
+                analysis['overall']['status'] = 'mild'
+        elif ferritin < 30:
+            analysis['ferritin']['status'] = 'mild'
+            analysis['ferritin']['message'] = 'Réserves en fer faibles'
+            analysis['overall']['recommendations'].append('Considérer un supplément en fer oral')
+
+    # Check for HELLP syndrome markers
+    hellp_indicators = 0
+
+    if platelets < 100:
+        hellp_indicators += 1
+
+    if ldh is not None:
+        analysis['ldh'] = {
+            'value': ldh,
+            'status': 'normal',
+            'message': 'LDH normal'
+        }
+
+        if ldh > 600:
+            analysis['ldh']['status'] = 'critical'
+            analysis['ldh']['message'] = 'LDH élevé'
+            hellp_indicators += 1
+
+    if ast is not None and alt is not None:
+        analysis['liver_enzymes'] = {
+            'ast': ast,
+            'alt': alt,
+            'status': 'normal',
+            'message': 'Enzymes hépatiques normales'
+        }
+
+        if ast > 70 or alt > 70:
+            analysis['liver_enzymes']['status'] = 'critical'
+            analysis['liver_enzymes']['message'] = 'Enzymes hépatiques élevées'
+            hellp_indicators += 1
+
+    # Check for HELLP syndrome
+    if hellp_indicators >= 2:
+        analysis['overall']['status'] = 'critical'
+        analysis['overall']['message'] = 'Suspicion de syndrome HELLP'
+        analysis['overall']['recommendations'] = [
+            'Consultation obstétricale immédiate',
+            'Tension artérielle et protéinurie',
+            'Surveillance fœtale'
+        ]
+
+    # Set the overall message based on status if not already set
+    if analysis['overall']['status'] != 'normal' and analysis['overall']['message'] == 'Résultats dans les normes':
+        if analysis['overall']['status'] == 'mild':
+            analysis['overall']['message'] = 'Anomalies légères détectées'
+        elif analysis['overall']['status'] == 'warning':
+            analysis['overall']['message'] = 'Anomalies modérées détectées'
+        elif analysis['overall']['status'] == 'critical':
+            analysis['overall']['message'] = 'Anomalies critiques détectées'
+
+    return analysis
+
+
+def reference_evaluate_blood_pressure(systolic, diastolic):
+    result = {
+        'systolic': systolic,
+        'diastolic': diastolic,
+        'status': 'normal',
+        'message': 'Tension artérielle normale',
+        'recommendations': []
+    }
+
+    # Critical hypertension (severe)
+    if systolic >= 160 or diastolic >= 110:
+        result['status'] = 'critical'
+        result['message'] = 'CRISE HYPERTENSIVE → URGENCE'
+        result['recommendations'] = [
+            'Transfert immédiat en milieu hospitalier',
+            'Bilan prééclampsie complet',
+            'Surveillance fœtale',
+            'Traitement antihypertenseur parentéral à envisager'
+        ]
+
+    # Moderate hypertension
+    elif (systolic >= 150 and systolic < 160) or (diastolic >= 100 and diastolic < 110):
+        result['status'] = 'warning'
+        result['message'] = 'HTA modérée → Contrôle rapide'
+        result['recommendations'] = [
+            'Contrôle dans la journée',
+            'Recherche de protéinurie',
+            'Surveillance des signes fonctionnels de prééclampsie',
+            'Consultation obstétricale si persistance'
+        ]
+
+    # Mild hypertension
+    elif (systolic >= 140 and systolic < 150) or (diastolic >= 90 and diastolic < 100):
+        result['status'] = 'mild'
+        result['message'] = 'HTA légère → Surveillance'
+        result['recommendations'] = [
+            'Contrôle dans les 24h',
+            'Repos et position latérale gauche',
+            'Recherche de protéinurie'
+        ]
+
+    # Elevated (borderline)
+    elif (systolic >= 130 and systolic < 140) or (diastolic >= 80 and diastolic < 90):
+        result['status'] = 'elevated'
+        result['message'] = 'Tension artérielle élevée'
+        result['recommendations'] = [
+            'Surveillance à la prochaine consultation',
+            'Conseils hygiéno-diététiques (limiter sel, repos)',
+            'Auto-surveillance si possible'
+        ]
+
+    # Low blood pressure
+    elif systolic < 90 or diastolic < 60:
+        result['status'] = 'low'
+        result['message'] = 'Tension artérielle basse'
+        result['recommendations'] = [
+            'Hydratation suffisante',
+            'Position latérale gauche en cas de malaise',
+            'Lever progressif'
+        ]
+
+    return result
+
+
+@pytest.fixture(autouse=True)
+def default_rules(monkeypatch):
+    # Ignore any CLINICAL_RULES_FILE of the environment
+    rules = RuleSet(DEFAULT_RULES)
+    monkeypatch.setattr(utils, 'get_rules', lambda: rules)
+
+
+def test_blood_pressure_matches_reference():
+    for systolic, diastolic in product(SYSTOLIC, DIASTOLIC):
+        assert utils.evaluate_blood_pressure(systolic, diastolic) == \
+            reference_evaluate_blood_pressure(systolic, diastolic), (systolic, diastolic)
+
+
+def test_blood_results_match_reference():
+    for hemoglobin, platelets, ferritin, ldh, alt, ast in product(HEMOGLOBIN, PLATELETS, FERRITIN, LDH, LIVER, LIVER):
+        values = dict(hemoglobin=hemoglobin, platelets=platelets, ferritin=ferritin, ldh=ldh, alt=alt, ast=ast)
+        assert utils.analyze_blood_results(**values) == reference_analyze_blood_results(**values), values
+
+
+def test_blood_pressure_result_is_shared():
+    # Classifications are preallocated: no allocation per reading
+    rules = RuleSet(DEFAULT_RULES)
+    assert rules.classify_blood_pressure(165, 95) is rules.classify_blood_pressure(170, 70)
+
+
+def test_broken_rules_file_is_logged_once_per_change(tmp_path, monkeypatch, caplog):
+    rules_file = tmp_path / 'rules.json'
+    rules_file.write_text('{"version": ', encoding='utf-8')
+    for name, value in (('RULES_FILE', str(rules_file)), ('RELOAD_CHECK_INTERVAL', 0),
+                        ('_active', clinical_rules._active), ('_rules_file_mtime', None),
+                        ('_failed_mtime', None), ('_next_check', 0.0)):
+        monkeypatch.setattr(clinical_rules, name, value)
+
+    for _ in range(3):
+        clinical_rules.get_rules()
+    assert len([record for record in caplog.records if record.levelname == 'ERROR']) == 1
+
+    rules_file.write_text(json.dumps(dict(DEFAULT_RULES, version='test')), encoding='utf-8')
+    os.utime(rules_file, (1, 1))
+    assert clinical_rules.get_rules().version == 'test'
@@ -0,0 +1,30 @@
+from datetime import date
+
+from duplicates import DUPLICATE_THRESHOLD, match_score, phonetic_key
+from patient_index import normalize_name
+
+
+def _profile(first_name, last_name, date_of_birth):
+    return normalize_name(first_name), normalize_name(last_name), date_of_birth
+
+
+def test_phonetic_key_spelling_variants():
+    for a, b in (('Lefèbvre', 'Lefebre'), ('Dupont', 'Dupond'), ('Philippe', 'Filipe')):
+        assert phonetic_key(normalize_name(a)) == phonetic_key(normalize_name(b)), (a, b)
+
+
+def test_sisters_are_not_duplicates():
+    born = date(1990, 5, 3)
+    assert match_score(_profile('Anne', 'Martin', born), _profile('Marie', 'Martin', born)) < DUPLICATE_THRESHOLD
+    assert match_score(_profile('Fatou', 'Diallo', born), _profile('Fanta', 'Diallo', born)) < DUPLICATE_THRESHOLD
+
+
+def test_entry_mistakes_are_duplicates():
+    born = date(1990, 5, 3)
+    pairs = (
+        (_profile('Aïssatou', 'Diallo', born), _profile('Aissatou', 'Dialo', born)),
+        (_profile('Awa', 'Diallo', born), _profile('Diallo', 'Awa', born)),
+        (_profile('Marie', 'Lefèbvre', born), _profile('Marie', 'Lefebre', date(1990, 3, 5))),
+    )
+    for a, b in pairs:
+        assert match_score(a, b) >= DUPLICATE_THRESHOLD, (a, b)
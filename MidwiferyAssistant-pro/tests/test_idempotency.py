@@ -0,0 +1,51 @@
+from models import Patient, User
+
+
+def _patient(db, username):
+    user = User.query.filter_by(username=username).one()
+    patient = Patient(first_name='Awa', last_name='Diallo', user_id=user.id)
+    db.session.add(patient)
+    db.session.commit()
+    return patient.id
+
+
+def test_key_only_replays_the_same_write(db, login):
+    client = login('idempotency-route')
+    patient_id = _patient(db, 'idempotency-route')
+    body = {'systolic': 120, 'diastolic': 80, 'patientId': patient_id}
+    headers = {'Idempotency-Key': 'route-1'}
+
+    first = client.post('/api/record_blood_pressure', json=body, headers=headers)
+    again = client.post('/api/record_blood_pressure', json=dict(reversed(list(body.items()))), headers=headers)
+    assert first.status_code == 200
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert again.get_json() == first.get_json()
+
+    other_body = client.post('/api/record_blood_pressure', json=dict(body, systolic=150), headers=headers)
+    other_endpoint = client.post('/api/postnatal/breastfeeding', json=body, headers=headers)
+    assert other_body.status_code == 422
+    assert other_endpoint.status_code == 422
+
+    # The same write queued offline and replayed later is recognized
+    replayed = client.post('/api/replay', json={'mutations': [
+        {'key': 'route-1', 'type': 'blood_pressure', 'data': body},
+        {'key': 'route-1', 'type': 'checkup', 'data': body},
+    ]}).get_json()['results']
+    assert replayed[0]['replayed'] and replayed[0]['body'] == first.get_json()
+    assert replayed[1]['status'] == 422
+
+
+def test_replay_rejects_malformed_input_per_item(db, login):
+    client = login('idempotency-replay')
+    patient_id = _patient(db, 'idempotency-replay')
+
+    assert client.post('/api/replay', json=[{'key': 'x'}]).status_code == 400
+    assert client.post('/api/replay', json={'mutations': {'key': 'x'}}).status_code == 400
+
+    results = client.post('/api/replay', json={'mutations': [
+        ['not', 'an', 'item'],
+        {'key': 'list-data', 'type': 'blood_pressure', 'data': [120, 80]},
+        {'key': 7, 'type': 'blood_pressure', 'data': {}},
+        {'key': 'good', 'type': 'blood_pressure', 'data': {'systolic': 120, 'diastolic': 80, 'patientId': patient_id}},
+    ]}).get_json()['results']
+    assert [result['status'] for result in results] == [400, 400, 400, 200]
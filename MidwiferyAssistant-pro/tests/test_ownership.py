@@ -0,0 +1,40 @@
+from models import Patient, User
+from ownership import resolve_ownership
+
+
+def _midwife(db, username):
+    user = User(username=username, email=f'{username}@example.org', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def test_rolled_back_answer_is_not_shared(app, db):
+    midwife_a = _midwife(db, 'ownership-a')
+    midwife_b = _midwife(db, 'ownership-b')
+
+    # A's patient is seen as A's inside the transaction, which then rolls back
+    with app.test_request_context():
+        patient = Patient(first_name='Awa', last_name='Diallo', user_id=midwife_a)
+        db.session.add(patient)
+        db.session.flush()
+        patient_id = patient.id
+        assert resolve_ownership(midwife_a, patients=[patient_id])['patients'] == {patient_id}
+        db.session.rollback()
+
+    # B's new patient reuses the id
+    with app.test_request_context():
+        patient = Patient(first_name='Marie', last_name='Martin', user_id=midwife_b)
+        db.session.add(patient)
+        db.session.commit()
+        assert patient.id == patient_id
+
+    # A's next write brings A's patients version back to the one the
+    # rolled-back answer was read under
+    with app.test_request_context():
+        db.session.add(Patient(first_name='Fatou', last_name='Sow', user_id=midwife_a))
+        db.session.commit()
+
+    with app.test_request_context():
+        assert resolve_ownership(midwife_a, patients=[patient_id])['patients'] == set()
+        assert resolve_ownership(midwife_b, patients=[patient_id])['patients'] == {patient_id}
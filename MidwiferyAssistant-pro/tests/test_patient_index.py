@@ -0,0 +1,40 @@
+from sqlalchemy import event, insert
+
+import patient_index
+from models import Patient, User
+from patient_index import search_patient_names
+from versioning import bump
+
+
+def _names(results):
+    return [(patient['first_name'], patient['last_name']) for patient in results]
+
+
+def test_keystrokes_do_not_query_and_foreign_writes_show_up(app, db, monkeypatch):
+    user = User(username='typeahead', email='typeahead@example.org', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    user_id = user.id
+    db.session.add(Patient(first_name='Awa', last_name='Diallo', user_id=user_id))
+    db.session.commit()
+
+    assert _names(search_patient_names(user_id, 'dia')) == [('Awa', 'Diallo')]
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        assert _names(search_patient_names(user_id, 'aw')) == [('Awa', 'Diallo')]
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert statements == []
+
+    # A write committed by another process: no ORM events in this one.
+    # End the read transaction first, as the request would.
+    db.session.rollback()
+    with db.engine.begin() as connection:
+        connection.execute(insert(Patient.__table__).values(first_name='Aïssatou', last_name='Diop', user_id=user_id))
+        bump(connection, user_id, 'patients')
+
+    monkeypatch.setattr(patient_index, '_next_check', {})
+    assert _names(search_patient_names(user_id, 'di')) == [('Awa', 'Diallo'), ('Aïssatou', 'Diop')]
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+from models import ChangeLogEntry, User
+from sync import SYNC_SETTLE_SECONDS, get_changes
+
+
+def test_cursor_waits_for_recent_changes_to_settle(db):
+    user = User(username='sync-settle', email='sync-settle@example.org', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    old = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS * 10)
+    settled, recent, after = (
+        ChangeLogEntry(record_type='patient', record_id=record_id, user_id=user.id, deleted=True, changed_at=at)
+        for record_id, at in ((900001, old), (900002, datetime.utcnow()), (900003, old))
+    )
+    db.session.add_all([settled, recent, after])
+    db.session.commit()
+    since = settled.id - 1
+
+    # A lower id may still be committed before the recent entry: the cursor
+    # stops in front of it, and every change is sent meanwhile
+    page = get_changes(user.id, since)
+    assert page['cursor'] == settled.id
+    assert page['deleted']['patient'] == [900001, 900002, 900003]
+
+    # A full page that cannot move the cursor does not ask for the next one
+    page = get_changes(user.id, settled.id, limit=1)
+    assert page['cursor'] == settled.id
+    assert page['has_more'] is False
+
+    recent.changed_at = old
+    db.session.commit()
+    assert get_changes(user.id, since)['cursor'] == after.id
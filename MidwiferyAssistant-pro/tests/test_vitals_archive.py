@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+from models import BloodPressureRecord, Patient, User
+from sync import get_changes
+from vitals_archive import archive_old_vitals, read_vitals
+
+
+def test_snapshot_includes_archived_readings(app, db):
+    user = User(username='archive-sync', email='archive-sync@example.org', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    patient = Patient(first_name='Awa', last_name='Diallo', user_id=user.id)
+    db.session.add(patient)
+    db.session.flush()
+    start = datetime(2024, 1, 1, 8)
+    for day in range(30):
+        db.session.add(BloodPressureRecord(systolic=110 + day % 20, diastolic=70, heart_rate=80,
+                                           recorded_at=start + timedelta(days=day),
+                                           patient_id=patient.id, user_id=user.id))
+    db.session.commit()
+
+    stats = archive_old_vitals(app, now=start + timedelta(days=400))
+    assert stats['readings'] == 30
+    assert BloodPressureRecord.query.filter_by(patient_id=patient.id).count() == 0
+
+    readings = read_vitals(patient.id, 'blood_pressure')
+    snapshot = get_changes(user.id, 0)
+    synced = sorted(snapshot['changes']['blood_pressure'], key=lambda row: row['id'])
+    assert [row['id'] for row in synced] == sorted(reading['id'] for reading in readings)
+    assert synced[0]['recorded_at'] == start.isoformat()
+    assert synced[0]['systolic'] == 110
@@ -0,0 +1,136 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app import db
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+@contextmanager
+def transaction():
+    """
+    Unit of work: collect every write of the block and commit once at the end.
+
+    Nested blocks join the outermost one, so only the outermost commits.
+    Any exception rolls the whole unit back.
+    """
+    depth = g.get('uow_depth', 0)
+    g.uow_depth = depth + 1
+    try:
+        yield db.session
+        if depth == 0:
+            db.session.commit()
+    except BaseException:
+        if depth == 0:
+            db.session.rollback()
+        raise
+    finally:
+        g.uow_depth = depth
+
+
+@contextmanager
+def savepoint():
+    """
+    Run part of a unit of work inside a SAVEPOINT.
+
+    If the block fails, only its own writes are rolled back and the
+    exception is re-raised; the enclosing unit of work stays usable.
+    The enclosing transaction is begun by _begin_sqlite, so releasing the
+    savepoint never commits it, even when the savepoint is its first statement.
+    """
+    nested = db.session.begin_nested()
+    try:
+        yield
+        nested.commit()
+    except BaseException:
+        nested.rollback()
+        raise
+
+
+def unit_of_work(view):
+    """
+    Decorator running a view inside a single transaction.
+
+    The view must not commit itself; it can flush when it needs generated
+    ids. Responses with an error status roll the unit back.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with transaction():
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code >= 400:
+                db.session.rollback()
+        return response
+    return wrapper
+
+
+@event.listens_for(Engine, 'begin')
+def _begin_sqlite(connection):
+    # pysqlite only sends BEGIN before an INSERT/UPDATE/DELETE: a SAVEPOINT
+    # opened first starts the transaction itself and its RELEASE commits.
+    # Turn off the driver's transaction handling and begin explicitly.
+    if connection.dialect.name != 'sqlite':
+        return
+    if connection.get_execution_options().get('isolation_level') == 'AUTOCOMMIT':
+        return
+    connection.connection.dbapi_connection.isolation_level = None
+    connection.exec_driver_sql('BEGIN')
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_write(session, flush_context):
+    session.info['uow_wrote'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _count_commit(session):
+    # Only commits that persisted writes cost an fsync
+    if session.info.pop('uow_wrote', False) and has_request_context():
+        g.db_commits = g.get('db_commits', 0) + 1
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('uow_wrote', None)
+
+
+def _record_commits(response):
+    endpoint = request.endpoint or 'unknown'
+    commits = g.get('db_commits', 0)
+    with _stats_lock:
+        stats = _stats.setdefault(endpoint, {'requests': 0, 'commits': 0, 'max_commits': 0})
+        stats['requests'] += 1
+        stats['commits'] += commits
+        stats['max_commits'] = max(stats['max_commits'], commits)
+    return response
+
+
+def get_commit_stats():
+    """
+    Get the commits-per-request metric of this worker process.
+
+    Returns:
+        dict: Endpoint -> requests, commits, average and maximum commits per request
+    """
+    with _stats_lock:
+        return {
+            endpoint: dict(stats, commits_per_request=round(stats['commits'] / stats['requests'], 3))
+            for endpoint, stats in _stats.items()
+        }
+
+
+def init_commit_metrics(app):
+    """
+    Start counting database commits per request.
+
+    Args:
+        app (Flask): Application
+    """
+    app.after_request(_record_commits)
@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+from clinical_rules import get_rules
 
 def calculate_gestational_age(last_period, cycle_length=28):
     """
@@ -135,127 +136,15 @@ def analyze_blood_results(hemoglobin, platelets, ferritin=None, hematocrit=None,
     Returns:
         dict: Analysis and recommendations
     """
-    analysis = {
-        'hemoglobin': {
-            'value': hemoglobin,
-            'status': 'normal',
-            'message': 'Taux d\'hémoglobine normal'
-        },
-        'platelets': {
-            'value': platelets,
-            'status': 'normal',
-            'message': 'Taux de plaquettes normal'
-        },
-        'overall': {
-            'status': 'normal',
-            'message': 'Résultats dans les normes',
-            'recommendations': []
-        }
-    }
-    
-    # Analyze hemoglobin
-    if hemoglobin < 8:
-        analysis['hemoglobin']['status'] = 'critical'
-        analysis['hemoglobin']['message'] = 'Anémie sévère'
-        analysis['overall']['recommendations'].append('Fer intraveineux recommandé')
-        analysis['overall']['status'] = 'critical'
-    elif hemoglobin < 10:
-        analysis['hemoglobin']['status'] = 'warning'
-        analysis['hemoglobin']['message'] = 'Anémie modérée'
-        analysis['overall']['recommendations'].append('Supplément en fer oral (80-100 mg/jour)')
-        analysis['overall']['status'] = 'warning'
-    elif hemoglobin < 11:
-        analysis['hemoglobin']['status'] = 'mild'
-        analysis['hemoglobin']['message'] = 'Anémie légère'
-        analysis['overall']['recommendations'].append('Supplément en fer oral (30-60 mg/jour)')
-        analysis['overall']['status'] = 'mild'
-    
-    # Analyze platelets
-    if platelets < 50:
-        analysis['platelets']['status'] = 'critical'
-        analysis['platelets']['message'] = 'Thrombopénie sévère'
-        analysis['overall']['recommendations'].append('Consultation hématologique urgente')
-        analysis['overall']['status'] = 'critical'
-    elif platelets < 100:
-        analysis['platelets']['status'] = 'warning'
-        analysis['platelets']['message'] = 'Thrombopénie modérée'
-        analysis['overall']['recommendations'].append('Surveillance rapprochée, LDH et frottis sanguin')
-        analysis['overall']['status'] = 'warning'
-    elif platelets < 150:
-        analysis['platelets']['status'] = 'mild'
-        analysis['platelets']['message'] = 'Thrombopénie légère'
-        analysis['overall']['recommendations'].append('Surveillance à la prochaine consultation')
-        
-    # Add ferritin analysis if provided
-    if ferritin is not None:
-        analysis['ferritin'] = {
-            'value': ferritin,
-            'status': 'normal',
-            'message': 'Taux de ferritine normal'
-        }
-        
-        if ferritin < 15:
-            analysis['ferritin']['status'] = 'warning'
-            analysis['ferritin']['message'] = 'Déplétion des réserves en fer'
-            analysis['overall']['recommendations'].append('Supplément en fer oral')
-            if analysis['overall']['status'] == 'normal':
-                analysis['overall']['status'] = 'mild'
-        elif ferritin < 30:
-            analysis['ferritin']['status'] = 'mild'
-            analysis['ferritin']['message'] = 'Réserves en fer faibles'
-            analysis['overall']['recommendations'].append('Considérer un supplément en fer oral')
-    
-    # Check for HELLP syndrome markers
-    hellp_indicators = 0
-    
-    if platelets < 100:
-        hellp_indicators += 1
-    
-    if ldh is not None:
-        analysis['ldh'] = {
-            'value': ldh,
-            'status': 'normal',
-            'message': 'LDH normal'
-        }
-        
-        if ldh > 600:
-            analysis['ldh']['status'] = 'critical'
-            analysis['ldh']['message'] = 'LDH élevé'
-            hellp_indicators += 1
-    
-    if ast is not None and alt is not None:
-        analysis['liver_enzymes'] = {
-            'ast': ast,
-            'alt': alt,
-            'status': 'normal',
-            'message': 'Enzymes hépatiques normales'
-        }
-        
-        if ast > 70 or alt > 70:
-            analysis['liver_enzymes']['status'] = 'critical'
-            analysis['liver_enzymes']['message'] = 'Enzymes hépatiques élevées'
-            hellp_indicators += 1
-    
-    # Check for HELLP syndrome
-    if hellp_indicators >= 2:
-        analysis['overall']['status'] = 'critical'
-        analysis['overall']['message'] = 'Suspicion de syndrome HELLP'
-        analysis['overall']['recommendations'] = [
-            'Consultation obstétricale immédiate',
-            'Tension artérielle et protéinurie',
-            'Surveillance fœtale'
-        ]
-    
-    # Set the overall message based on status if not already set
-    if analysis['overall']['status'] != 'normal' and analysis['overall']['message'] == 'Résultats dans les normes':
-        if analysis['overall']['status'] == 'mild':
-            analysis['overall']['message'] = 'Anomalies légères détectées'
-        elif analysis['overall']['status'] == 'warning':
-            analysis['overall']['message'] = 'Anomalies modérées détectées'
-        elif analysis['overall']['status'] == 'critical':
-            analysis['overall']['message'] = 'Anomalies critiques détectées'
-    
-    return analysis
+    return get_rules().analyze_blood_results({
+        'hemoglobin': hemoglobin,
+        'platelets': platelets,
+        'ferritin': ferritin,
+        'hematocrit': hematocrit,
+        'ldh': ldh,
+        'alt': alt,
+        'ast': ast
+    })
 
 def evaluate_blood_pressure(systolic, diastolic):
     """
@@ -268,67 +157,15 @@ def evaluate_blood_pressure(systolic, diastolic):
     Returns:
         dict: Evaluation and recommendations
     """
-    result = {
+    classification = get_rules().classify_blood_pressure(systolic, diastolic)
+
+    return {
         'systolic': systolic,
         'diastolic': diastolic,
-        'status': 'normal',
-        'message': 'Tension artérielle normale',
-        'recommendations': []
+        'status': classification.status,
+        'message': classification.message,
+        'recommendations': list(classification.recommendations)
     }
-    
-    # Critical hypertension (severe)
-    if systolic >= 160 or diastolic >= 110:
-        result['status'] = 'critical'
-        result['message'] = 'CRISE HYPERTENSIVE → URGENCE'
-        result['recommendations'] = [
-            'Transfert immédiat en milieu hospitalier',
-            'Bilan prééclampsie complet',
-            'Surveillance fœtale',
-            'Traitement antihypertenseur parentéral à envisager'
-        ]
-    
-    # Moderate hypertension
-    elif (systolic >= 150 and systolic < 160) or (diastolic >= 100 and diastolic < 110):
-        result['status'] = 'warning'
-        result['message'] = 'HTA modérée → Contrôle rapide'
-        result['recommendations'] = [
-            'Contrôle dans la journée',
-            'Recherche de protéinurie',
-            'Surveillance des signes fonctionnels de prééclampsie',
-            'Consultation obstétricale si persistance'
-        ]
-    
-    # Mild hypertension
-    elif (systolic >= 140 and systolic < 150) or (diastolic >= 90 and diastolic < 100):
-        result['status'] = 'mild'
-        result['message'] = 'HTA légère → Surveillance'
-        result['recommendations'] = [
-            'Contrôle dans les 24h',
-            'Repos et position latérale gauche',
-            'Recherche de protéinurie'
-        ]
-    
-    # Elevated (borderline)
-    elif (systolic >= 130 and systolic < 140) or (diastolic >= 80 and diastolic < 90):
-        result['status'] = 'elevated'
-        result['message'] = 'Tension artérielle élevée'
-        result['recommendations'] = [
-            'Surveillance à la prochaine consultation',
-            'Conseils hygiéno-diététiques (limiter sel, repos)',
-            'Auto-surveillance si possible'
-        ]
-    
-    # Low blood pressure
-    elif systolic < 90 or diastolic < 60:
-        result['status'] = 'low'
-        result['message'] = 'Tension artérielle basse'
-        result['recommendations'] = [
-            'Hydratation suffisante',
-            'Position latérale gauche en cas de malaise',
-            'Lever progressif'
-        ]
-    
-    return result
 
 def get_ultrasound_reference_data():
     """
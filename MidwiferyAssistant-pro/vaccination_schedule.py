@@ -0,0 +1,259 @@
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy import select
+
+from app import db
+from models import BabyRecord, Patient, VaccinationRecord
+from patient_index import normalize_name
+from versioning import current_version
+
+# Series key -> (label shown to the midwife, vaccine names that count as a dose)
+# A combined vaccine (pentavalent) counts for every series it contains.
+VACCINES = {
+    'vitamin_k': ('Vitamine K', ('vitamin k', 'vitamine k', 'vit k')),
+    'bcg': ('BCG', ('bcg',)),
+    'hepatitis_b': ('Hépatite B', ('hepatitis b', 'hepatite b', 'vhb', 'hbv')),
+    'polio': ('VPO (Polio oral)', ('vpo', 'polio', 'opv', 'vpi', 'ipv')),
+    'dtp': ('DTCoq', ('dtcoq', 'dtc', 'dtp', 'pentavalent', 'penta')),
+    'hib': ('Hib', ('hib', 'pentavalent', 'penta')),
+    'pcv': ('PCV (Pneumocoque)', ('pcv', 'pcv13', 'pneumocoque')),
+    'rotavirus': ('Rotavirus', ('rotavirus', 'rota')),
+    'measles': ('Rougeole', ('measles', 'rougeole', 'mmr', 'ror', 'rr')),
+    'yellow_fever': ('Fièvre jaune', ('yellow fever', 'fievre jaune', 'vaa')),
+}
+
+# One dose of a series: recommended age, days after which it is overdue,
+# age after which it must no longer be given (None: catch-up at any age) and
+# minimum days since the previous dose of the series. Ages in days.
+ScheduledDose = namedtuple('ScheduledDose', 'series dose age grace max_age interval')
+
+# Expanded Programme on Immunization (WHO), doses in series order
+SCHEDULE = (
+    ScheduledDose('vitamin_k', 1, 0, 1, 28, 0),
+    ScheduledDose('bcg', 1, 0, 28, 365, 0),
+    ScheduledDose('hepatitis_b', 1, 0, 1, 14, 0),
+    ScheduledDose('polio', 0, 0, 14, 14, 0),
+    ScheduledDose('polio', 1, 42, 28, None, 28),
+    ScheduledDose('polio', 2, 70, 28, None, 28),
+    ScheduledDose('polio', 3, 98, 28, None, 28),
+    ScheduledDose('dtp', 1, 42, 28, None, 28),
+    ScheduledDose('dtp', 2, 70, 28, None, 28),
+    ScheduledDose('dtp', 3, 98, 28, None, 28),
+    ScheduledDose('hib', 1, 42, 28, None, 28),
+    ScheduledDose('hib', 2, 70, 28, None, 28),
+    ScheduledDose('hib', 3, 98, 28, None, 28),
+    ScheduledDose('pcv', 1, 42, 28, None, 28),
+    ScheduledDose('pcv', 2, 70, 28, None, 28),
+    ScheduledDose('pcv', 3, 98, 28, None, 28),
+    ScheduledDose('rotavirus', 1, 42, 28, 105, 0),
+    ScheduledDose('rotavirus', 2, 70, 28, 224, 28),
+    ScheduledDose('measles', 1, 270, 30, None, 0),
+    ScheduledDose('measles', 2, 450, 60, None, 28),
+    ScheduledDose('yellow_fever', 1, 270, 30, None, 0),
+)
+
+STATUSES = ('overdue', 'due', 'upcoming', 'missed')
+
+# Doses due within this many days are listed as upcoming
+UPCOMING_DAYS = 14
+
+# Babies older than this have no dose left to schedule and are not read
+MAX_SCHEDULE_AGE_DAYS = 3 * 365
+
+# Midwives whose schedule is kept in memory (least recently used are dropped)
+SCHEDULE_CACHE_USERS = 256
+
+_series_by_name = {}
+for _series, (_label, _names) in VACCINES.items():
+    for _name in _names:
+        _series_by_name.setdefault(_name, []).append(_series)
+
+_doses_by_series = OrderedDict()
+for _dose in SCHEDULE:
+    _doses_by_series.setdefault(_dose.series, []).append(_dose)
+
+_schedules = OrderedDict()
+_schedules_lock = threading.Lock()
+
+
+def vaccine_series(vaccine_name):
+    """
+    Find the schedule series a recorded vaccine counts for.
+
+    Args:
+        vaccine_name (str): Name as entered ("VPO", "Pentavalent", "Vitamine K"...)
+
+    Returns:
+        list: Series keys of VACCINES, empty for a vaccine outside the schedule
+    """
+    return _series_by_name.get(normalize_name(vaccine_name), [])
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _series_status(doses, birth, given, today):
+    # Match the doses given, in date order, to the slots of the series. The
+    # first open slot stops the series: later doses wait for it. A slot whose
+    # window has closed is skipped once a later dose was given anyway, and
+    # otherwise reported as missed; a series is never started late, except
+    # after a missed dose 0 (supplementary birth dose)
+    given = iter(given)
+    pending = next(given, None)
+    previous = None
+    results = []
+    for dose in doses:
+        if pending is not None and (dose.max_age is None or (pending - birth).days <= dose.max_age):
+            previous, pending = pending, next(given, None)
+            continue
+
+        due = birth + timedelta(days=dose.age)
+        if previous is not None:
+            due = max(due, previous + timedelta(days=dose.interval))
+        overdue = due + timedelta(days=dose.grace)
+        closes = birth + timedelta(days=dose.max_age) if dose.max_age is not None else None
+
+        if closes is not None and (today > closes or pending is not None):
+            if pending is not None:
+                continue
+            results.append((dose, 'missed', due, overdue, closes))
+            if dose.dose == 0:
+                continue
+            break
+        if today >= overdue:
+            results.append((dose, 'overdue', due, overdue, closes))
+        elif today >= due:
+            results.append((dose, 'due', due, overdue, closes))
+        elif (due - today).days <= UPCOMING_DAYS:
+            results.append((dose, 'upcoming', due, overdue, closes))
+        break
+    return results
+
+
+def compute_schedule(rows, today):
+    """
+    Compute the open doses of every baby from their vaccination history.
+
+    Args:
+        rows (iterable): (baby_id, first_name, last_name, birth_date, mother_id,
+            mother_name, vaccine_name, date_administered) sorted by baby,
+            vaccine columns None for a baby without any vaccination
+        today (date): Day the statuses are computed for
+
+    Returns:
+        list: Dicts per open dose (baby, vaccine, dose, status and dates), most urgent first
+    """
+    results = []
+    for _, baby_rows in groupby(rows, key=lambda row: row[0]):
+        baby_rows = list(baby_rows)
+        baby_id, first_name, last_name, birth_date, mother_id, mother_name = baby_rows[0][:6]
+        birth = _as_date(birth_date)
+
+        given = {}
+        for row in baby_rows:
+            if row[6] is None or row[7] is None:
+                continue
+            for series in vaccine_series(row[6]):
+                given.setdefault(series, []).append(_as_date(row[7]))
+
+        baby = {'baby_id': baby_id, 'baby_name': ' '.join(filter(None, (first_name, last_name))) or 'Bébé',
+                'mother_id': mother_id, 'mother_name': mother_name}
+        for series, doses in _doses_by_series.items():
+            for dose, status, due, overdue, closes in _series_status(doses, birth, sorted(given.get(series, ())), today):
+                results.append({**baby, 'series': series, 'vaccine': VACCINES[series][0], 'dose': dose.dose,
+                                'status': status, 'due_date': due, 'overdue_date': overdue, 'window_closes': closes})
+
+    results.sort(key=lambda item: (STATUSES.index(item['status']), item['due_date'], item['baby_id']))
+    return results
+
+
+def _load_rows(user_id, today):
+    # One query for the whole caseload: babies of the midwife's patients with
+    # their vaccinations, in baby order for grouping
+    return db.session.execute(
+        select(BabyRecord.id, BabyRecord.first_name, BabyRecord.last_name, BabyRecord.birth_date,
+               BabyRecord.mother_id, (Patient.last_name + ' ' + Patient.first_name).label('mother_name'),
+               VaccinationRecord.vaccine_name, VaccinationRecord.date_administered)
+        .join(Patient, Patient.id == BabyRecord.mother_id)
+        .outerjoin(VaccinationRecord, VaccinationRecord.baby_id == BabyRecord.id)
+        .where(Patient.user_id == user_id,
+               BabyRecord.birth_date >= datetime.combine(today - timedelta(days=MAX_SCHEDULE_AGE_DAYS),
+                                                         datetime.min.time()))
+        .order_by(BabyRecord.id, VaccinationRecord.date_administered)
+    ).all()
+
+
+def get_vaccination_schedule(user_id, today=None):
+    """
+    Get the open doses of all of a midwife's babies, computed once per day
+    and again whenever a baby or vaccination of the midwife changes.
+
+    Args:
+        user_id (int): Midwife
+        today (date, optional): Day the statuses are computed for
+
+    Returns:
+        list: Dicts per open dose, most urgent first (see compute_schedule)
+    """
+    today = today or date.today()
+    stamp = (today, current_version(user_id, 'babies'), current_version(user_id, 'vaccinations'))
+    with _schedules_lock:
+        cached = _schedules.get(user_id)
+        if cached is not None and cached[0] == stamp:
+            _schedules.move_to_end(user_id)
+            return cached[1]
+
+    schedule = compute_schedule(_load_rows(user_id, today), today)
+    with _schedules_lock:
+        _schedules[user_id] = (stamp, schedule)
+        _schedules.move_to_end(user_id)
+        while len(_schedules) > SCHEDULE_CACHE_USERS:
+            _schedules.popitem(last=False)
+    return schedule
+
+
+_PRIORITIES = {'overdue': 'high', 'due': 'normal', 'upcoming': 'low'}
+
+
+def vaccination_reminders(user_id, today=None):
+    """
+    Reminders for the doses due, overdue or coming up, shaped like stored
+    PostnatalCareReminder rows so that both lists can be shown together.
+
+    They are never completed by hand: recording the vaccination removes them.
+
+    Args:
+        user_id (int): Midwife
+        today (date, optional): Day the statuses are computed for
+
+    Returns:
+        list: Reminder dicts, most urgent first
+    """
+    reminders = []
+    for item in get_vaccination_schedule(user_id, today):
+        if item['status'] not in _PRIORITIES:
+            continue
+        if item['status'] == 'overdue':
+            description = f"En retard depuis le {item['overdue_date'].strftime('%d/%m/%Y')}"
+        elif item['status'] == 'due':
+            description = f"À administrer avant le {item['overdue_date'].strftime('%d/%m/%Y')}"
+        else:
+            description = f"Prévue le {item['due_date'].strftime('%d/%m/%Y')}"
+        reminders.append({
+            'id': f"vaccination-{item['baby_id']}-{item['series']}-{item['dose']}",
+            'source': 'vaccination',
+            'title': f"Vaccination {item['vaccine']} (dose {item['dose']})",
+            'description': description,
+            'reminder_date': item['due_date'],
+            'reminder_type': 'baby',
+            'priority': _PRIORITIES[item['status']],
+            'completed': False,
+            'patient_id': item['mother_id'],
+            'baby_id': item['baby_id'],
+            'baby_name': item['baby_name'],
+        })
+    return reminders
@@ -0,0 +1,191 @@
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+from flask_login import current_user
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app import db
+from models import (Patient, BabyRecord, DataVersion, DeliveryRecord, VaccinationRecord, get_owner_id,
+                    get_previous_owner_id)
+from serializers import negotiate_mimetype
+
+# Maximum number of serialized bodies kept in memory per process
+BODY_CACHE_SIZE = 512
+
+# Model -> collections whose payload includes rows of that model
+_tracked = {}
+
+_bodies = OrderedDict()
+_bodies_lock = threading.Lock()
+
+
+def track(model, *collections):
+    """
+    Register the collections that must be invalidated when a model changes.
+
+    Args:
+        model (db.Model): Model class whose writes change the collections
+        collections (str): Names of the cached collections
+    """
+    _tracked.setdefault(model, set()).update(collections)
+
+
+def current_version(user_id, collection):
+    """
+    Get the current data version of a user's collection.
+
+    Versions are stored in the database, next to the data, so that every
+    worker process and every host sees the writes made by the others.
+
+    Args:
+        user_id (int): Owner of the data
+        collection (str): Collection name
+
+    Returns:
+        int: Version counter, increased on every committed write
+    """
+    version = db.session.execute(
+        select(DataVersion.version).where(DataVersion.user_id == user_id, DataVersion.collection == collection)
+    ).scalar()
+    return version or 0
+
+
+def bump(connection, user_id, collection):
+    """
+    Mark a collection of a user as changed, in the transaction of the write.
+
+    Args:
+        connection (Connection): Connection of the transaction making the write
+        user_id (int): Owner of the data
+        collection (str): Collection name
+
+    Returns:
+        int: New version of the collection
+    """
+    table = DataVersion.__table__
+    version = connection.execute(
+        table.update()
+        .where(table.c.user_id == user_id, table.c.collection == collection)
+        .values(version=table.c.version + 1)
+        .returning(table.c.version)
+    ).scalar()
+    if version is None:
+        version = 1
+        connection.execute(table.insert().values(user_id=user_id, collection=collection, version=version))
+    return version
+
+
+def transaction_versions(session):
+    """
+    Get the collections bumped by the session's current transaction.
+
+    Args:
+        session (Session): Session, e.g. in an after_commit listener
+
+    Returns:
+        dict: (user_id, collection) -> (version before the transaction, version after it)
+    """
+    return session.info.get('data_versions', {})
+
+
+def make_etag(user_id, collection, version, mimetype):
+    return f"{user_id}-{collection}-{version}-{mimetype.rsplit('/', 1)[-1]}"
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changed = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        collections = _tracked.get(type(obj))
+        if not collections:
+            continue
+        connection = session.connection()
+        # A record moved to another midwife changes both users' collections
+        for user_id in (get_owner_id(connection, obj), get_previous_owner_id(connection, obj)):
+            if user_id is None:
+                continue
+            for collection in collections:
+                changed.add((user_id, collection))
+    if not changed:
+        return
+
+    # Bumped in the same transaction as the write: the new version becomes
+    # visible to other processes exactly when the data does
+    versions = session.info.setdefault('data_versions', {})
+    connection = session.connection()
+    for key in sorted(changed):
+        version = bump(connection, *key)
+        versions[key] = (versions[key][0] if key in versions else version - 1, version)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _forget_changes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('data_versions', None)
+
+
+def _get_body(key):
+    with _bodies_lock:
+        body = _bodies.get(key)
+        if body is not None:
+            _bodies.move_to_end(key)
+        return body
+
+
+def _store_body(key, body):
+    with _bodies_lock:
+        _bodies[key] = body
+        _bodies.move_to_end(key)
+        while len(_bodies) > BODY_CACHE_SIZE:
+            _bodies.popitem(last=False)
+
+
+def versioned_json(collection):
+    """
+    Decorator adding conditional GET support to a per-user JSON endpoint.
+
+    The ETag is derived from the user's collection version, so a matching
+    If-None-Match is answered with 304 before the view runs. Serialized
+    bodies are cached by (user, collection, version, format).
+
+    Args:
+        collection (str): Name of the collection served by the view
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user_id = current_user.id
+            # Read the version before querying: a concurrent write can only
+            # make the cached body newer than its key, never older.
+            version = current_version(user_id, collection)
+            mimetype = negotiate_mimetype()
+            etag = make_etag(user_id, collection, version, mimetype)
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                key = (user_id, collection, version, mimetype)
+                body = _get_body(key)
+                if body is None:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    body = response.get_data()
+                    _store_body(key, body)
+                response = current_app.response_class(body, mimetype=mimetype)
+
+            response.set_etag(etag)
+            response.vary.add('Accept')
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+track(Patient, 'patients', 'babies', 'deliveries')
+track(BabyRecord, 'babies')
+track(DeliveryRecord, 'deliveries')
+track(VaccinationRecord, 'vaccinations')
@@ -0,0 +1,408 @@
+import fcntl
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from flask import current_app
+from sqlalchemy import and_, delete, func, insert, or_, select
+
+from app import db
+from jobs import register_periodic, register_task
+from models import BloodPressureRecord, Patient, PostnatalCheckup, VitalsBlock
+from sharding import set_tenant, tenant_ids
+
+# Readings per block: a chart of several months reads a handful of blocks
+BLOCK_READINGS = 4096
+
+FORMAT_VERSION = 1
+
+# Stored in place of NULL in the int16 value columns
+NULL_VALUE = -32768
+
+LOCK_FILE = 'vitals_archive.lock'
+
+# Readings and seconds spent reading them, per series and tier, in this process
+_scan_stats = {}
+_scan_stats_lock = threading.Lock()
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_HEADER = struct.Struct('<HI')
+
+# A series of readings that can be archived:
+#   times: datetime columns, the first one orders the readings
+#   values: (column, scale) stored as round(value * scale) in int16
+#   scope: condition on the table selecting the rows of the series, or None
+#   archivable: condition on the table of the rows that may be archived
+#   constants: values of the other columns in every archivable row
+Series = namedtuple('Series', 'model times values scope archivable constants')
+
+
+def _blank(table, *columns):
+    return and_(*[or_(table.c[column].is_(None), table.c[column] == '') for column in columns])
+
+
+_POSTNATAL_TEXT = ('symptoms', 'physical_exam', 'recommendations', 'medications', 'notes')
+
+SERIES = {
+    # Readings without notes (the notes stay searchable in the hot table)
+    'blood_pressure': Series(
+        BloodPressureRecord, ('recorded_at',),
+        (('systolic', 1), ('diastolic', 1), ('heart_rate', 1)),
+        None,
+        lambda table: _blank(table, 'notes'),
+        {'notes': None}),
+    # The mother's vitals-only checkups; examinations with findings stay in
+    # the table, and babies' weighings are read by the growth charts
+    'postnatal': Series(
+        PostnatalCheckup, ('checkup_date', 'created_at'),
+        (('temperature', 10), ('heart_rate', 1), ('blood_pressure_systolic', 1),
+         ('blood_pressure_diastolic', 1), ('respiratory_rate', 1), ('weight', 100)),
+        lambda table: table.c.checkup_type == 'mother',
+        lambda table: and_(table.c.checkup_type == 'mother', table.c.baby_id.is_(None),
+                           table.c.next_checkup_date.is_(None), _blank(table, *_POSTNATAL_TEXT)),
+        {'checkup_type': 'mother', 'baby_id': None, 'next_checkup_date': None,
+         **{column: None for column in _POSTNATAL_TEXT}}),
+}
+
+
+def _to_int16(value, scale):
+    # None if the value would not come back identical
+    if value is None:
+        return NULL_VALUE
+    scaled = value * scale
+    stored = round(scaled)
+    if abs(scaled - stored) > 1e-6 or not NULL_VALUE < stored <= 32767:
+        return None
+    return stored
+
+
+def _micros(moment):
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def _pack(typecode, values):
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack(typecode, data, offset, count):
+    values = array(typecode)
+    end = offset + values.itemsize * count
+    values.frombytes(data[offset:end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, end
+
+
+def _deltas(values):
+    return [values[0]] + [b - a for a, b in zip(values, values[1:])]
+
+
+def encode_block(series, rows):
+    """
+    Encode readings column by column and compress them.
+
+    Ids and timestamps (microseconds) are stored as deltas from the previous
+    reading, which are small and repetitive for regular measurements; values
+    are int16. Decoding gives back exactly the original rows.
+
+    Args:
+        series (Series): Series of the readings
+        rows (list): Rows (or dicts) ordered by time, all encodable
+
+    Returns:
+        tuple: (compressed bytes, size before compression)
+    """
+    parts = [_HEADER.pack(FORMAT_VERSION, len(rows)),
+             _pack('q', _deltas([row['id'] for row in rows]))]
+    for column in series.times:
+        parts.append(_pack('q', _deltas([_micros(row[column]) for row in rows])))
+    parts.append(_pack('q', [row['patient_id'] for row in rows[:1]]))
+    parts.append(_pack('i', [row['user_id'] for row in rows]))
+    for column, scale in series.values:
+        parts.append(_pack('h', [_to_int16(row[column], scale) for row in rows]))
+    raw = b''.join(parts)
+    return zlib.compress(raw, 9), len(raw)
+
+
+def decode_block(series, data):
+    """
+    Decode the readings of a block.
+
+    Args:
+        series (Series): Series of the block
+        data (bytes): Compressed block, as made by encode_block
+
+    Returns:
+        list: Readings as dicts with every column of the table, oldest first
+    """
+    raw = zlib.decompress(data)
+    version, count = _HEADER.unpack_from(raw)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Format de bloc inconnu : {version}")
+    offset = _HEADER.size
+
+    deltas, offset = _unpack('q', raw, offset, count)
+    columns = {'id': list(accumulate(deltas))}
+    for column in series.times:
+        deltas, offset = _unpack('q', raw, offset, count)
+        columns[column] = [_EPOCH + micros * _MICROSECOND for micros in accumulate(deltas)]
+    (patient_id,), offset = _unpack('q', raw, offset, 1)
+    columns['user_id'], offset = _unpack('i', raw, offset, count)
+    for column, scale in series.values:
+        values, offset = _unpack('h', raw, offset, count)
+        if scale == 1:
+            columns[column] = [None if value == NULL_VALUE else value for value in values]
+        else:
+            columns[column] = [None if value == NULL_VALUE else value / scale for value in values]
+
+    names = list(columns)
+    readings = []
+    for values in zip(*columns.values()):
+        reading = dict(series.constants)
+        reading.update(zip(names, values))
+        reading['patient_id'] = patient_id
+        readings.append(reading)
+    return readings
+
+
+def _encodable(series, row):
+    return all(_to_int16(row[column], scale) is not None for column, scale in series.values)
+
+
+@contextmanager
+def _archive_lock(app):
+    # Only one process archives at a time, whatever the number of workers
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, LOCK_FILE), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _archive_series(name, series, cutoff, stats):
+    table = series.model.__table__
+    order = table.c[series.times[0]]
+    candidates = and_(order < cutoff, table.c.patient_id.isnot(None), series.archivable(table),
+                      *[table.c[column].isnot(None) for column in series.times])
+
+    patient_ids = db.session.execute(select(table.c.patient_id).where(candidates).distinct()).scalars().all()
+    for patient_id in patient_ids:
+        rows = db.session.execute(select(table).where(candidates, table.c.patient_id == patient_id)
+                                  .order_by(order, table.c.id)).mappings().all()
+        rows = [row for row in rows if _encodable(series, row)]
+        for start in range(0, len(rows), BLOCK_READINGS):
+            chunk = rows[start:start + BLOCK_READINGS]
+            data, raw_size = encode_block(series, chunk)
+            db.session.execute(insert(VitalsBlock.__table__).values(
+                patient_id=patient_id, series=name, first_at=chunk[0][series.times[0]],
+                last_at=chunk[-1][series.times[0]], count=len(chunk), raw_size=raw_size,
+                data=data, created_at=datetime.utcnow()))
+            # Core statement: archiving is not a deletion for the sync log,
+            # the rollups or the search index
+            db.session.execute(delete(table).where(table.c.id.in_([row['id'] for row in chunk])))
+            stats['readings'] += len(chunk)
+            stats['blocks'] += 1
+            stats['bytes'] += len(data)
+        # One transaction per patient: blocks and row deletions together
+        db.session.commit()
+
+
+def archive_old_vitals(app, now=None):
+    """
+    Compact readings older than VITALS_ARCHIVE_AGE_DAYS into per-patient
+    columnar blocks and remove them from the row tables.
+
+    Rows with free text, and values that int16 cannot store exactly, are
+    left in place.
+
+    Archived readings are read-only: their rows no longer exist, so they
+    cannot be edited or deleted by id. read_vitals and archived_readings
+    (used by the sync snapshot) read them back.
+
+    Args:
+        app (Flask): Application, for configuration and context
+        now (datetime, optional): Reference time, defaults to utcnow
+
+    Returns:
+        dict: Number of readings and blocks written, compressed bytes
+    """
+    age_days = app.config.get('VITALS_ARCHIVE_AGE_DAYS', 180)
+    cutoff = (now or datetime.utcnow()) - timedelta(days=age_days)
+    stats = {'readings': 0, 'blocks': 0, 'bytes': 0}
+
+    with _archive_lock(app):
+        for tenant in [None] + tenant_ids():
+            with app.app_context():
+                set_tenant(tenant)
+                for name, series in SERIES.items():
+                    _archive_series(name, series, cutoff, stats)
+                db.session.remove()
+
+    if stats['readings']:
+        logging.info("%d mesures archivées en %d blocs (%d octets)",
+                     stats['readings'], stats['blocks'], stats['bytes'])
+    return stats
+
+
+def _archive_task(user_id, payload, progress):
+    return archive_old_vitals(current_app._get_current_object())
+
+
+register_task('vitals_archive', _archive_task)
+
+
+def read_vitals(patient_id, series_name, start=None, end=None, limit=None):
+    """
+    Read a patient's readings from the row table and the archived blocks.
+
+    Args:
+        patient_id (int): Patient, whose ownership has been checked
+        series_name (str): Key of SERIES
+        start (datetime, optional): Inclusive lower bound
+        end (datetime, optional): Exclusive upper bound
+        limit (int, optional): Maximum number of readings
+
+    Returns:
+        list: Readings as dicts with every column of the table, most recent first
+    """
+    series = SERIES[series_name]
+    table = series.model.__table__
+    time_column = series.times[0]
+    order = table.c[time_column]
+
+    started = time.perf_counter()
+    query = select(table).where(table.c.patient_id == patient_id, order.isnot(None))
+    if series.scope is not None:
+        query = query.where(series.scope(table))
+    if start:
+        query = query.where(order >= start)
+    if end:
+        query = query.where(order < end)
+    query = query.order_by(order.desc(), table.c.id.desc())
+    if limit:
+        query = query.limit(limit)
+    readings = [dict(row) for row in db.session.execute(query).mappings()]
+    rows_done = time.perf_counter()
+
+    blocks = select(VitalsBlock.data, VitalsBlock.last_at).where(
+        VitalsBlock.patient_id == patient_id, VitalsBlock.series == series_name)
+    if start:
+        blocks = blocks.where(VitalsBlock.last_at >= start)
+    if end:
+        blocks = blocks.where(VitalsBlock.first_at < end)
+
+    archived = []
+    for data, last_at in db.session.execute(blocks.order_by(VitalsBlock.last_at.desc())):
+        if limit and len(readings) + len(archived) >= limit:
+            # Stop once older blocks cannot reach the most recent readings
+            newest = sorted(readings + archived, key=lambda r: (r[time_column], r['id']), reverse=True)
+            if last_at < newest[limit - 1][time_column]:
+                break
+        archived.extend(reading for reading in decode_block(series, data)
+                        if (not start or reading[time_column] >= start) and (not end or reading[time_column] < end))
+    _record_scan(series_name, len(readings), rows_done - started, len(archived), time.perf_counter() - rows_done)
+
+    if not archived:
+        return readings
+    # A reading is in one place only, but two archivers racing on the same
+    # rows must not show it twice
+    seen = set()
+    merged = []
+    for reading in sorted(readings + archived, key=lambda r: (r[time_column], r['id']), reverse=True):
+        if reading['id'] not in seen:
+            seen.add(reading['id'])
+            merged.append(reading)
+    return merged[:limit] if limit else merged
+
+
+def archived_readings(series_name, user_id):
+    """
+    Read every archived reading of a series recorded by a midwife.
+
+    Args:
+        series_name (str): Key of SERIES
+        user_id (int): Midwife; blocks of their patients are read
+
+    Returns:
+        list: Readings as dicts with every column of the table
+    """
+    series = SERIES[series_name]
+    blocks = db.session.execute(
+        select(VitalsBlock.data).join(Patient, Patient.id == VitalsBlock.patient_id)
+        .where(Patient.user_id == user_id, VitalsBlock.series == series_name)
+        .order_by(VitalsBlock.patient_id, VitalsBlock.first_at)
+    ).scalars()
+    return [reading for data in blocks for reading in decode_block(series, data)
+            if reading['user_id'] == user_id]
+
+
+def _record_scan(series_name, rows, rows_seconds, archived, archived_seconds):
+    with _scan_stats_lock:
+        stats = _scan_stats.setdefault(series_name, {'rows': [0, 0.0], 'archived': [0, 0.0]})
+        stats['rows'][0] += rows
+        stats['rows'][1] += rows_seconds
+        stats['archived'][0] += archived
+        stats['archived'][1] += archived_seconds
+
+
+def vitals_scan_stats():
+    """
+    Compare the time spent reading hot rows and archived blocks.
+
+    Counted by read_vitals in this worker process.
+
+    Returns:
+        dict: Per series and tier ('rows', 'archived'): readings read, total
+        milliseconds and microseconds per reading
+    """
+    with _scan_stats_lock:
+        return {
+            series_name: {
+                tier: {'readings': readings, 'ms': round(seconds * 1000, 1),
+                       'us_per_reading': round(seconds * 1e6 / readings, 2) if readings else None}
+                for tier, (readings, seconds) in stats.items()
+            }
+            for series_name, stats in _scan_stats.items()
+        }
+
+
+def vitals_storage_stats():
+    """
+    Compare the archived readings with their uncompressed encoding.
+
+    Returns:
+        dict: Per series: blocks, readings, compressed and raw bytes
+    """
+    rows = db.session.execute(select(
+        VitalsBlock.series, func.count(), func.sum(VitalsBlock.count),
+        func.sum(func.length(VitalsBlock.data)), func.sum(VitalsBlock.raw_size)
+    ).group_by(VitalsBlock.series))
+    return {series: {'blocks': blocks, 'readings': readings, 'bytes': compressed, 'raw_bytes': raw}
+            for series, blocks, readings, compressed, raw in rows}
+
+
+def init_vitals_archive(app):
+    """
+    Have the job runners archive old readings periodically.
+
+    The interval comes from VITALS_ARCHIVE_INTERVAL (seconds, 0 disables it).
+
+    Args:
+        app (Flask): Application
+    """
+    register_periodic('vitals_archive', app.config.get('VITALS_ARCHIVE_INTERVAL', 86400))